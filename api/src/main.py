@@ -4,11 +4,26 @@
 ##                                  LIBRARIES                                 ##
 ################################################################################
 
+################
+##  BUILT-IN  ##
+################
+
+from datetime import datetime, timedelta, timezone
+from typing import Callable
+
+
 ################
 ##  INTERNAL  ##
 ################
 
-from utils import crud, models, schemas
+from utils import binary, crud, link, models, schemas, series
+from utils.admission import admission
+from utils.cache import TTLCache
+from utils.registry import registry
+from utils.replicas import replicas
+from utils.replication import replicator
+from utils.shards import shards
+from utils.webhooks import dispatcher
 from utils.database import SessionLocal, engine
 
 
@@ -16,7 +31,7 @@ from utils.database import SessionLocal, engine
 ##  EXTERNAL  ##
 ################
 
-from fastapi import Depends, FastAPI, HTTPException, Query, status
+from fastapi import BackgroundTasks, Depends, FastAPI, HTTPException, Query, Request, status
 from mangum import Mangum
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
@@ -35,27 +50,89 @@ app = FastAPI(
 
 handler = Mangum(app=app)
 
+# Dashboard snapshots are fine to serve a few seconds stale
+overview_cache = TTLCache(ttl=10)
+
+# Fleet health comes from hourly rollups, it barely moves within a minute
+fleet_cache = TTLCache(ttl=60)
+
+# Longest window of the fleet health endpoints
+MAX_HEALTH_HOURS = 24 * 90
+
+# Maximum number of records in a single batch upload
+MAX_BATCH_SIZE = 1000
+
 
 
 ################################################################################
 ##                                 CONNECTION                                 ##
 ################################################################################
 
-models.Base.metadata.create_all(bind=engine)
+for shard_engine in shards.engines:
+  models.Base.metadata.create_all(bind=shard_engine)
+
+# Edge mode: replicate the local database to the central API, see utils/replication.py
+@app.on_event("startup")
+def start_replication():
+  if replicator is not None:
+    replicator.start()
 
 # Dependency
-def get_db():
+def get_db(request: Request):
 
   """
   Create a new database session and yield it to the caller.
 
+  Read-only (GET) requests are served by a read replica whose lag is within
+  `MAX_REPLICA_LAG` seconds, if any, and the others by the primary.
+
+  Parameters
+  ----------
+  request : Request
+    The request, its method selects the database.
+
   Yields
   ------
   Session
     A SQLAlchemy Session object representing a database session.
   """
 
-  db = SessionLocal()
+  replica = replicas.pick() if request.method == "GET" else None
+  db = SessionLocal() if replica is None else SessionLocal(bind=replica)
+
+  try:
+    yield db
+  finally:
+    db.close()
+
+
+def get_collector_db(collector_id: int, request: Request):
+
+  """
+  Create a new database session on the shard of a collector and yield it to the caller.
+
+  Without shards it is the session of `get_db`. With shards it is always a session on
+  the shard itself: the read replicas replicate the first shard only, so reads of
+  collectors do not go to them.
+
+  Parameters
+  ----------
+  collector_id : int
+    The ID of the collector of the route.
+  request : Request
+    The request, its method selects the database.
+
+  Yields
+  ------
+  Session
+    A SQLAlchemy Session object representing a database session.
+  """
+
+  if not shards.sharded:
+    yield from get_db(request)
+    return
+
+  db = shards.session(shards.index(collector_id))
 
   try:
     yield db
@@ -68,6 +145,171 @@ def get_db():
 ##                                    ROUTES                                  ##
 ################################################################################
 
+#############
+##  UTILS  ##
+#############
+
+async def read_binary(request: Request, record_size: int) -> bytes:
+
+  """
+  Read the body of a binary upload, decompressing it if it is gzip encoded.
+
+  Parameters
+  ----------
+  request : Request
+    The request, its body holds the packed records.
+  record_size : int
+    The size of a single record, in bytes.
+
+  Returns
+  -------
+  bytes
+    The packed records.
+
+  Raises
+  ------
+  HTTPException
+    If the body is not valid gzip or has more than `MAX_BATCH_SIZE` records.
+  """
+
+  data = await request.body()
+  max_size = MAX_BATCH_SIZE * record_size
+
+  # Edge gateways replicate compressed batches, the decompression stops past the limit
+  if request.headers.get("Content-Encoding") == "gzip":
+    try:
+      data = binary.decompress(data, max_size + 1)
+    except ValueError as e:
+      raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
+
+  if len(data) > max_size:
+    raise HTTPException(
+      status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+      detail=f"A batch can have at most {MAX_BATCH_SIZE} records"
+    )
+
+  return data
+
+
+def admit_ingest(request: Request, db: Session, records: int, batch: bool = False):
+
+  """
+  Admit an ingest request, or send it back to be retried later.
+
+  The receptor is identified by its `X-Receptor-Id` header, or by its address.
+
+  Parameters
+  ----------
+  request : Request
+    The ingest request.
+  db : Session
+    The database session of the request.
+  records : int
+    The number of records in the request.
+  batch : bool, optional
+    If the records go to every shard through `ingest_on_shard`, which takes the
+    ingest slots of the shards. Defaults to False.
+
+  Raises
+  ------
+  HTTPException
+    With status 429 and a Retry-After header if the receptor sends faster than its
+    rate or every ingest slot is taken. The receptor keeps the records meanwhile.
+  """
+
+  receptor = request.headers.get("X-Receptor-Id") or (request.client.host if request.client else "")
+  retry_after = admission.admit(None if batch and shards.sharded else db, receptor, records)
+
+  if retry_after is not None:
+    raise too_many_uploads(retry_after)
+
+
+def too_many_uploads(retry_after: int) -> HTTPException:
+  return HTTPException(
+    status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+    detail="Too many uploads, retry later",
+    headers={"Retry-After": str(retry_after)},
+  )
+
+
+def ingest_on_shard(function: Callable[[Session, list], dict]) -> Callable[[Session, list], dict]:
+
+  """
+  Make a batch function of `shards.scatter` take an ingest slot on its shard first.
+
+  Advisory locks only count the connections of their own database, so with shards
+  every shard has its own ingest slots. Without shards the slot was already taken
+  by `admit_ingest` on the session of the request.
+
+  Raises
+  ------
+  HTTPException
+    With status 429 and a Retry-After header if every slot of a shard is taken. The
+    parts stored on the other shards are counted as duplicated when the batch is retried.
+  """
+
+  if not shards.sharded:
+    return function
+
+  def run(db: Session, items: list) -> dict:
+    retry_after = admission.slot(db)
+    if retry_after is not None:
+      raise too_many_uploads(retry_after)
+    return function(db, items)
+
+  return run
+
+
+def merge_batch_results(results: list[dict]) -> dict:
+
+  """
+  Add up the batch results of the shards.
+  """
+
+  return {
+    "inserted": sum(result["inserted"] for result in results),
+    "duplicated": sum(result["duplicated"] for result in results),
+    "rejected": sum(result["rejected"] for result in results),
+    "unknown": sorted(collector_id for result in results for collector_id in result["unknown"]),
+  }
+
+
+def store_records(db: Session, records: list[tuple[int, datetime, int]]) -> dict:
+
+  """
+  Store batch records on the shards of their collectors.
+
+  Parameters
+  ----------
+  db : Session
+    The database session of the request.
+  records : List[Tuple[int, datetime, int]]
+    The records, as (collector ID, collection date, read humidity) tuples.
+
+  Returns
+  -------
+  Dict[str, int]
+    The number of records inserted, duplicated and rejected.
+
+  Raises
+  ------
+  HTTPException
+    With status 503 if a concurrent upload created the same alert state first. The
+    transaction was rolled back, the batch is stored when it is sent again.
+  """
+
+  try:
+    return merge_batch_results(
+      shards.scatter(db, records, ingest_on_shard(crud.post_collector_record_batch), key=lambda record: record[0])
+    )
+  except IntegrityError:
+    raise HTTPException(
+      status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+      detail="Conflicting concurrent upload, retry later",
+      headers={"Retry-After": "1"},
+    )
+
+
 ############
 ##  ROOT  ##
 ############
@@ -111,7 +353,7 @@ async def get_collector_status(
     A list of CollectorStatusJSON objects representing the most recent status updates for all collectors.
   """
 
-  return crud.get_collector_status(db, offset, limit)
+  return shards.gather(db, lambda db: crud.get_collector_status(db, offset, limit))
 
 
 @app.get(
@@ -124,7 +366,7 @@ async def get_collector_status_by_id(
   collector_id: int,
   offset: int = Query(default=0, ge=0),
   limit: int = Query(default=100, ge=1),
-  db: Session = Depends(get_db),
+  db: Session = Depends(get_collector_db),
 ):
 
   """
@@ -188,7 +430,7 @@ async def get_collector_record(
     A list of CollectorRecordJSON objects representing the most recent records for all collectors.
   """
 
-  return crud.get_collector_record(db, offset, limit)
+  return shards.gather(db, lambda db: crud.get_collector_record(db, offset, limit))
 
 
 @app.get(
@@ -201,7 +443,7 @@ async def get_collector_record_by_id(
   collector_id: int,
   offset: int = Query(default=0, ge=0),
   limit: int = Query(default=100, ge=1),
-  db: Session = Depends(get_db),
+  db: Session = Depends(get_collector_db),
 ):
 
   """
@@ -235,6 +477,100 @@ async def get_collector_record_by_id(
   return collector_record
 
 
+@app.get(
+  path="/collector/{collector_id}/flags",
+  response_model=schemas.CollectorRecordFlagJSON,
+  tags=["Collector"],
+  description="Retrieve the most recent records flagged by the data-quality checks for a specific collector from the database."
+)
+async def get_collector_flags_by_id(
+  collector_id: int,
+  offset: int = Query(default=0, ge=0),
+  limit: int = Query(default=100, ge=1),
+  db: Session = Depends(get_collector_db),
+):
+
+  """
+  Retrieve the most recent records flagged by the data-quality checks for a specific collector from the database.
+
+  Parameters
+  ----------
+  collector_id : int
+    The ID of the collector to retrieve the flagged records for.
+  offset : int, optional
+    The number of records to skip. Defaults to 0.
+  limit : int, optional
+    The maximum number of records to retrieve. Defaults to 100.
+  db : Session, optional
+    The database session. This parameter is automatically injected by FastAPI.
+
+  Returns
+  -------
+  CollectorRecordFlagJSON
+    A CollectorRecordFlagJSON object representing the most recent flagged records for the specified collector.
+
+  Raises
+  ------
+  HTTPException
+    If the specified collector has no flagged records in the database.
+  """
+
+  collector_flags = crud.get_collector_flags_by_id(db, collector_id, offset, limit)
+  if collector_flags is None:
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No flagged records found")
+  return collector_flags
+
+
+@app.get(
+  path="/collector/{collector_id}/season/record",
+  response_model=schemas.CollectorSeasonJSON,
+  tags=["Collector"],
+  description="Retrieve the records of a specific collector during its current or a previous crop season from the database."
+)
+async def get_collector_season_record(
+  collector_id: int,
+  season: int = Query(default=0, ge=0),
+  offset: int = Query(default=0, ge=0),
+  limit: int = Query(default=100, ge=1),
+  db: Session = Depends(get_collector_db),
+):
+
+  """
+  Retrieve the records of a specific collector during its current or a previous crop season from the database.
+
+  Parameters
+  ----------
+  collector_id : int
+    The ID of the collector to retrieve the records for.
+  season : int, optional
+    The season to retrieve, 0 is the current (most recent) crop, 1 the previous one and so on. Defaults to 0.
+  offset : int, optional
+    The number of records to skip. Defaults to 0.
+  limit : int, optional
+    The maximum number of records to retrieve. Defaults to 100.
+  db : Session, optional
+    The database session. This parameter is automatically injected by FastAPI.
+
+  Returns
+  -------
+  CollectorSeasonJSON
+    A CollectorSeasonJSON object with the crop season and its most recent records.
+
+  Raises
+  ------
+  HTTPException
+    If the specified season is not found or has no records in the database.
+  """
+
+  if not registry.is_known(db, collector_id):
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Collector not found")
+
+  collector_season = crud.get_collector_season_record(db, collector_id, season, offset, limit)
+  if collector_season is None:
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No records found for this season")
+  return collector_season
+
+
 @app.get(
   path="/collector/calculated_humidity",
   response_model=list[schemas.CalculatedHumidityJSON],
@@ -265,7 +601,7 @@ async def get_collector_calculated_humidity(
     A list of CalculatedHumidityJSON objects representing the most recent calculated humidity records for all collectors.
   """
 
-  return crud.get_collector_calculated_humidity(db, offset, limit)
+  return shards.gather(db, lambda db: crud.get_collector_calculated_humidity(db, offset, limit))
 
 
 @app.get(
@@ -278,7 +614,7 @@ async def get_collector_calculated_humidity_by_id(
   collector_id: int,
   offset: int = Query(default=0, ge=0),
   limit: int = Query(default=100, ge=1),
-  db: Session = Depends(get_db),
+  db: Session = Depends(get_collector_db),
 ):
   
   """
@@ -312,6 +648,144 @@ async def get_collector_calculated_humidity_by_id(
   return collector_calculated_humidity
 
 
+@app.get(
+  path="/collector/series",
+  response_model=schemas.HumiditySeriesJSON,
+  tags=["Collector"],
+  description="Retrieve the calculated humidity of several collectors resampled onto a shared time axis."
+)
+async def get_collector_series(
+  collector_id: list[int] = Query(min_length=1),
+  start: datetime | None = Query(default=None),
+  end: datetime | None = Query(default=None),
+  resolution: int = Query(default=600, ge=1),
+  db: Session = Depends(get_db),
+):
+
+  """
+  Retrieve the calculated humidity of several collectors resampled onto a shared time axis.
+
+  All the series are loaded with a single query and resampled together, so a
+  whole field can be charted with one request.
+
+  Parameters
+  ----------
+  collector_id : List[int]
+    The IDs of the collectors to retrieve, repeat the parameter for each collector.
+  start : datetime, optional
+    The start of the window. Defaults to 24 hours before `end`.
+  end : datetime, optional
+    The end of the window. Defaults to now.
+  resolution : int, optional
+    The distance between two points of the time axis, in seconds. Defaults to 600.
+  db : Session, optional
+    The database session. This parameter is automatically injected by FastAPI.
+
+  Returns
+  -------
+  HumiditySeriesJSON
+    A HumiditySeriesJSON object with the shared time axis and one series per collector.
+
+  Raises
+  ------
+  HTTPException
+    If the window is empty or has too many points for the given resolution.
+  """
+
+  end = end or datetime.now(timezone.utc)
+  start = start or end - timedelta(days=1)
+
+  # Dates without timezone are assumed to be in UTC
+  start, end = (date if date.tzinfo else date.replace(tzinfo=timezone.utc) for date in (start, end))
+
+  axis = series.time_axis(start, end, resolution)
+  if not 0 < len(axis) <= series.MAX_POINTS:
+    raise HTTPException(
+      status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+      detail=f"The window must have between 1 and {series.MAX_POINTS} points"
+    )
+
+  collector_ids = list(dict.fromkeys(collector_id))
+  rows = [
+    row
+    for rows in shards.scatter(db, collector_ids, lambda db, ids: crud.get_collector_calculated_humidity_window(db, ids, start, end))
+    for row in rows
+  ]
+
+  return {
+    "timestamps": series.axis_dates(axis),
+    "resolution": resolution,
+    "series": [
+      {"collector_id": id, "data": data}
+      for id, data in zip(collector_ids, series.align(rows, collector_ids, axis, resolution))
+    ],
+  }
+
+
+@app.get(
+  path="/crop/{crop}/calculated_humidity",
+  response_model=schemas.CropHumidityJSON,
+  tags=["Crop"],
+  description="Retrieve the calculated humidity aggregated over every collector growing a crop."
+)
+async def get_crop_calculated_humidity(
+  crop: str,
+  start: datetime | None = Query(default=None),
+  end: datetime | None = Query(default=None),
+  resolution: int = Query(default=3600, ge=1),
+  db: Session = Depends(get_db),
+):
+
+  """
+  Retrieve the calculated humidity aggregated over every collector growing a crop.
+
+  Only the readings made while the crop was planted at each collector are taken into account.
+
+  Parameters
+  ----------
+  crop : str
+    The crop to aggregate.
+  start : datetime, optional
+    The start of the window. Defaults to 7 days before `end`.
+  end : datetime, optional
+    The end of the window. Defaults to now.
+  resolution : int, optional
+    The size of the aggregation buckets, in seconds. Defaults to 3600.
+  db : Session, optional
+    The database session. This parameter is automatically injected by FastAPI.
+
+  Returns
+  -------
+  CropHumidityJSON
+    A CropHumidityJSON object with the mean, minimum and maximum humidity per bucket.
+
+  Raises
+  ------
+  HTTPException
+    If the window is empty or has too many buckets for the given resolution.
+  """
+
+  end = end or datetime.now(timezone.utc)
+  start = start or end - timedelta(days=7)
+
+  # Dates without timezone are assumed to be in UTC
+  start, end = (date if date.tzinfo else date.replace(tzinfo=timezone.utc) for date in (start, end))
+
+  if not 0 < (end - start).total_seconds() / resolution <= series.MAX_POINTS:
+    raise HTTPException(
+      status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+      detail=f"The window must have between 1 and {series.MAX_POINTS} buckets"
+    )
+
+  return {
+    "crop": crop,
+    "resolution": resolution,
+    "data": crud.merge_crop_calculated_humidity(shards.fan_out(
+      lambda db: crud.get_crop_calculated_humidity(db, crop, start, end, resolution)
+    )) if shards.sharded else crud.get_crop_calculated_humidity(db, crop, start, end, resolution),
+  }
+
+
 @app.get(
   path="/receptor/status",
   response_model=list[schemas.ReceptorStatus],
@@ -348,6 +822,243 @@ async def get_receptor_status(
   return receptor_status
 
 
+@app.get(
+  path="/overview",
+  response_model=schemas.Overview,
+  tags=["Dashboard"],
+  description="Retrieve a snapshot of every collector and of the receptor in a single request."
+)
+async def get_overview(
+  db: Session = Depends(get_db),
+):
+
+  """
+  Retrieve a snapshot of every collector and of the receptor in a single request.
+
+  The collectors and their status come from the in-process registry, the latest readings are cached
+  for a few seconds and only the last-seen age is computed on every request.
+
+  Parameters
+  ----------
+  db : Session, optional
+    The database session. This parameter is automatically injected by FastAPI.
+
+  Returns
+  -------
+  Overview
+    An Overview object with the current status, latest reading, calculated humidity and
+    last-seen age of every collector, and the latest status of the receptor.
+  """
+
+  def load():
+    collectors = registry.status(db)
+    receptor_status = crud.get_receptor_status(db, 0, 1)
+    return {
+      "collectors": [
+        {**row._asdict(), **collectors[row.collector_id]._asdict()}
+        for row in sorted(
+          (row for rows in shards.scatter(db, sorted(collectors), crud.get_overview) for row in rows),
+          key=lambda row: row.collector_id,
+        )
+      ],
+      "receptor": schemas.ReceptorStatus.model_validate(receptor_status[0]) if receptor_status else None,
+    }
+
+  snapshot = overview_cache.get("overview", load)
+  last_seen = registry.last_seen(db)
+  now = datetime.now(timezone.utc)
+
+  return {
+    "generated_at": now,
+    "collectors": [
+      {
+        **collector,
+        "last_seen_age": (now - last_seen[collector["collector_id"]]).total_seconds() if collector["collector_id"] in last_seen else None,
+      }
+      for collector in snapshot["collectors"]
+    ],
+    "receptor": snapshot["receptor"],
+  }
+
+
+@app.get(
+  path="/fleet/health",
+  response_model=schemas.FleetHealth,
+  tags=["Dashboard"],
+  description="Retrieve the radio link health of every collector and of the whole fleet over the last hours."
+)
+async def get_fleet_health(
+  hours: int = Query(default=24, ge=1, le=MAX_HEALTH_HOURS),
+  db: Session = Depends(get_db),
+):
+
+  """
+  Retrieve the radio link health of every collector and of the whole fleet over the last hours.
+
+  Computed from the hourly rollups of the link telemetry, never from the raw rows. The
+  packet loss is estimated from the gaps in the header IDs of the packets of each
+  collector, the RSSI percentiles from the sum of the hourly histograms.
+
+  Parameters
+  ----------
+  hours : int, optional
+    The number of hours of the window, the current hour included. Defaults to 24.
+  db : Session, optional
+    The database session. This parameter is automatically injected by FastAPI.
+
+  Returns
+  -------
+  FleetHealth
+    A FleetHealth object with the link health of the fleet and of every known collector,
+    including the ones that were not heard in the window.
+  """
+
+  now = datetime.now(timezone.utc)
+  start = now.replace(minute=0, second=0, microsecond=0) - timedelta(hours=hours - 1)
+
+  def load():
+    rows = shards.gather(db, lambda db: crud.get_link_hourly(db, start), key=lambda row: (row.collector_id, row.hour))
+    by_collector = {collector_id: [] for collector_id in registry.status(db)}
+    for row in rows:
+      by_collector.setdefault(row.collector_id, []).append(row)
+
+    last_seen = registry.last_seen(db)
+    return {
+      "generated_at": now,
+      "start": start,
+      "fleet": link.summarize(rows),
+      "collectors": [
+        {"collector_id": collector_id, "last_seen": last_seen.get(collector_id), **link.summarize(collector_rows)}
+        for collector_id, collector_rows in sorted(by_collector.items())
+      ],
+    }
+
+  return fleet_cache.get(("fleet", hours), load)
+
+
+@app.get(
+  path="/fleet/health/{collector_id}",
+  response_model=schemas.CollectorLinkHealthJSON,
+  tags=["Dashboard"],
+  description="Retrieve the hourly radio link health of a specific collector over the last hours."
+)
+async def get_collector_link_health(
+  collector_id: int,
+  hours: int = Query(default=24, ge=1, le=MAX_HEALTH_HOURS),
+  db: Session = Depends(get_collector_db),
+):
+
+  """
+  Retrieve the hourly radio link health of a specific collector over the last hours.
+
+  Parameters
+  ----------
+  collector_id : int
+    The ID of the collector to retrieve the link health for.
+  hours : int, optional
+    The number of hours of the window, the current hour included. Defaults to 24.
+  db : Session, optional
+    The database session. This parameter is automatically injected by FastAPI.
+
+  Returns
+  -------
+  CollectorLinkHealthJSON
+    A CollectorLinkHealthJSON object with the link health of every hour the collector was heard.
+
+  Raises
+  ------
+  HTTPException
+    If the collector was not heard in the window.
+  """
+
+  start = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0) - timedelta(hours=hours - 1)
+
+  rows = crud.get_link_hourly(db, start, collector_id)
+  if not rows:
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No link telemetry found")
+
+  return {
+    "collector_id": collector_id,
+    "data": [{"hour": row.hour, **link.summarize([row])} for row in rows],
+  }
+
+
+@app.get(
+  path="/alert/rule",
+  response_model=list[schemas.AlertRule],
+  tags=["Alert"],
+  description="Retrieve the alert rules from the database."
+)
+async def get_alert_rules(
+  offset: int = Query(default=0, ge=0),
+  limit: int = Query(default=100, ge=1),
+  db: Session = Depends(get_db),
+):
+
+  """
+  Retrieve the alert rules from the database.
+
+  Parameters
+  ----------
+  offset : int, optional
+    The number of rules to skip. Defaults to 0.
+  limit : int, optional
+    The maximum number of rules to retrieve. Defaults to 100.
+  db : Session, optional
+    The database session. This parameter is automatically injected by FastAPI.
+
+  Returns
+  -------
+  List[AlertRule]
+    A list of AlertRule objects.
+  """
+
+  return crud.get_alert_rules(db, offset, limit)
+
+
+@app.get(
+  path="/alert/state",
+  response_model=list[schemas.AlertState],
+  tags=["Alert"],
+  description="Retrieve the state of the alert rules for each collector from the database."
+)
+async def get_alert_state(
+  firing: bool | None = Query(default=None),
+  offset: int = Query(default=0, ge=0),
+  limit: int = Query(default=100, ge=1),
+  db: Session = Depends(get_db),
+):
+
+  """
+  Retrieve the state of the alert rules for each collector from the database.
+
+  Parameters
+  ----------
+  firing : bool, optional
+    If set, only retrieve the states that are (or are not) firing.
+  offset : int, optional
+    The number of states to skip. Defaults to 0.
+  limit : int, optional
+    The maximum number of states to retrieve. Defaults to 100.
+  db : Session, optional
+    The database session. This parameter is automatically injected by FastAPI.
+
+  Returns
+  -------
+  List[AlertState]
+    A list of AlertState objects.
+  """
+
+  if not shards.sharded:
+    return crud.get_alert_state(db, firing, offset, limit)
+
+  # The page is cut from the first `offset + limit` states of every shard
+  states = shards.gather(
+    db, lambda db: crud.get_alert_state(db, firing, 0, offset + limit), key=lambda state: (state.rule_id, state.collector_id)
+  )
+  return states[offset:offset + limit]
+
+
 ##############
 ##  CREATE  ##
 ##############
@@ -361,7 +1072,7 @@ async def get_receptor_status(
 async def post_collector_status(
   collector_id: int,
   body: schemas.CollectorStatusBase,
-  db: Session = Depends(get_db),
+  db: Session = Depends(get_collector_db),
 ):
 
   """
@@ -384,11 +1095,14 @@ async def post_collector_status(
   Raises
   ------
   HTTPException
-    If the specified collector is not found in the database or if the primary key already exists.
+    If the primary key already exists (409) or the season overlaps another season of the
+    collector (422). A new crop closes the season still open, it does not overlap it.
   """
 
   try:
     return crud.post_collector_status(db, collector_id, body)
+  except crud.SeasonOverlapError as e:
+    raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
   except IntegrityError:
     raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Primary key already exists")
 
@@ -402,7 +1116,9 @@ async def post_collector_status(
 async def post_collectors_record(
   collector_id: int,
   body: schemas.CollectorRecordBase,
-  db: Session = Depends(get_db),
+  request: Request,
+  background_tasks: BackgroundTasks,
+  db: Session = Depends(get_collector_db),
 ):
 
   """
@@ -414,6 +1130,10 @@ async def post_collectors_record(
     The ID of the collector to create the record for.
   body : CollectorRecordBase
     The request body containing the data for the new record.
+  request : Request
+    The request, it identifies the receptor.
+  background_tasks : BackgroundTasks
+    Deliver the alert notifications once the response is ready.
   db : Session, optional
     The database session. This parameter is automatically injected by FastAPI.
 
@@ -425,15 +1145,188 @@ async def post_collectors_record(
   Raises
   ------
   HTTPException
-    If the specified collector is not found in the database or if the primary key already exists.
+    If the specified collector has never been registered with a status, if the primary key
+    already exists or if the upload is not admitted (429).
   """
 
+  if not registry.is_known(db, collector_id):
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Collector not found")
+
+  admit_ingest(request, db, 1)
+  background_tasks.add_task(dispatcher.flush)
+
   try:
     return crud.post_collector_record(db, collector_id, body)
   except IntegrityError:
     raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Primary key already exists")
 
 
+@app.post(
+  path="/collector/record/batch",
+  response_model=schemas.CollectorRecordBatchResult,
+  tags=["Collector"],
+  description="Create several records, of any collectors, in the database in a single request."
+)
+async def post_collector_record_batch(
+  body: list[schemas.CollectorRecordBatch],
+  request: Request,
+  background_tasks: BackgroundTasks,
+  db: Session = Depends(get_db),
+):
+
+  """
+  Create several records, of any collectors, in the database in a single request.
+
+  Used by the receptor to upload the readings it buffered. Records that already
+  exist are skipped, so retrying a batch is safe.
+
+  Parameters
+  ----------
+  body : List[CollectorRecordBatch]
+    The request body containing the records to create.
+  request : Request
+    The request, it identifies the receptor.
+  background_tasks : BackgroundTasks
+    Deliver the alert notifications once the response is ready.
+  db : Session, optional
+    The database session. This parameter is automatically injected by FastAPI.
+
+  Returns
+  -------
+  CollectorRecordBatchResult
+    A CollectorRecordBatchResult object with the number of records inserted, duplicated and rejected.
+
+  Raises
+  ------
+  HTTPException
+    If the batch has more than `MAX_BATCH_SIZE` records, is not admitted (429) or
+    conflicts with a concurrent upload (503).
+  """
+
+  if len(body) > MAX_BATCH_SIZE:
+    raise HTTPException(
+      status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+      detail=f"A batch can have at most {MAX_BATCH_SIZE} records"
+    )
+
+  admit_ingest(request, db, len(body), batch=True)
+  background_tasks.add_task(dispatcher.flush)
+
+  return store_records(db, [(record.collector_id, record.collection_date, record.read_humidity) for record in body])
+
+
+@app.post(
+  path="/collector/record/binary",
+  response_model=schemas.CollectorRecordBatchResult,
+  tags=["Collector"],
+  description="Create several records, of any collectors, in the database from packed binary records.",
+  openapi_extra={"requestBody": {"content": {binary.CONTENT_TYPE: {"schema": {"type": "string", "format": "binary"}}}}},
+)
+async def post_collector_record_binary(
+  request: Request,
+  background_tasks: BackgroundTasks,
+  db: Session = Depends(get_db),
+):
+
+  """
+  Create several records, of any collectors, in the database from packed binary records.
+
+  The body is a sequence of 12 byte little-endian records (collector ID uint32, Unix
+  epoch uint32, reading uint16, flags uint8, reserved uint8), as buffered by the
+  receptor. They are decoded in a single pass and inserted like a batch upload. The
+  body may be gzip compressed (`Content-Encoding: gzip`), as replicated by edge gateways.
+
+  Parameters
+  ----------
+  request : Request
+    The request, its body holds the records.
+  background_tasks : BackgroundTasks
+    Deliver the alert notifications once the response is ready.
+  db : Session, optional
+    The database session. This parameter is automatically injected by FastAPI.
+
+  Returns
+  -------
+  CollectorRecordBatchResult
+    A CollectorRecordBatchResult object with the number of records inserted, duplicated and rejected.
+    Records whose date was not synchronized by the receptor are counted as rejected.
+
+  Raises
+  ------
+  HTTPException
+    If the body is not (gzip compressed) records, has more than `MAX_BATCH_SIZE` records,
+    is not admitted (429) or conflicts with a concurrent upload (503).
+  """
+
+  data = await read_binary(request, binary.RECORD_DTYPE.itemsize)
+
+  try:
+    records, dropped = binary.decode_records(data)
+  except ValueError as e:
+    raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
+
+  admit_ingest(request, db, len(records) + dropped, batch=True)
+  background_tasks.add_task(dispatcher.flush)
+
+  result = store_records(db, records)
+  result["rejected"] += dropped
+  return result
+
+
+@app.post(
+  path="/collector/link/binary",
+  response_model=schemas.CollectorRecordBatchResult,
+  tags=["Collector"],
+  description="Create radio link telemetry records, of any collectors, in the database from packed binary records.",
+  openapi_extra={"requestBody": {"content": {binary.CONTENT_TYPE: {"schema": {"type": "string", "format": "binary"}}}}},
+)
+async def post_collector_link_binary(
+  request: Request,
+  db: Session = Depends(get_db),
+):
+
+  """
+  Create radio link telemetry records, of any collectors, in the database from packed binary records.
+
+  The body is a sequence of 14 byte little-endian records (collector ID uint32, Unix
+  epoch uint32, RSSI int16, SNR int8 in quarters of dB, header ID uint8, duplicates
+  uint8, flags uint8), one per packet received by the receptor. The hourly rollups of
+  the fleet health are updated in the same transaction. The body may be gzip compressed.
+
+  Parameters
+  ----------
+  request : Request
+    The request, its body holds the link records.
+  db : Session, optional
+    The database session. This parameter is automatically injected by FastAPI.
+
+  Returns
+  -------
+  CollectorRecordBatchResult
+    A CollectorRecordBatchResult object with the number of records inserted, duplicated and rejected.
+    Records whose date was not synchronized by the receptor are counted as rejected.
+
+  Raises
+  ------
+  HTTPException
+    If the body is not a sequence of link records, has more than `MAX_BATCH_SIZE` records
+    or is not admitted (429).
+  """
+
+  data = await read_binary(request, binary.LINK_DTYPE.itemsize)
+
+  try:
+    links, dropped = binary.decode_links(data)
+  except ValueError as e:
+    raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
+
+  admit_ingest(request, db, len(links) + dropped, batch=True)
+
+  result = merge_batch_results(shards.scatter(db, links, ingest_on_shard(crud.post_collector_link_batch), key=lambda link: link[0]))
+  result["rejected"] += dropped
+  return result
+
+
 @app.post(
   path="/collector/{collector_id}/calculated_humidity",
   response_model=schemas.CalculatedHumidity,
@@ -443,7 +1336,7 @@ async def post_collectors_record(
 async def post_collector_calculated_humidity(
   collector_id: int,
   body: schemas.CalculatedHumidityBase,
-  db: Session = Depends(get_db),
+  db: Session = Depends(get_collector_db),
 ):
 
   """
@@ -511,3 +1404,34 @@ async def post_receptor_status(
     return crud.post_receptor_status(db, body)
   except IntegrityError:
     raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Primary key already exists")
+
+
+
+@app.post(
+  path="/alert/rule",
+  response_model=schemas.AlertRule,
+  tags=["Alert"],
+  description="Create a new alert rule in the database."
+)
+async def post_alert_rule(
+  body: schemas.AlertRuleBase,
+  db: Session = Depends(get_db),
+):
+
+  """
+  Create a new alert rule in the database.
+
+  Parameters
+  ----------
+  body : AlertRuleBase
+    The request body containing the data for the new rule.
+  db : Session, optional
+    The database session. This parameter is automatically injected by FastAPI.
+
+  Returns
+  -------
+  AlertRule
+    An AlertRule object representing the newly created rule.
+  """
+
+  return crud.post_alert_rule(db, body)
@@ -0,0 +1,211 @@
+################################################################################
+##                                  LIBRARIES                                 ##
+################################################################################
+
+################
+##  BUILT-IN  ##
+################
+
+import math
+import os
+import random
+import time
+from threading import Lock
+
+
+################
+##  INTERNAL  ##
+################
+
+from . import dialect
+
+
+################
+##  EXTERNAL  ##
+################
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+
+
+################################################################################
+##                                  CONSTANTS                                 ##
+################################################################################
+
+# Records per second a receptor may upload, and how many it may send at once. A receptor
+# that comes back online drains its buffer at this rate instead of all at once.
+RECEPTOR_RATE = float(os.environ.get("RECEPTOR_RATE", 20))
+RECEPTOR_BURST = float(os.environ.get("RECEPTOR_BURST", 1000))
+MAX_BUCKETS = 10000 # Receptors tracked, the idle ones are dropped past it
+
+# Ingest transactions running at once on a database (the primary, or every shard) across
+# every process. Defaults to the pool of a single process on that database, the other
+# connections of the database are left to the reads.
+INGEST_SLOTS = int(os.environ["INGEST_SLOTS"]) if "INGEST_SLOTS" in os.environ else None
+SLOT_RETRY_AFTER = (1, 5) # Seconds, spread so the rejected receptors do not come back together
+
+# Advisory lock keys of the ingest slots are (INGEST_LOCK, slot)
+INGEST_LOCK = 0x50494c # "PIL"
+
+# Take the first free slot, the lock is released when the transaction ends
+SLOT_QUERY = text("""
+  SELECT slot FROM generate_series(0, :slots - 1) AS slot
+  WHERE pg_try_advisory_xact_lock(:key, slot)
+  LIMIT 1
+""")
+
+
+
+################################################################################
+##                                TOKEN BUCKET                                ##
+################################################################################
+
+class TokenBucket:
+
+  """
+  Allow `rate` units per second on average, with bursts of up to `burst` units.
+  """
+
+  def __init__(self, rate: float, burst: float):
+    self.rate = rate
+    self.burst = burst
+    self.tokens = burst
+    self.updated = time.monotonic()
+
+
+  def take(self, cost: float) -> float:
+
+    """
+    Take `cost` tokens if there are enough.
+
+    Parameters
+    ----------
+    cost : float
+      The number of tokens to take, at most `burst`.
+
+    Returns
+    -------
+    float
+      0 if the tokens were taken, otherwise the seconds until there are enough.
+    """
+
+    now = time.monotonic()
+    self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+    self.updated = now
+
+    if self.tokens >= cost:
+      self.tokens -= cost
+      return 0.0
+    return (cost - self.tokens) / self.rate
+
+
+  def idle(self) -> float:
+    return time.monotonic() - self.updated
+
+
+
+################################################################################
+##                                 ADMISSION                                  ##
+################################################################################
+
+class Admission:
+
+  """
+  Decide whether an ingest request is served now or sent back with a Retry-After.
+
+  Every receptor has a token bucket, in records, kept in-process (each process,
+  or Lambda container, has its own). The ingest transactions also take one of
+  the `slots` advisory locks of the database they write to on PostgreSQL, so
+  every process together never holds more than that many of its connections
+  for uploads and the dashboards keep the rest. Advisory locks are per
+  database: with shards every shard has its own slots, and a batch takes one
+  on every shard it writes to (see `slot`). Reads are never limited. On SQLite
+  (edge mode) the database serializes the writes itself and only the buckets
+  apply.
+  """
+
+  def __init__(self, rate: float = RECEPTOR_RATE, burst: float = RECEPTOR_BURST, slots: int | None = INGEST_SLOTS):
+    self.rate = rate
+    self.burst = burst
+    self.slots = slots
+    self._buckets: dict[str, TokenBucket] = {}
+    self._lock = Lock()
+
+
+  def admit(self, db: Session, receptor: str, records: int) -> int | None:
+
+    """
+    Admit an ingest request.
+
+    Parameters
+    ----------
+    db : Session | None
+      The database session of the request, it holds the ingest slot until its
+      transaction ends. None to only take the tokens, the slots are then taken
+      with `slot` on every session that writes.
+    receptor : str
+      The receptor (or client) that sent the request.
+    records : int
+      The number of records in the request.
+
+    Returns
+    -------
+    int | None
+      None if the request is admitted, otherwise the seconds to wait before retrying.
+    """
+
+    with self._lock:
+      bucket = self._buckets.get(receptor)
+      if bucket is None:
+        if len(self._buckets) >= MAX_BUCKETS:
+          self._prune()
+        bucket = self._buckets[receptor] = TokenBucket(self.rate, self.burst)
+      wait = bucket.take(min(records, self.burst))
+
+    if wait:
+      return math.ceil(wait)
+
+    retry_after = None if db is None else self.slot(db)
+    if retry_after is not None:
+      # The records were not stored, give the tokens back
+      with self._lock:
+        bucket.tokens = min(self.burst, bucket.tokens + min(records, self.burst))
+
+    return retry_after
+
+
+  def slot(self, db: Session) -> int | None:
+
+    """
+    Take an ingest slot of the database of a session, held until its transaction ends.
+
+    Parameters
+    ----------
+    db : Session
+      The database session that writes the records.
+
+    Returns
+    -------
+    int | None
+      None if a slot was taken (or on SQLite), otherwise the seconds to wait before retrying.
+    """
+
+    if dialect.is_sqlite(db):
+      return None
+
+    # Without INGEST_SLOTS, as many as the pool of this process on that database
+    slots = self.slots or db.get_bind().pool.size()
+    if db.execute(SLOT_QUERY, {"slots": slots, "key": INGEST_LOCK}).scalar() is None:
+      return random.randint(*SLOT_RETRY_AFTER)
+    return None
+
+
+  def _prune(self):
+    # A bucket idle long enough to be full again is the same as a new one
+    full = self.burst / self.rate
+    for receptor in [receptor for receptor, bucket in self._buckets.items() if bucket.idle() >= full]:
+      del self._buckets[receptor]
+
+
+admission = Admission()
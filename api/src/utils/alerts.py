@@ -0,0 +1,204 @@
+################################################################################
+##                                  LIBRARIES                                 ##
+################################################################################
+
+################
+##  BUILT-IN  ##
+################
+
+import time
+from contextlib import nullcontext
+from datetime import datetime
+from threading import Lock
+
+
+################
+##  INTERNAL  ##
+################
+
+from . import dialect
+from . import models
+from . import quality
+from .registry import registry
+from .shards import shards
+from .webhooks import dispatcher
+
+
+################
+##  EXTERNAL  ##
+################
+
+from sqlalchemy.orm import Session
+
+
+
+################################################################################
+##                                  CONSTANTS                                 ##
+################################################################################
+
+RULES_TTL = 60 # seconds between reloads of the rules table
+
+CONDITIONS = {
+  "below": lambda value, threshold: value < threshold,
+  "above": lambda value, threshold: value > threshold,
+}
+
+
+
+################################################################################
+##                                    RULES                                   ##
+################################################################################
+
+_rules: list[models.AlertRule] = []
+_rules_loaded = 0.0
+_lock = Lock()
+
+
+def invalidate_rules():
+
+  """
+  Force the rules to be reloaded on the next evaluation.
+  """
+
+  global _rules_loaded
+  _rules_loaded = 0.0
+
+
+def get_rules(db: Session) -> list[models.AlertRule]:
+
+  """
+  Retrieve the enabled alert rules, cached in-process for `RULES_TTL` seconds.
+
+  Parameters
+  ----------
+  db : Session
+    The database session, only used when the cache is stale. The rules are kept
+    on the primary, a session on another shard is not used.
+
+  Returns
+  -------
+  List[AlertRule]
+    The enabled alert rules, detached from the session.
+  """
+
+  global _rules, _rules_loaded
+
+  with _lock:
+    if time.monotonic() - _rules_loaded > RULES_TTL:
+      with shards.session(0) if shards.sharded else nullcontext(db) as db:
+        _rules = db.query(models.AlertRule).filter(models.AlertRule.enabled.is_(True)).all()
+        for rule in _rules:
+          db.expunge(rule)
+      _rules_loaded = time.monotonic()
+
+    return _rules
+
+
+################################################################################
+##                                 EVALUATION                                 ##
+################################################################################
+
+def evaluate(db: Session, readings: list[tuple[int, datetime, int]]) -> list[models.AlertOutbox]:
+
+  """
+  Evaluate the alert rules that apply to their collectors against new readings.
+
+  Each rule keeps a single state row per collector (when the breach started and
+  whether it is firing), so a reading costs one primary key lookup per matching
+  rule instead of scanning the history. State changes and notifications are added
+  to the session and committed together with the readings by the caller.
+
+  Parameters
+  ----------
+  db : Session
+    The database session.
+  readings : List[Tuple[int, datetime, int]]
+    The readings, as (collector ID, collection date, raw ADC reading) tuples, in
+    collection order.
+
+  Returns
+  -------
+  List[AlertOutbox]
+    The notifications added to the outbox, delivered once the readings are committed.
+  """
+
+  rules = get_rules(db)
+  if not rules:
+    return []
+
+  # The states added by this call are not flushed, db.get would not find them again
+  states = {}
+  notifications = []
+
+  for collector_id, date, read_humidity in readings:
+    date = dialect.as_utc(date)
+    crop = registry.crop(db, collector_id)
+    humidity = quality.humidity_percentage(read_humidity)
+
+    for rule in rules:
+      if rule.collector_id is not None and rule.collector_id != collector_id:
+        continue
+      if rule.crop is not None and rule.crop != crop:
+        continue
+
+      key = (rule.rule_id, collector_id)
+      state = states.get(key) or db.get(models.AlertState, key)
+      if state is None:
+        state = models.AlertState(rule_id=rule.rule_id, collector_id=collector_id, firing=False)
+        db.add(state)
+      elif state.last_date is not None and date <= state.last_date:
+        # Late readings would rewind the breach, ignore them
+        continue
+
+      states[key] = state
+      state.last_date = date
+
+      kind = None
+      if CONDITIONS[rule.condition](humidity, float(rule.threshold)):
+        if state.breach_start is None:
+          state.breach_start = date
+        if not state.firing and (date - state.breach_start).total_seconds() >= rule.duration:
+          state.firing = True
+          kind = "firing"
+
+      else:
+        if state.firing:
+          kind = "resolved"
+        state.breach_start = None
+        state.firing = False
+
+      if kind is not None:
+        notification = models.AlertOutbox(
+          webhook_url=rule.webhook_url,
+          event=_event(kind, rule, collector_id, crop, date, humidity),
+          attempts=0,
+        )
+        db.add(notification)
+        notifications.append(notification)
+
+  return notifications
+
+
+def notify(notifications: list[models.AlertOutbox]):
+
+  """
+  Let the webhook dispatcher know about the notifications returned by `evaluate`,
+  called once they have been committed.
+  """
+
+  if notifications:
+    dispatcher.wake()
+
+
+def _event(kind: str, rule: models.AlertRule, collector_id: int, crop: str | None, date: datetime, humidity: float) -> dict:
+  return {
+    "event": kind,
+    "rule_id": rule.rule_id,
+    "collector_id": collector_id,
+    "crop": crop,
+    "condition": rule.condition,
+    "threshold": float(rule.threshold),
+    "duration": rule.duration,
+    "date": date.isoformat(),
+    "humidity_percentage": humidity,
+  }
@@ -0,0 +1,177 @@
+################################################################################
+##                                  LIBRARIES                                 ##
+################################################################################
+
+################
+##  BUILT-IN  ##
+################
+
+import zlib
+from datetime import datetime, timezone
+
+
+################
+##  EXTERNAL  ##
+################
+
+import numpy as np
+
+
+
+################################################################################
+##                                  CONSTANTS                                 ##
+################################################################################
+
+# Packed binary record sent by the receptor, must match `devices/lib/record.py`.
+# Little-endian, 12 bytes, no padding between fields.
+RECORD_DTYPE = np.dtype([
+  ("collector_id", "<u4"),
+  ("epoch", "<u4"),        # Unix seconds
+  ("read_humidity", "<u2"),
+  ("flags", "u1"),
+  ("reserved", "u1"),
+])
+
+# Packed link telemetry record, one per packet received by the receptor, must match
+# `devices/lib/link.py`. Little-endian, 14 bytes, no padding between fields.
+LINK_DTYPE = np.dtype([
+  ("collector_id", "<u4"),
+  ("epoch", "<u4"),        # Unix seconds
+  ("rssi", "<i2"),         # dBm
+  ("snr", "i1"),           # quarters of dB
+  ("header_id", "u1"),
+  ("duplicates", "u1"),
+  ("flags", "u1"),
+])
+
+# Flags, shared by both records
+FLAG_TIME_UNSYNCED = 0x01 # The receptor clock was not synchronized by NTP yet
+
+CONTENT_TYPE = "application/octet-stream"
+
+
+
+################################################################################
+##                                  DECODING                                  ##
+################################################################################
+
+def decode_records(data: bytes) -> tuple[list[tuple[int, datetime, int]], int]:
+
+  """
+  Decode a buffer of packed binary records in a single pass.
+
+  Parameters
+  ----------
+  data : bytes
+    The concatenated records.
+
+  Returns
+  -------
+  Tuple[List[Tuple[int, datetime, int]], int]
+    The valid records as (collector ID, collection date, read humidity) tuples, sorted by
+    collector and date, and the number of records dropped because their date is unreliable.
+
+  Raises
+  ------
+  ValueError
+    If the size of the buffer is not a multiple of the record size.
+  """
+
+  if len(data) % RECORD_DTYPE.itemsize:
+    raise ValueError(f"The body must be a sequence of {RECORD_DTYPE.itemsize} byte records")
+
+  records = np.frombuffer(data, dtype=RECORD_DTYPE)
+
+  synced = (records["flags"] & FLAG_TIME_UNSYNCED) == 0
+  dropped = int(len(records) - np.count_nonzero(synced))
+  records = records[synced]
+
+  records = records[np.lexsort((records["epoch"], records["collector_id"]))]
+  dates = records["epoch"].astype("datetime64[s]").tolist()
+
+  return list(zip(
+    records["collector_id"].tolist(),
+    [date.replace(tzinfo=timezone.utc) for date in dates],
+    records["read_humidity"].tolist(),
+  )), dropped
+
+
+def decode_links(data: bytes) -> tuple[list[tuple[int, datetime, int, float, int, int]], int]:
+
+  """
+  Decode a buffer of packed link telemetry records in a single pass.
+
+  Parameters
+  ----------
+  data : bytes
+    The concatenated link records.
+
+  Returns
+  -------
+  Tuple[List[Tuple[int, datetime, int, float, int, int]], int]
+    The valid records as (collector ID, received date, RSSI, SNR, header ID, duplicates) tuples,
+    sorted by collector and date, and the number of records dropped because their date is unreliable.
+
+  Raises
+  ------
+  ValueError
+    If the size of the buffer is not a multiple of the link record size.
+  """
+
+  if len(data) % LINK_DTYPE.itemsize:
+    raise ValueError(f"The body must be a sequence of {LINK_DTYPE.itemsize} byte records")
+
+  links = np.frombuffer(data, dtype=LINK_DTYPE)
+
+  synced = (links["flags"] & FLAG_TIME_UNSYNCED) == 0
+  dropped = int(len(links) - np.count_nonzero(synced))
+  links = links[synced]
+
+  links = links[np.lexsort((links["epoch"], links["collector_id"]))]
+  dates = links["epoch"].astype("datetime64[s]").tolist()
+
+  return list(zip(
+    links["collector_id"].tolist(),
+    [date.replace(tzinfo=timezone.utc) for date in dates],
+    links["rssi"].tolist(),
+    (links["snr"] / 4).tolist(),
+    links["header_id"].tolist(),
+    links["duplicates"].tolist(),
+  )), dropped
+
+
+
+def decompress(data: bytes, max_size: int) -> bytes:
+
+  """
+  Decompress a gzip body, stopping at `max_size` bytes so a small body cannot expand
+  without bound in memory.
+
+  Parameters
+  ----------
+  data : bytes
+    The gzip compressed body.
+  max_size : int
+    The maximum number of bytes to decompress.
+
+  Returns
+  -------
+  bytes
+    The decompressed body, cut at `max_size` bytes if it is larger.
+
+  Raises
+  ------
+  ValueError
+    If the body is not valid gzip.
+  """
+
+  decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+  try:
+    result = decompressor.decompress(data, max_size)
+  except zlib.error as e:
+    raise ValueError(f"Invalid gzip body: {e}")
+
+  if len(result) < max_size and not decompressor.eof:
+    raise ValueError("Invalid gzip body: truncated")
+
+  return result
@@ -0,0 +1,73 @@
+################################################################################
+##                                  LIBRARIES                                 ##
+################################################################################
+
+################
+##  BUILT-IN  ##
+################
+
+import time
+from threading import Lock
+from typing import Any, Callable, Hashable
+
+
+
+################################################################################
+##                                    CACHE                                   ##
+################################################################################
+
+class TTLCache:
+
+  """
+  Small in-process cache whose entries expire after a fixed time.
+
+  Meant for results that are expensive to compute and fine to serve slightly
+  stale, such as dashboard snapshots. Each process (or Lambda container) keeps
+  its own copy.
+  """
+
+  def __init__(self, ttl: float):
+    self.ttl = ttl
+    self._entries: dict[Hashable, tuple[float, Any]] = {}
+    self._lock = Lock()
+
+
+  def get(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+
+    """
+    Retrieve a value from the cache, calling `loader` to compute it when missing or expired.
+
+    Parameters
+    ----------
+    key : Hashable
+      The key of the value.
+    loader : Callable[[], Any]
+      A function that computes the value.
+
+    Returns
+    -------
+    Any
+      The cached (or freshly computed) value.
+    """
+
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is not None and time.monotonic() - entry[0] < self.ttl:
+        return entry[1]
+
+      value = loader()
+      self._entries[key] = (time.monotonic(), value)
+      return value
+
+
+  def invalidate(self, key: Hashable | None = None):
+
+    """
+    Drop a value from the cache, or every value if no key is given.
+    """
+
+    with self._lock:
+      if key is None:
+        self._entries.clear()
+      else:
+        self._entries.pop(key, None)
@@ -2,20 +2,45 @@
 ##                                  LIBRARIES                                 ##
 ################################################################################
 
+################
+##  BUILT-IN  ##
+################
+
+from datetime import datetime, timedelta, timezone
+
+
 ################
 ##  INTERNAL  ##
 ################
 
+from . import alerts
+from . import dialect
+from . import link
 from . import models
+from . import quality
 from . import schemas
+from .registry import registry
 
 
 ################
 ##  EXTERNAL  ##
 ################
 
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import DateTime, Integer, and_, cast, column, distinct, func, or_, select, text, true, values
+
+
+################################################################################
+##                                   ERRORS                                   ##
+################################################################################
+
+class SeasonOverlapError(Exception):
+
+  """
+  The season of a new collector status overlaps another season of the collector.
+  """
+
 
 
 ################################################################################
@@ -63,12 +88,10 @@ def get_collector_status(db: Session, offset: int = 0, limit: int = 1):
 
   query = (
     db.query(subquery.c.collector_id,
-    func.array_agg(
-      func.json_build_object(
-        "start_date", subquery.c.start_date,
-        "end_date", subquery.c.end_date,
-        "crop", subquery.c.crop
-      )
+    dialect.json_agg(
+      "start_date", subquery.c.start_date,
+      "end_date", subquery.c.end_date,
+      "crop", subquery.c.crop
     ).label("data"))
     .filter(subquery.c.row_number >= offset)
     .filter(subquery.c.row_number <= limit+offset)
@@ -116,12 +139,10 @@ def get_collector_status_by_id(db: Session, collector_id: int, offset: int = 0,
 
   query = (
     db.query(subquery.c.collector_id,
-    func.array_agg(
-      func.json_build_object(
-        "start_date", subquery.c.start_date,
-        "end_date", subquery.c.end_date,
-        "crop", subquery.c.crop
-      )
+    dialect.json_agg(
+      "start_date", subquery.c.start_date,
+      "end_date", subquery.c.end_date,
+      "crop", subquery.c.crop
     ).label("data"))
     .group_by(subquery.c.collector_id)
     .first()
@@ -151,6 +172,7 @@ def get_collector_record(db: Session, offset: int = 0, limit: int = 100):
     Each dictionary contains the following keys:
       - "collection_date": The date and time of the record.
       - "read_humidity": The humidity reading for the record.
+      - "quality_flags": The data-quality flags of the record.
   """
 
   subquery = (
@@ -166,11 +188,10 @@ def get_collector_record(db: Session, offset: int = 0, limit: int = 100):
 
   query = (
     db.query(subquery.c.collector_id,
-    func.array_agg(
-      func.json_build_object(
-        "collection_date", subquery.c.collection_date,
-        "read_humidity", subquery.c.read_humidity
-      )
+    dialect.json_agg(
+      "collection_date", subquery.c.collection_date,
+      "read_humidity", subquery.c.read_humidity,
+      "quality_flags", subquery.c.quality_flags
     ).label("data"))
     .filter(subquery.c.row_number >= offset)
     .filter(subquery.c.row_number <= limit+offset)
@@ -205,6 +226,7 @@ def get_collector_record_by_id(db: Session, collector_id: int, offset: int = 0,
     Each dictionary contains the following keys:
       - "collection_date": The date and time of the record.
       - "read_humidity": The humidity reading for the record.
+      - "quality_flags": The data-quality flags of the record.
   """
 
   subquery = (
@@ -217,11 +239,59 @@ def get_collector_record_by_id(db: Session, collector_id: int, offset: int = 0,
 
   query = (
     db.query(subquery.c.collector_id, 
-    func.array_agg(
-      func.json_build_object(
-        "collection_date", subquery.c.collection_date,
-        "read_humidity", subquery.c.read_humidity
-      )
+    dialect.json_agg(
+      "collection_date", subquery.c.collection_date,
+      "read_humidity", subquery.c.read_humidity,
+      "quality_flags", subquery.c.quality_flags
+    ).label("data"))
+    .group_by(subquery.c.collector_id)
+    .first()
+  )
+
+  return query
+
+
+def get_collector_flags_by_id(db: Session, collector_id: int, offset: int = 0, limit: int = 100):
+
+  """
+  Retrieve the most recent flagged (quarantined) records for a specific collector from the database.
+
+  Parameters
+  ----------
+  db : Session
+    The database session.
+  collector_id : int
+    The ID of the collector to retrieve flagged records for.
+  offset : int, optional
+    The number of records to skip. Defaults to 0.
+  limit : int, optional
+    The maximum number of records to retrieve. Defaults to 100.
+
+  Returns
+  -------
+  Tuple[int, List[Dict[str, Any]]]
+    A tuple containing the collector ID and a list of dictionaries representing the most recent flagged records for that collector.
+    Each dictionary contains the following keys:
+      - "collection_date": The date and time of the record.
+      - "read_humidity": The humidity reading for the record.
+      - "quality_flags": The data-quality flags of the record.
+  """
+
+  subquery = (
+    db.query(models.CollectorRecord)
+      .filter(models.CollectorRecord.collector_id == collector_id)
+      .filter(models.CollectorRecord.quality_flags != 0)
+      .order_by(models.CollectorRecord.collection_date.desc())
+      .offset(offset)
+      .limit(limit)
+  ).subquery()
+
+  query = (
+    db.query(subquery.c.collector_id,
+    dialect.json_agg(
+      "collection_date", subquery.c.collection_date,
+      "read_humidity", subquery.c.read_humidity,
+      "quality_flags", subquery.c.quality_flags
     ).label("data"))
     .group_by(subquery.c.collector_id)
     .first()
@@ -266,11 +336,9 @@ def get_collector_calculated_humidity(db: Session, offset: int = 0, limit: int =
 
   query = (
     db.query(subquery.c.collector_id,
-    func.array_agg(
-      func.json_build_object(
-        "calculation_date", subquery.c.calculation_date,
-        "humidity_percentage", subquery.c.humidity_percentage
-      )
+    dialect.json_agg(
+      "calculation_date", subquery.c.calculation_date,
+      "humidity_percentage", subquery.c.humidity_percentage
     ).label("data"))
     .filter(subquery.c.row_number >= offset)
     .filter(subquery.c.row_number <= limit+offset)
@@ -317,11 +385,9 @@ def get_collector_calculated_humidity_by_id(db: Session, collector_id: int, offs
 
   query = (
     db.query(subquery.c.collector_id,
-    func.array_agg(
-      func.json_build_object(
-        "calculation_date", subquery.c.calculation_date,
-        "humidity_percentage", subquery.c.humidity_percentage
-      )
+    dialect.json_agg(
+      "calculation_date", subquery.c.calculation_date,
+      "humidity_percentage", subquery.c.humidity_percentage
     ).label("data"))
     .group_by(subquery.c.collector_id)
     .first()
@@ -330,6 +396,44 @@ def get_collector_calculated_humidity_by_id(db: Session, collector_id: int, offs
   return query
 
 
+def get_collector_calculated_humidity_window(db: Session, collector_ids: list[int], start: datetime, end: datetime):
+
+  """
+  Retrieve the calculated humidity values of several collectors within a time window, in a single query.
+
+  Parameters
+  ----------
+  db : Session
+    The database session.
+  collector_ids : List[int]
+    The IDs of the collectors to retrieve calculated humidity values for.
+  start : datetime
+    The start of the window (inclusive).
+  end : datetime
+    The end of the window (exclusive).
+
+  Returns
+  -------
+  List[Tuple[int, float, float]]
+    A list of (collector ID, seconds since the epoch, humidity percentage) tuples, ordered by collector and date.
+  """
+
+  query = (
+    db.query(
+      models.CalculatedHumidity.collector_id,
+      func.extract("epoch", models.CalculatedHumidity.calculation_date),
+      models.CalculatedHumidity.humidity_percentage,
+    )
+    .filter(models.CalculatedHumidity.collector_id.in_(collector_ids))
+    .filter(models.CalculatedHumidity.calculation_date >= start)
+    .filter(models.CalculatedHumidity.calculation_date < end)
+    .order_by(models.CalculatedHumidity.collector_id, models.CalculatedHumidity.calculation_date)
+    .all()
+  )
+
+  return query
+
+
 def get_receptor_status(db: Session, offset: int = 0, limit: int = 1):
 
   """
@@ -361,6 +465,460 @@ def get_receptor_status(db: Session, offset: int = 0, limit: int = 1):
   return query
 
 
+def get_collector_season_record(db: Session, collector_id: int, season: int = 0, offset: int = 0, limit: int = 100):
+
+  """
+  Retrieve the records of a specific collector during one of its crop seasons from the database.
+
+  Parameters
+  ----------
+  db : Session
+    The database session.
+  collector_id : int
+    The ID of the collector to retrieve records for.
+  season : int, optional
+    The season to retrieve, 0 is the current (most recent) crop, 1 the previous one and so on. Defaults to 0.
+  offset : int, optional
+    The number of records to skip. Defaults to 0.
+  limit : int, optional
+    The maximum number of records to retrieve. Defaults to 100.
+
+  Returns
+  -------
+  Tuple[int, str, datetime, datetime, List[Dict[str, Any]]]
+    A tuple containing the collector ID, the crop, the start and end dates of the season and a list of dictionaries representing the most recent records of the season.
+    Each dictionary contains the following keys:
+      - "collection_date": The date and time of the record.
+      - "read_humidity": The humidity reading for the record.
+      - "quality_flags": The data-quality flags of the record.
+  """
+
+  # SQLite has no LATERAL nor range types, the season is read first
+  if dialect.is_sqlite(db):
+    status = (
+      db.query(models.CollectorStatus)
+        .filter(models.CollectorStatus.collector_id == collector_id)
+        .order_by(models.CollectorStatus.start_date.desc())
+        .offset(season)
+        .first()
+    )
+    if status is None:
+      return None
+
+    records = (
+      db.query(
+        models.CollectorRecord.collection_date,
+        models.CollectorRecord.read_humidity,
+        models.CollectorRecord.quality_flags,
+      )
+      .filter(models.CollectorRecord.collector_id == collector_id)
+      .filter(models.CollectorRecord.collection_date >= status.start_date)
+    )
+    if status.end_date is not None:
+      records = records.filter(models.CollectorRecord.collection_date < status.end_date)
+    records = (
+      records
+        .order_by(models.CollectorRecord.collection_date.desc())
+        .offset(offset)
+        .limit(limit)
+        .all()
+    )
+    if not records:
+      return None
+
+    return {
+      "collector_id": status.collector_id,
+      "crop": status.crop,
+      "start_date": status.start_date,
+      "end_date": status.end_date,
+      "data": [record._asdict() for record in records],
+    }
+
+  season_status = (
+    db.query(models.CollectorStatus)
+      .filter(models.CollectorStatus.collector_id == collector_id)
+      .order_by(models.CollectorStatus.start_date.desc())
+      .offset(season)
+      .limit(1)
+  ).subquery()
+
+  # Bounds taken from the season range, written as plain comparisons so the primary key index is used
+  records = (
+    select(
+      models.CollectorRecord.collection_date,
+      models.CollectorRecord.read_humidity,
+      models.CollectorRecord.quality_flags,
+    )
+    .where(models.CollectorRecord.collector_id == season_status.c.collector_id)
+    .where(models.CollectorRecord.collection_date >= func.lower(season_status.c.season))
+    .where(or_(
+      func.upper_inf(season_status.c.season),
+      models.CollectorRecord.collection_date < func.upper(season_status.c.season),
+    ))
+    .order_by(models.CollectorRecord.collection_date.desc())
+    .offset(offset)
+    .limit(limit)
+  ).lateral()
+
+  query = (
+    db.query(
+      season_status.c.collector_id,
+      season_status.c.crop,
+      season_status.c.start_date,
+      season_status.c.end_date,
+      dialect.json_agg(
+        "collection_date", records.c.collection_date,
+        "read_humidity", records.c.read_humidity,
+        "quality_flags", records.c.quality_flags
+      ).label("data"),
+    )
+    .select_from(season_status)
+    .join(records, true())
+    .group_by(
+      season_status.c.collector_id,
+      season_status.c.crop,
+      season_status.c.start_date,
+      season_status.c.end_date,
+    )
+    .first()
+  )
+
+  return query
+
+
+def get_crop_calculated_humidity(db: Session, crop: str, start: datetime, end: datetime, resolution: int = 3600):
+
+  """
+  Retrieve the calculated humidity aggregated over every collector growing a crop from the database.
+
+  Each reading is joined to the season it belongs to (`season @> calculation_date`),
+  the seasons of the crop that overlap the window are found through the GiST index
+  on (crop, season).
+
+  Parameters
+  ----------
+  db : Session
+    The database session.
+  crop : str
+    The crop to aggregate.
+  start : datetime
+    The start of the window (inclusive).
+  end : datetime
+    The end of the window (exclusive).
+  resolution : int, optional
+    The size of the aggregation buckets, in seconds. Defaults to 3600.
+
+  Returns
+  -------
+  List[Tuple[datetime, float, float, float, int, int]]
+    A list of tuples, one per bucket with data, with the following fields:
+      - "calculation_date": The start of the bucket.
+      - "humidity_mean": The mean humidity percentage in the bucket.
+      - "humidity_min": The minimum humidity percentage in the bucket.
+      - "humidity_max": The maximum humidity percentage in the bucket.
+      - "collectors": The number of collectors with readings in the bucket.
+      - "samples": The number of readings in the bucket.
+  """
+
+  # SQLite has no date_bin nor range types, the buckets are computed on Unix seconds and
+  # the seasons compared through their bounds
+  if dialect.is_sqlite(db):
+    origin = int(start.timestamp())
+    epoch = cast(func.strftime("%s", models.CalculatedHumidity.calculation_date), Integer)
+    bucket = (epoch - origin) // resolution * resolution + origin
+
+    query = (
+      db.query(
+        bucket.label("calculation_date"),
+        func.avg(models.CalculatedHumidity.humidity_percentage).label("humidity_mean"),
+        func.min(models.CalculatedHumidity.humidity_percentage).label("humidity_min"),
+        func.max(models.CalculatedHumidity.humidity_percentage).label("humidity_max"),
+        func.count(distinct(models.CalculatedHumidity.collector_id)).label("collectors"),
+        func.count().label("samples"),
+      )
+      .join(models.CollectorStatus, and_(
+        models.CollectorStatus.collector_id == models.CalculatedHumidity.collector_id,
+        models.CollectorStatus.start_date <= models.CalculatedHumidity.calculation_date,
+        or_(models.CollectorStatus.end_date.is_(None), models.CollectorStatus.end_date > models.CalculatedHumidity.calculation_date),
+      ))
+      .filter(models.CollectorStatus.crop == crop)
+      .filter(models.CalculatedHumidity.calculation_date >= start)
+      .filter(models.CalculatedHumidity.calculation_date < end)
+      .group_by(bucket)
+      .order_by(bucket)
+      .all()
+    )
+
+    return [
+      {**row._asdict(), "calculation_date": datetime.fromtimestamp(row.calculation_date, tz=timezone.utc)}
+      for row in query
+    ]
+
+  bucket = func.date_bin(timedelta(seconds=resolution), models.CalculatedHumidity.calculation_date, start)
+
+  query = (
+    db.query(
+      bucket.label("calculation_date"),
+      func.avg(models.CalculatedHumidity.humidity_percentage).label("humidity_mean"),
+      func.min(models.CalculatedHumidity.humidity_percentage).label("humidity_min"),
+      func.max(models.CalculatedHumidity.humidity_percentage).label("humidity_max"),
+      func.count(distinct(models.CalculatedHumidity.collector_id)).label("collectors"),
+      func.count().label("samples"),
+    )
+    .join(models.CollectorStatus, and_(
+      models.CollectorStatus.collector_id == models.CalculatedHumidity.collector_id,
+      models.CollectorStatus.season.op("@>")(models.CalculatedHumidity.calculation_date),
+    ))
+    .filter(models.CollectorStatus.crop == crop)
+    .filter(models.CollectorStatus.season.op("&&")(func.tstzrange(start, end)))
+    .filter(models.CalculatedHumidity.calculation_date >= start)
+    .filter(models.CalculatedHumidity.calculation_date < end)
+    .group_by(bucket)
+    .order_by(bucket)
+    .all()
+  )
+
+  return query
+
+
+def merge_crop_calculated_humidity(results: list[list]) -> list[dict]:
+
+  """
+  Merge the crop aggregates of several shards, bucket by bucket.
+
+  A collector is on a single shard, so the collectors add up, and the means are
+  weighted by the number of readings.
+
+  Parameters
+  ----------
+  results : List[List]
+    The results of `get_crop_calculated_humidity` on every shard.
+
+  Returns
+  -------
+  List[Dict]
+    The merged buckets, with the fields of `get_crop_calculated_humidity`, ordered by date.
+  """
+
+  buckets = {}
+  for row in (row for rows in results for row in rows):
+    row = row if isinstance(row, dict) else row._asdict()
+    bucket = buckets.get(row["calculation_date"])
+    if bucket is None:
+      buckets[row["calculation_date"]] = {**row, "humidity_mean": float(row["humidity_mean"]) * row["samples"]}
+      continue
+    bucket["humidity_mean"] += float(row["humidity_mean"]) * row["samples"]
+    bucket["humidity_min"] = min(bucket["humidity_min"], row["humidity_min"])
+    bucket["humidity_max"] = max(bucket["humidity_max"], row["humidity_max"])
+    bucket["collectors"] += row["collectors"]
+    bucket["samples"] += row["samples"]
+
+  for bucket in buckets.values():
+    bucket["humidity_mean"] /= bucket["samples"]
+
+  return [buckets[date] for date in sorted(buckets)]
+
+
+def get_overview(db: Session, collector_ids: list[int]):
+
+  """
+  Retrieve the latest reading and latest calculated humidity of several collectors.
+
+  The latest values are fetched per collector with a lateral `ORDER BY ... LIMIT 1`
+  on the primary key, so the cost grows with the number of collectors and not with
+  the number of records.
+
+  Parameters
+  ----------
+  db : Session
+    The database session.
+  collector_ids : List[int]
+    The IDs of the collectors, usually every collector in the registry.
+
+  Returns
+  -------
+  List[Tuple]
+    A list of tuples, one per collector, with the following fields:
+      - "collector_id": The ID of the collector.
+      - "collection_date", "read_humidity", "quality_flags": The latest record of the collector.
+      - "calculation_date", "humidity_percentage": The latest calculated humidity of the collector.
+  """
+
+  if not collector_ids:
+    return []
+
+  # SQLite has no LATERAL, the latest values are correlated subqueries on the primary keys
+  if dialect.is_sqlite(db):
+    collectors = (
+      select(models.CollectorStatus.collector_id)
+        .where(models.CollectorStatus.collector_id.in_(collector_ids))
+        .distinct()
+    ).subquery()
+
+    def latest(model, date, value):
+      return (
+        select(value)
+          .where(model.collector_id == collectors.c.collector_id)
+          .order_by(date.desc())
+          .limit(1)
+      ).scalar_subquery().label(value.key)
+
+    record_date = models.CollectorRecord.collection_date
+    humidity_date = models.CalculatedHumidity.calculation_date
+    return (
+      db.query(
+        collectors.c.collector_id,
+        latest(models.CollectorRecord, record_date, record_date),
+        latest(models.CollectorRecord, record_date, models.CollectorRecord.read_humidity),
+        latest(models.CollectorRecord, record_date, models.CollectorRecord.quality_flags),
+        latest(models.CalculatedHumidity, humidity_date, humidity_date),
+        latest(models.CalculatedHumidity, humidity_date, models.CalculatedHumidity.humidity_percentage),
+      )
+      .order_by(collectors.c.collector_id)
+      .all()
+    )
+
+  collectors = values(column("collector_id", Integer), name="collectors").data([(id,) for id in collector_ids])
+
+  record = (
+    select(
+      models.CollectorRecord.collection_date,
+      models.CollectorRecord.read_humidity,
+      models.CollectorRecord.quality_flags,
+    )
+    .where(models.CollectorRecord.collector_id == collectors.c.collector_id)
+    .order_by(models.CollectorRecord.collection_date.desc())
+    .limit(1)
+  ).lateral()
+
+  humidity = (
+    select(
+      models.CalculatedHumidity.calculation_date,
+      models.CalculatedHumidity.humidity_percentage,
+    )
+    .where(models.CalculatedHumidity.collector_id == collectors.c.collector_id)
+    .order_by(models.CalculatedHumidity.calculation_date.desc())
+    .limit(1)
+  ).lateral()
+
+  query = (
+    db.query(
+      collectors.c.collector_id,
+      record.c.collection_date,
+      record.c.read_humidity,
+      record.c.quality_flags,
+      humidity.c.calculation_date,
+      humidity.c.humidity_percentage,
+    )
+    .select_from(collectors)
+    .outerjoin(record, true())
+    .outerjoin(humidity, true())
+    .order_by(collectors.c.collector_id)
+    .all()
+  )
+
+  return query
+
+
+def get_alert_rules(db: Session, offset: int = 0, limit: int = 100):
+
+  """
+  Retrieve the alert rules from the database.
+
+  Parameters
+  ----------
+  db : Session
+    The database session.
+  offset : int, optional
+    The number of rules to skip. Defaults to 0.
+  limit : int, optional
+    The maximum number of rules to retrieve. Defaults to 100.
+
+  Returns
+  -------
+  List[AlertRule]
+    A list of AlertRule objects ordered by ID.
+  """
+
+  query = (
+    db.query(models.AlertRule)
+      .order_by(models.AlertRule.rule_id)
+      .offset(offset)
+      .limit(limit)
+      .all()
+  )
+
+  return query
+
+
+def get_alert_state(db: Session, firing: bool | None = None, offset: int = 0, limit: int = 100):
+
+  """
+  Retrieve the state of the alert rules for each collector from the database.
+
+  Parameters
+  ----------
+  db : Session
+    The database session.
+  firing : bool, optional
+    If set, only retrieve the states that are (or are not) firing.
+  offset : int, optional
+    The number of states to skip. Defaults to 0.
+  limit : int, optional
+    The maximum number of states to retrieve. Defaults to 100.
+
+  Returns
+  -------
+  List[AlertState]
+    A list of AlertState objects ordered by rule and collector ID.
+  """
+
+  query = db.query(models.AlertState)
+
+  if firing is not None:
+    query = query.filter(models.AlertState.firing.is_(firing))
+
+  return (
+    query
+      .order_by(models.AlertState.rule_id, models.AlertState.collector_id)
+      .offset(offset)
+      .limit(limit)
+      .all()
+  )
+
+
+def get_link_hourly(db: Session, start: datetime, collector_id: int | None = None):
+
+  """
+  Retrieve the hourly link telemetry rollups from the database.
+
+  Parameters
+  ----------
+  db : Session
+    The database session.
+  start : datetime
+    The start of the window, the rollups of the hours from then on are retrieved.
+  collector_id : int, optional
+    If set, only retrieve the rollups of this collector.
+
+  Returns
+  -------
+  List[CollectorLinkHourly]
+    A list of CollectorLinkHourly objects ordered by collector ID and hour.
+  """
+
+  query = db.query(models.CollectorLinkHourly).filter(models.CollectorLinkHourly.hour >= start)
+
+  if collector_id is not None:
+    query = query.filter(models.CollectorLinkHourly.collector_id == collector_id)
+
+  return (
+    query
+      .order_by(models.CollectorLinkHourly.collector_id, models.CollectorLinkHourly.hour)
+      .all()
+  )
+
+
 ##############
 ##  CREATE  ##
 ##############
@@ -383,13 +941,53 @@ def post_collector_status(db: Session, collector_id: int, status: schemas.Collec
   -------
   CollectorStatus
     A CollectorStatus object representing the newly created status record.
+
+  Raises
+  ------
+  SeasonOverlapError
+    If the new season overlaps another season of the collector, other than the open
+    one it closes.
+  IntegrityError
+    If the collector already has a status with the same start date.
   """
 
+  start_date = dialect.as_utc(status.start_date)
+  end_date = status.end_date and dialect.as_utc(status.end_date)
+
+  # A new crop ends the season still open when it is planted
+  db.query(models.CollectorStatus).filter(
+    models.CollectorStatus.collector_id == collector_id,
+    models.CollectorStatus.end_date.is_(None),
+    models.CollectorStatus.start_date < start_date,
+  ).update({"end_date": start_date}, synchronize_session=False)
+
+  # A collector grows a single crop at a time. PostgreSQL enforces it with the exclusion
+  # constraint of collector_status, SQLite (edge mode) has no range types to do the same.
+  # A status sent again (same start date) is left to the primary key.
+  overlap = db.query(models.CollectorStatus.start_date).filter(
+    models.CollectorStatus.collector_id == collector_id,
+    models.CollectorStatus.start_date != start_date,
+    or_(models.CollectorStatus.end_date.is_(None), models.CollectorStatus.end_date > start_date),
+    true() if end_date is None else models.CollectorStatus.start_date < end_date,
+  ).first()
+  if overlap is not None:
+    db.rollback()
+    raise SeasonOverlapError(f"The season overlaps the season of collector {collector_id} started at {overlap.start_date}")
+
   db_status = models.CollectorStatus(collector_id=collector_id, **status.model_dump())
   db.add(db_status)
-  db.commit()
+  try:
+    db.commit()
+  except IntegrityError as e:
+    db.rollback()
+    # A concurrent status got in first, PostgreSQL reports exclusion violations as 23P01
+    if getattr(e.orig, "pgcode", None) == "23P01":
+      raise SeasonOverlapError(f"The season overlaps another season of collector {collector_id}") from e
+    raise
   db.refresh(db_status)
 
+  registry.update_status(collector_id, db_status.crop, db_status.start_date, db_status.end_date)
+
   return db_status
 
 
@@ -411,16 +1009,246 @@ def post_collector_record(db: Session, collector_id: int, record: schemas.Collec
   -------
   CollectorRecord
     A CollectorRecord object representing the newly created record.
+    Readings that fail the data-quality checks are still stored, but with their quality flags set.
   """
 
-  db_record = models.CollectorRecord(collector_id=collector_id, **record.model_dump())
+  quality_flags, = quality.check_readings(db, [(collector_id, record.collection_date, record.read_humidity)])
+
+  # Quarantined readings must not trigger (or resolve) alerts
+  notifications = []
+  if not quality_flags:
+    notifications = alerts.evaluate(db, [(collector_id, record.collection_date, record.read_humidity)])
+
+  db_record = models.CollectorRecord(collector_id=collector_id, quality_flags=quality_flags, **record.model_dump())
   db.add(db_record)
   db.commit()
   db.refresh(db_record)
 
+  quality.record_readings([(collector_id, db_record.collection_date, db_record.read_humidity, quality_flags)])
+  registry.seen(collector_id, db_record.collection_date)
+  alerts.notify(notifications)
+
   return db_record
 
 
+def post_collector_record_batch(db: Session, records: list[tuple[int, datetime, int]]):
+
+  """
+  Create several records, of any collectors, in the database with a single insert.
+
+  Records that already exist are skipped, so a batch can safely be sent again
+  when its response was lost. Records of collectors that were never registered
+  with a status are rejected, and the collectors returned as unknown.
+
+  Parameters
+  ----------
+  db : Session
+    The database session.
+  records : List[Tuple[int, datetime, int]]
+    The records to create, as (collector ID, collection date, read humidity) tuples.
+    Plain tuples keep the binary ingest route free of per-record object creation.
+
+  Returns
+  -------
+  Dict[str, Any]
+    A dictionary with the number of records inserted, duplicated and rejected, and
+    the IDs of the unknown collectors.
+  """
+
+  rows = []
+  rejected = 0
+  known = registry.known(db, {record[0] for record in records})
+
+  readings = []
+  for collector_id, collection_date, read_humidity in records:
+    if collector_id not in known:
+      rejected += 1
+      continue
+    readings.append((collector_id, dialect.as_utc(collection_date), read_humidity))
+
+  # The data-quality and alert state expect the readings of a collector in order
+  readings.sort(key=lambda reading: reading[:2])
+
+  for (collector_id, collection_date, read_humidity), quality_flags in zip(readings, quality.check_readings(db, readings)):
+    rows.append({
+      "collector_id": collector_id,
+      "collection_date": collection_date,
+      "read_humidity": read_humidity,
+      "quality_flags": quality_flags,
+    })
+
+  inserted = []
+  if rows:
+    inserted = db.execute(
+      dialect.insert(db, models.CollectorRecord)
+        .values(rows)
+        .on_conflict_do_nothing()
+        .returning(
+          models.CollectorRecord.collector_id,
+          models.CollectorRecord.collection_date,
+          models.CollectorRecord.read_humidity,
+          models.CollectorRecord.quality_flags,
+        )
+    ).all()
+    inserted = sorted((tuple(row) for row in inserted), key=lambda row: row[:2])
+
+  # Only the inserted readings move the state, a retried batch is not counted twice.
+  # Quarantined readings must not trigger (or resolve) alerts.
+  notifications = alerts.evaluate(db, [
+    (collector_id, collection_date, read_humidity)
+    for collector_id, collection_date, read_humidity, quality_flags in inserted
+    if not quality_flags
+  ])
+
+  db.commit()
+
+  quality.record_readings(inserted)
+  for collector_id, collection_date, _, _ in inserted:
+    registry.seen(collector_id, collection_date)
+  alerts.notify(notifications)
+
+  return {
+    "inserted": len(inserted),
+    "duplicated": len(rows) - len(inserted),
+    "rejected": rejected,
+    "unknown": sorted({record[0] for record in records} - known),
+  }
+
+
+def post_collector_link_batch(db: Session, links: list[tuple[int, datetime, int, float, int, int]]):
+
+  """
+  Create several link telemetry records, of any collectors, and update their hourly rollups.
+
+  Link records that already exist are skipped and only the inserted ones are added to
+  the rollups, so a batch can safely be sent again. Records of collectors that were
+  never registered with a status are rejected, and the collectors returned as unknown.
+
+  Parameters
+  ----------
+  db : Session
+    The database session.
+  links : List[Tuple[int, datetime, int, float, int, int]]
+    The link records to create, as (collector ID, received date, RSSI, SNR, header ID,
+    duplicates) tuples.
+
+  Returns
+  -------
+  Dict[str, Any]
+    A dictionary with the number of records inserted, duplicated and rejected, and
+    the IDs of the unknown collectors.
+  """
+
+  rows = []
+  rejected = 0
+  known = registry.known(db, {link[0] for link in links})
+
+  for collector_id, received_date, rssi, snr, header_id, duplicates in links:
+    if collector_id not in known:
+      rejected += 1
+      continue
+
+    rows.append({
+      "collector_id": collector_id,
+      "received_date": received_date,
+      "rssi": rssi,
+      "snr": snr,
+      "header_id": header_id,
+      "duplicates": duplicates,
+    })
+
+  inserted = []
+  if rows:
+    inserted = db.execute(
+      dialect.insert(db, models.CollectorLink)
+        .values(rows)
+        .on_conflict_do_nothing()
+        .returning(
+          models.CollectorLink.collector_id,
+          models.CollectorLink.received_date,
+          models.CollectorLink.rssi,
+          models.CollectorLink.snr,
+          models.CollectorLink.header_id,
+          models.CollectorLink.duplicates,
+        )
+    ).all()
+
+  if inserted:
+    inserted = sorted((tuple(row) for row in inserted), key=lambda row: row[:2])
+
+    # Header ID of the packet stored just before the first new one of every collector
+    first = {}
+    for row in inserted:
+      first.setdefault(row[0], row[1])
+    if dialect.is_sqlite(db):
+      # No LATERAL on SQLite, a gateway only has a few collectors
+      previous = {}
+      for collector_id, first_date in first.items():
+        header_id = (
+          db.query(models.CollectorLink.header_id)
+            .filter(models.CollectorLink.collector_id == collector_id)
+            .filter(models.CollectorLink.received_date < first_date)
+            .order_by(models.CollectorLink.received_date.desc())
+            .limit(1)
+            .scalar()
+        )
+        if header_id is not None:
+          previous[collector_id] = header_id
+    else:
+      collectors = values(
+        column("collector_id", Integer), column("first_date", DateTime(timezone=True)), name="collectors"
+      ).data(list(first.items()))
+      previous = (
+        select(models.CollectorLink.header_id)
+        .where(models.CollectorLink.collector_id == collectors.c.collector_id)
+        .where(models.CollectorLink.received_date < collectors.c.first_date)
+        .order_by(models.CollectorLink.received_date.desc())
+        .limit(1)
+      ).lateral()
+      previous = dict(
+        db.query(collectors.c.collector_id, previous.c.header_id)
+          .select_from(collectors)
+          .join(previous, true())
+          .all()
+      )
+
+    # The histograms are added element by element
+    statement = dialect.insert(db, models.CollectorLinkHourly).values(link.rollup(inserted, previous))
+    if dialect.is_sqlite(db):
+      rssi_histogram = text(
+        "(SELECT json_group_array(v) FROM (SELECT a.value + b.value AS v"
+        " FROM json_each(collector_link_hourly.rssi_histogram) AS a"
+        " JOIN json_each(excluded.rssi_histogram) AS b ON a.key = b.key ORDER BY a.key))"
+      )
+      last_date = func.max(models.CollectorLinkHourly.last_date, statement.excluded.last_date)
+    else:
+      rssi_histogram = text(
+        "ARRAY(SELECT a + b FROM unnest(collector_link_hourly.rssi_histogram, excluded.rssi_histogram)"
+        " WITH ORDINALITY AS bucket(a, b, i) ORDER BY i)"
+      )
+      last_date = func.greatest(models.CollectorLinkHourly.last_date, statement.excluded.last_date)
+    db.execute(statement.on_conflict_do_update(
+      index_elements=[models.CollectorLinkHourly.collector_id, models.CollectorLinkHourly.hour],
+      set_={
+        "packets": models.CollectorLinkHourly.packets + statement.excluded.packets,
+        "expected": models.CollectorLinkHourly.expected + statement.excluded.expected,
+        "duplicates": models.CollectorLinkHourly.duplicates + statement.excluded.duplicates,
+        "snr_sum": models.CollectorLinkHourly.snr_sum + statement.excluded.snr_sum,
+        "rssi_histogram": rssi_histogram,
+        "last_date": last_date,
+      },
+    ))
+
+  db.commit()
+
+  return {
+    "inserted": len(inserted),
+    "duplicated": len(rows) - len(inserted),
+    "rejected": rejected,
+    "unknown": sorted({link[0] for link in links} - known),
+  }
+
+
 def post_collector_calculated_humidity(db: Session, collector_id: int, calculated_humidity: schemas.CalculatedHumidityBase):
   
   """
@@ -473,3 +1301,32 @@ def post_receptor_status(db: Session, status: schemas.ReceptorStatus):
   db.refresh(db_status)
 
   return db_status
+
+
+
+def post_alert_rule(db: Session, rule: schemas.AlertRuleBase):
+
+  """
+  Create a new alert rule in the database.
+
+  Parameters
+  ----------
+  db : Session
+    The database session.
+  rule : AlertRuleBase
+    An AlertRuleBase object representing the rule to create.
+
+  Returns
+  -------
+  AlertRule
+    An AlertRule object representing the newly created rule.
+  """
+
+  db_rule = models.AlertRule(**rule.model_dump())
+  db.add(db_rule)
+  db.commit()
+  db.refresh(db_rule)
+
+  alerts.invalidate_rules()
+
+  return db_rule
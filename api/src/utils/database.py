@@ -7,6 +7,7 @@
 ################
 
 import json
+import os
 
 
 ################
@@ -14,7 +15,7 @@ import json
 ################
 
 # SQLAlchemy
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
@@ -27,14 +28,56 @@ from sqlalchemy.orm import sessionmaker
 # Credentials
 CREDENTIALS_PATH = "credentials.json"
 
-with open(CREDENTIALS_PATH, "r") as f:
-  credentials = json.load(f)
+# Edge mode: on a farm gateway the API runs against an embedded SQLite database, e.g.
+# DATABASE_URL=sqlite:////var/lib/soil/edge.db, and replicates to the central API
+# (see utils/replication.py). Without it, the central PostgreSQL is used.
+DATABASE_URL = os.environ.get("DATABASE_URL")
 
-# PostgreSQL connection
-POSTGRESQL_URL = f"postgresql://{credentials['user']}:{credentials['password']}@{credentials['host']}:{credentials['port']}/{credentials['database']}"
+# Read replicas of the primary, as a comma separated DATABASE_REPLICA_URLS or the
+# replica_hosts of the credentials (same user, password, port and database)
+REPLICA_URLS = [url for url in os.environ.get("DATABASE_REPLICA_URLS", "").split(",") if url]
+
+# Shards after the primary, as a comma separated DATABASE_SHARD_URLS or the shard_hosts
+# of the credentials, see utils/shards.py
+SHARD_URLS = [url for url in os.environ.get("DATABASE_SHARD_URLS", "").split(",") if url]
+
+if DATABASE_URL is None:
+  with open(CREDENTIALS_PATH, "r") as f:
+    credentials = json.load(f)
+
+  # PostgreSQL connection
+  DATABASE_URL = f"postgresql://{credentials['user']}:{credentials['password']}@{credentials['host']}:{credentials['port']}/{credentials['database']}"
+  REPLICA_URLS = REPLICA_URLS or [
+    f"postgresql://{credentials['user']}:{credentials['password']}@{host}:{credentials['port']}/{credentials['database']}"
+    for host in credentials.get("replica_hosts", [])
+  ]
+  SHARD_URLS = SHARD_URLS or [
+    f"postgresql://{credentials['user']}:{credentials['password']}@{host}:{credentials['port']}/{credentials['database']}"
+    for host in credentials.get("shard_hosts", [])
+  ]
+
+EDGE = DATABASE_URL.startswith("sqlite")
 
 # SQLAlchemy
-engine = create_engine(POSTGRESQL_URL)
+if EDGE:
+  # The requests run on several threads, SQLite serializes the writes itself
+  engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False, "timeout": 30})
+
+  @event.listens_for(engine, "connect")
+  def configure_sqlite(connection, _):
+    # WAL lets the dashboards read while the receptor uploads, and survives power cuts
+    cursor = connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+else:
+  engine = create_engine(DATABASE_URL)
+
+# A replica that does not answer quickly is skipped, see utils/replicas.py
+replica_engines = [] if EDGE else [
+  create_engine(url, connect_args={"connect_timeout": 3}) for url in REPLICA_URLS
+]
 
 # Session
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -0,0 +1,143 @@
+################################################################################
+##                                  LIBRARIES                                 ##
+################################################################################
+
+################
+##  BUILT-IN  ##
+################
+
+from datetime import datetime, timezone
+
+
+################
+##  EXTERNAL  ##
+################
+
+from sqlalchemy import JSON, DateTime
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.functions import FunctionElement
+from sqlalchemy.types import TypeDecorator
+
+
+
+################################################################################
+##                                  DIALECTS                                  ##
+################################################################################
+
+# The API runs against PostgreSQL and, in edge mode, against SQLite. The few constructs
+# that differ between them are here, the queries that cannot be written for both
+# branch on `is_sqlite`.
+
+def is_sqlite(db: Session) -> bool:
+
+  """
+  Check if a session is bound to a SQLite database (edge mode).
+  """
+
+  return db.get_bind().dialect.name == "sqlite"
+
+
+def insert(db: Session, model):
+
+  """
+  Build an INSERT of the dialect of the session, both support ON CONFLICT and RETURNING.
+
+  Parameters
+  ----------
+  db : Session
+    The database session.
+  model
+    The model (or table) to insert into.
+
+  Returns
+  -------
+  Insert
+    A PostgreSQL or SQLite Insert construct.
+  """
+
+  return (sqlite.insert if is_sqlite(db) else postgresql.insert)(model)
+
+
+
+def as_utc(date: datetime) -> datetime:
+
+  """
+  Give a date a time zone, dates without one are taken as UTC.
+
+  The dates read from the database always have one, comparing them with a date
+  sent without one would raise a TypeError.
+  """
+
+  return date if date.tzinfo is not None else date.replace(tzinfo=timezone.utc)
+
+
+
+################################################################################
+##                                    TYPES                                   ##
+################################################################################
+
+class UTCDateTime(TypeDecorator):
+
+  """
+  A DateTime that keeps its time zone on SQLite.
+
+  PostgreSQL stores `timestamptz` columns itself. SQLite stores dates as text and drops
+  the time zone, so they are converted to UTC and written with an explicit offset, which
+  also keeps the dates built into JSON by `json_agg` unambiguous.
+  """
+
+  impl = DateTime
+  cache_ok = True
+
+  STORAGE_FORMAT = "%(year)04d-%(month)02d-%(day)02dT%(hour)02d:%(minute)02d:%(second)02d.%(microsecond)06d+00:00"
+  REGEXP = r"(\d+)-(\d+)-(\d+)[T ](\d+):(\d+):(\d+)(?:\.(\d+))?"
+
+
+  def load_dialect_impl(self, dialect):
+    if dialect.name == "sqlite":
+      return dialect.type_descriptor(sqlite.DATETIME(storage_format=self.STORAGE_FORMAT, regexp=self.REGEXP))
+    return dialect.type_descriptor(self.impl)
+
+
+  def process_bind_param(self, value: datetime | None, dialect):
+    if dialect.name == "sqlite" and value is not None and value.tzinfo is not None:
+      value = value.astimezone(timezone.utc)
+    return value
+
+
+  def process_result_value(self, value: datetime | None, dialect):
+    if dialect.name == "sqlite" and value is not None:
+      value = value.replace(tzinfo=timezone.utc)
+    return value
+
+
+
+################################################################################
+##                                  FUNCTIONS                                 ##
+################################################################################
+
+class json_agg(FunctionElement):
+
+  """
+  Aggregate the rows of a group into a list of objects.
+
+  `json_agg("crop", table.c.crop, ...)` takes the keys and values in turn, as
+  `json_build_object`. It is `array_agg(json_build_object(...))` on PostgreSQL and
+  `json_group_array(json_object(...))` on SQLite, read back as a list of dictionaries.
+  """
+
+  name = "json_agg"
+  type = JSON()
+  inherit_cache = True
+
+
+@compiles(json_agg, "postgresql")
+def _json_agg_postgresql(element, compiler, **kw):
+  return f"array_agg(json_build_object({compiler.process(element.clauses, **kw)}))"
+
+
+@compiles(json_agg, "sqlite")
+def _json_agg_sqlite(element, compiler, **kw):
+  return f"json_group_array(json_object({compiler.process(element.clauses, **kw)}))"
@@ -0,0 +1,153 @@
+################################################################################
+##                                  LIBRARIES                                 ##
+################################################################################
+
+################
+##  BUILT-IN  ##
+################
+
+from datetime import datetime
+
+
+################
+##  EXTERNAL  ##
+################
+
+import numpy as np
+
+
+
+################################################################################
+##                                  CONSTANTS                                 ##
+################################################################################
+
+# RSSI histogram of the hourly rollups, percentiles of any window are computed from
+# the sum of the histograms of its hours
+RSSI_MIN = -150   # dBm, lower edge of the first bucket, weaker packets go in it
+RSSI_STEP = 2     # dB per bucket
+RSSI_BUCKETS = 66 # up to -18 dBm, stronger packets go in the last bucket
+
+# The header ID is 8 bits and grows by one per frame. A larger jump is taken as a
+# reboot of the collector (or an outage too long to count) and not as lost frames.
+MAX_GAP = 128
+
+
+
+################################################################################
+##                                   ROLLUP                                   ##
+################################################################################
+
+def rollup(links: list[tuple[int, datetime, int, float, int, int]], previous: dict[int, int]) -> list[dict]:
+
+  """
+  Aggregate link telemetry into hourly rows per collector.
+
+  The frames a collector sent are estimated from the gaps between the header IDs of
+  consecutive packets. A repeated header ID is a retransmission the receptor stored
+  twice (its ACK was lost) and counts as a duplicate instead of a packet.
+
+  Parameters
+  ----------
+  links : List[Tuple[int, datetime, int, float, int, int]]
+    The new link records as (collector ID, received date, RSSI, SNR, header ID, duplicates)
+    tuples, sorted by collector and date.
+  previous : Dict[int, int]
+    The header ID of the latest stored packet of each collector, before the new ones.
+
+  Returns
+  -------
+  List[Dict]
+    One row per collector and hour, with the columns of `collector_link_hourly`.
+  """
+
+  rows = {}
+  last_id = dict(previous)
+
+  for collector_id, received_date, rssi, snr, header_id, duplicates in links:
+    hour = received_date.replace(minute=0, second=0, microsecond=0)
+    row = rows.get((collector_id, hour))
+    if row is None:
+      row = rows[collector_id, hour] = {
+        "collector_id": collector_id,
+        "hour": hour,
+        "packets": 0,
+        "expected": 0,
+        "duplicates": 0,
+        "snr_sum": 0.0,
+        "rssi_histogram": [0] * RSSI_BUCKETS,
+        "last_date": received_date,
+      }
+
+    row["duplicates"] += duplicates
+    row["last_date"] = max(row["last_date"], received_date)
+
+    gap = None if collector_id not in last_id else (header_id - last_id[collector_id]) % 256
+    last_id[collector_id] = header_id
+    if gap == 0:
+      row["duplicates"] += 1
+      continue
+
+    row["packets"] += 1
+    row["expected"] += gap if gap is not None and gap <= MAX_GAP else 1
+    row["snr_sum"] += float(snr) # Numeric columns come back as Decimal
+    bucket = (rssi - RSSI_MIN) // RSSI_STEP
+    row["rssi_histogram"][min(max(bucket, 0), RSSI_BUCKETS - 1)] += 1
+
+  return list(rows.values())
+
+
+
+################################################################################
+##                                   SUMMARY                                  ##
+################################################################################
+
+def percentiles(histogram: np.ndarray, quantiles: tuple[int, ...]) -> list[float | None]:
+
+  """
+  Estimate RSSI percentiles from a histogram, at the center of the bucket that holds them.
+  """
+
+  total = int(histogram.sum())
+  if not total:
+    return [None] * len(quantiles)
+
+  cumulative = np.cumsum(histogram)
+  buckets = np.searchsorted(cumulative, np.asarray(quantiles) * total / 100)
+  return (RSSI_MIN + (buckets + 0.5) * RSSI_STEP).tolist()
+
+
+def summarize(rows: list) -> dict:
+
+  """
+  Combine hourly rollup rows into the link health of a window.
+
+  Parameters
+  ----------
+  rows : List
+    Rows of `collector_link_hourly`, of one or several collectors and hours.
+
+  Returns
+  -------
+  Dict
+    A dictionary with the number of packets, expected frames and duplicates, the
+    estimated loss, the RSSI percentiles and the mean SNR.
+  """
+
+  packets = sum(row.packets for row in rows)
+  expected = sum(row.expected for row in rows)
+  histogram = np.zeros(RSSI_BUCKETS, dtype=np.int64)
+  for row in rows:
+    histogram[:len(row.rssi_histogram)] += np.asarray(row.rssi_histogram, dtype=np.int64)
+
+  p10, p50, p90 = percentiles(histogram, (10, 50, 90))
+
+  return {
+    "packets": packets,
+    "expected": expected,
+    "duplicates": sum(row.duplicates for row in rows),
+    "loss": round(1 - packets / expected, 4) if expected else None,
+    "rssi_p10": p10,
+    "rssi_p50": p50,
+    "rssi_p90": p90,
+    "snr_mean": round(float(sum(row.snr_sum for row in rows)) / packets, 2) if packets else None,
+  }
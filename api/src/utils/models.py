@@ -6,13 +6,15 @@
 ##  INTERNAL  ##
 ################
 
-from .database import Base
+from .database import Base, EDGE
+from .dialect import UTCDateTime
 
 ################
 ##  EXTERNAL  ##
 ################
 
-from sqlalchemy import Column, DateTime, Integer, String, Numeric
+from sqlalchemy import JSON, Boolean, Column, Computed, DDL, Index, Integer, String, Numeric, SmallInteger, event
+from sqlalchemy.dialects.postgresql import ARRAY, ExcludeConstraint, TSTZRANGE
 
 
 
@@ -20,33 +22,126 @@ from sqlalchemy import Column, DateTime, Integer, String, Numeric
 ##                                   MODELS                                   ##
 ################################################################################
 
+# The exclusion constraint on the crop seasons needs `=` on integers in a GiST index
+event.listen(Base.metadata, "before_create", DDL("CREATE EXTENSION IF NOT EXISTS btree_gist").execute_if(dialect="postgresql"))
+
+# SQLite (edge mode) gets calculated_humidity as the view of aws/rds/sql/create_tables.sql,
+# the table of the model is left out of the metadata below
+event.listen(Base.metadata, "after_create", DDL("""
+  CREATE VIEW IF NOT EXISTS calculated_humidity AS
+  SELECT
+      collector_id
+    , collection_date AS calculation_date
+    , ROUND(MIN(100 * (65535 - CAST(read_humidity AS REAL)) / 42106, 100.0), 2) AS humidity_percentage
+  FROM collector_record
+  WHERE quality_flags = 0
+""").execute_if(dialect="sqlite"))
+
+
 class CollectorStatus(Base):
   __tablename__ = "collector_status"
 
   collector_id = Column(Integer, primary_key=True)
-  start_date = Column(DateTime, primary_key=True)
-  end_date = Column(DateTime, nullable=True)
+  start_date = Column(UTCDateTime(timezone=True), primary_key=True)
+  end_date = Column(UTCDateTime(timezone=True), nullable=True)
   crop = Column(String)
 
+  # SQLite has no range types, the edge queries compare start_date and end_date instead
+  if not EDGE:
+    season = Column(TSTZRANGE, Computed("tstzrange(start_date, end_date, '[)')", persisted=True))
+
+    __table_args__ = (
+      # A collector grows a single crop at a time
+      ExcludeConstraint(
+        (collector_id, "="),
+        (season, "&&"),
+        name="collector_status_season_excl",
+        using="gist",
+      ),
+      Index("collector_status_crop_season_idx", crop, season, postgresql_using="gist"),
+    )
+
 
 class CollectorRecord(Base):
   __tablename__ = "collector_record"
 
   collector_id = Column(Integer, primary_key=True)
-  collection_date = Column(DateTime, primary_key=True)
+  collection_date = Column(UTCDateTime, primary_key=True)
   read_humidity = Column(Integer)
+  quality_flags = Column(SmallInteger, nullable=False, default=0)
   
   
 class CalculatedHumidity(Base):
   __tablename__ = "calculated_humidity"
 
   collector_id = Column(Integer, primary_key=True)
-  calculation_date = Column(DateTime, primary_key=True)
+  calculation_date = Column(UTCDateTime, primary_key=True)
   humidity_percentage = Column(Numeric(5, 2))
 
 
+if EDGE:
+  Base.metadata.remove(CalculatedHumidity.__table__)
+
+
+class CollectorLink(Base):
+  __tablename__ = "collector_link"
+
+  collector_id = Column(Integer, primary_key=True)
+  received_date = Column(UTCDateTime(timezone=True), primary_key=True)
+  rssi = Column(SmallInteger)
+  snr = Column(Numeric(4, 2))
+  header_id = Column(SmallInteger)
+  duplicates = Column(SmallInteger, nullable=False, default=0)
+
+
+class CollectorLinkHourly(Base):
+  __tablename__ = "collector_link_hourly"
+
+  collector_id = Column(Integer, primary_key=True)
+  hour = Column(UTCDateTime(timezone=True), primary_key=True)
+  packets = Column(Integer, nullable=False)
+  expected = Column(Integer, nullable=False)
+  duplicates = Column(Integer, nullable=False)
+  snr_sum = Column(Numeric(12, 2), nullable=False)
+  rssi_histogram = Column(ARRAY(Integer).with_variant(JSON(), "sqlite"), nullable=False)
+  last_date = Column(UTCDateTime(timezone=True), nullable=False)
+
+
 class ReceptorStatus(Base):
   __tablename__ = "receptor_status"
 
-  update_date = Column(DateTime, primary_key=True)
+  update_date = Column(UTCDateTime, primary_key=True)
   records_in_buffer = Column(Integer)
+
+
+class AlertRule(Base):
+  __tablename__ = "alert_rule"
+
+  rule_id = Column(Integer, primary_key=True, autoincrement=True)
+  collector_id = Column(Integer, nullable=True)
+  crop = Column(String, nullable=True)
+  condition = Column(String)
+  threshold = Column(Numeric(5, 2))
+  duration = Column(Integer)
+  webhook_url = Column(String)
+  enabled = Column(Boolean, default=True)
+
+
+class AlertState(Base):
+  __tablename__ = "alert_state"
+
+  rule_id = Column(Integer, primary_key=True)
+  collector_id = Column(Integer, primary_key=True)
+  breach_start = Column(UTCDateTime, nullable=True)
+  last_date = Column(UTCDateTime)
+  firing = Column(Boolean, default=False)
+
+
+class AlertOutbox(Base):
+  __tablename__ = "alert_outbox"
+
+  outbox_id = Column(Integer, primary_key=True, autoincrement=True)
+  webhook_url = Column(String)
+  event = Column(JSON)
+  attempts = Column(Integer, nullable=False, default=0)
+  next_attempt = Column(UTCDateTime(timezone=True), nullable=True)
@@ -0,0 +1,343 @@
+################################################################################
+##                                  LIBRARIES                                 ##
+################################################################################
+
+################
+##  BUILT-IN  ##
+################
+
+from array import array
+from datetime import datetime
+from threading import Lock
+
+
+################
+##  INTERNAL  ##
+################
+
+from . import dialect, models
+
+
+################
+##  EXTERNAL  ##
+################
+
+from sqlalchemy.orm import Session
+
+
+
+################################################################################
+##                                  CONSTANTS                                 ##
+################################################################################
+
+# Quality flags (bitmask stored in collector_record.quality_flags)
+FLAG_OUT_OF_RANGE = 0x01 # Reading outside of the physically possible ADC range
+FLAG_SPIKE = 0x02        # Reading too far from the rolling median (median/MAD)
+FLAG_STUCK = 0x04        # Same raw value repeated too many times in a row
+FLAG_JUMP = 0x08         # Change from the previous reading faster than soil allows
+
+FLAG_NAMES = {
+  FLAG_OUT_OF_RANGE: "out_of_range",
+  FLAG_SPIKE: "spike",
+  FLAG_STUCK: "stuck",
+  FLAG_JUMP: "jump",
+}
+
+# Sensor calibration, must match the calculated_humidity view
+ADC_DRY = 65535 # 0%
+ADC_WET = 23429 # 100%
+
+# Valid ADC range, anything well below the wet point means a shorted or disconnected probe
+ADC_MIN = 20000
+ADC_MAX = 65535
+
+WINDOW_SIZE = 16     # Readings kept per collector
+MIN_SAMPLES = 5      # Readings required before spikes are detected
+SPIKE_THRESHOLD = 6  # Number of (scaled) MADs away from the median to be a spike
+MAD_FLOOR = 256      # Minimum MAD in ADC counts, avoids flagging noise on flat signals
+MAD_SCALE = 1.4826   # Makes the MAD comparable to a standard deviation
+STUCK_COUNT = 8      # Identical consecutive readings to consider the sensor stuck
+MAX_RATE = 500       # Maximum plausible change in ADC counts per second
+
+
+
+################################################################################
+##                                   WINDOW                                   ##
+################################################################################
+
+class CollectorWindow:
+
+  """
+  Rolling state of the most recent readings of a single collector.
+
+  The readings are kept in a fixed-size circular buffer backed by an `array`,
+  so updating the state is O(1) in memory and O(w log w) to compute the median
+  over the window of size w.
+  """
+
+  __slots__ = ("values", "index", "count", "last_value", "last_date", "repeats")
+
+  def __init__(self, size: int = WINDOW_SIZE):
+    self.values = array("i", [0] * size)
+    self.index = 0
+    self.count = 0
+    self.last_value = None
+    self.last_date = None
+    self.repeats = 0
+
+
+  def push(self, value: int, date: datetime):
+
+    """
+    Add a reading to the window.
+
+    Parameters
+    ----------
+    value : int
+      The raw ADC reading.
+    date : datetime
+      The collection date of the reading.
+    """
+
+    self.values[self.index] = value
+    self.index = (self.index + 1) % len(self.values)
+    self.count = min(self.count + 1, len(self.values))
+
+    # Late readings still count for the median, but not for the sequence checks
+    if self.last_date is not None and date <= self.last_date:
+      return
+
+    if value == self.last_value:
+      self.repeats += 1
+    else:
+      self.repeats = 1
+
+    self.last_value = value
+    self.last_date = date
+
+
+  def copy(self) -> "CollectorWindow":
+
+    """
+    Copy the window, to check readings without changing it.
+    """
+
+    window = CollectorWindow(len(self.values))
+    window.values[:] = self.values
+    window.index = self.index
+    window.count = self.count
+    window.last_value = self.last_value
+    window.last_date = self.last_date
+    window.repeats = self.repeats
+    return window
+
+
+  def median_mad(self) -> tuple[float, float]:
+
+    """
+    Compute the median and the median absolute deviation of the window.
+
+    Returns
+    -------
+    Tuple[float, float]
+      The median and the MAD of the readings in the window.
+    """
+
+    values = sorted(self.values[:self.count])
+    median = _median(values)
+    mad = _median(sorted(abs(value - median) for value in values))
+    return median, mad
+
+
+  def inspect(self, value: int, date: datetime) -> int:
+
+    """
+    Compute the quality flags of a new reading against the current state.
+
+    Parameters
+    ----------
+    value : int
+      The raw ADC reading.
+    date : datetime
+      The collection date of the reading.
+
+    Returns
+    -------
+    int
+      A bitmask of quality flags, 0 if the reading looks valid.
+    """
+
+    if not ADC_MIN <= value <= ADC_MAX:
+      return FLAG_OUT_OF_RANGE
+
+    flags = 0
+
+    if self.count >= MIN_SAMPLES:
+      median, mad = self.median_mad()
+      if abs(value - median) > SPIKE_THRESHOLD * max(MAD_SCALE * mad, MAD_FLOOR):
+        flags |= FLAG_SPIKE
+
+    # Readings arriving out of order can't be compared to the previous one
+    if self.last_date is not None and date > self.last_date:
+      if value == self.last_value and self.repeats + 1 >= STUCK_COUNT:
+        flags |= FLAG_STUCK
+
+      elapsed = (date - self.last_date).total_seconds()
+      if abs(value - self.last_value) > MAX_RATE * max(elapsed, 1):
+        flags |= FLAG_JUMP
+
+    return flags
+
+
+def _median(values: list) -> float:
+  middle = len(values) // 2
+  if len(values) % 2:
+    return values[middle]
+  return (values[middle - 1] + values[middle]) / 2
+
+
+
+################################################################################
+##                                   STATE                                    ##
+################################################################################
+
+_windows: dict[int, CollectorWindow] = {}
+_lock = Lock()
+
+
+def _load_window(db: Session, collector_id: int) -> CollectorWindow:
+
+  """
+  Seed the window of a collector with its most recent valid readings.
+
+  This is done once per collector and process (or by every request that sees a new
+  collector at the same time, the first window stored is kept), after that the
+  window is kept up to date by `record_readings`.
+  """
+
+  window = CollectorWindow()
+
+  rows = (
+    db.query(models.CollectorRecord.read_humidity, models.CollectorRecord.collection_date)
+      .filter(models.CollectorRecord.collector_id == collector_id)
+      .filter(models.CollectorRecord.quality_flags.op("&")(FLAG_OUT_OF_RANGE) == 0)
+      .order_by(models.CollectorRecord.collection_date.desc())
+      .limit(WINDOW_SIZE)
+      .all()
+  )
+
+  for read_humidity, collection_date in reversed(rows):
+    window.push(read_humidity, collection_date)
+
+  return window
+
+
+def _copy_windows(db: Session, collector_ids: set[int]) -> dict[int, CollectorWindow]:
+  # The windows not seen yet are loaded without the lock, a slow query must not hold
+  # up the other requests. A window loaded meanwhile by another request is kept.
+  with _lock:
+    missing = [collector_id for collector_id in collector_ids if collector_id not in _windows]
+
+  loaded = {collector_id: _load_window(db, collector_id) for collector_id in missing}
+
+  with _lock:
+    for collector_id, window in loaded.items():
+      _windows.setdefault(collector_id, window)
+    return {collector_id: _windows[collector_id].copy() for collector_id in collector_ids}
+
+
+def check_readings(db: Session, readings: list[tuple[int, datetime, int]]) -> list[int]:
+
+  """
+  Run new readings through the data-quality stage, without updating the collector state.
+
+  The readings are checked in turn against a copy of the state, so a batch is checked
+  as if they came one by one. The state itself is only updated by `record_readings`,
+  once the readings are stored, so a reading that is never stored (a duplicate, or a
+  failed transaction) does not count twice.
+
+  Parameters
+  ----------
+  db : Session
+    The database session, only used the first time a collector is seen.
+  readings : List[Tuple[int, datetime, int]]
+    The readings, as (collector ID, collection date, raw ADC reading) tuples, in
+    collection order. Dates without a time zone are taken as UTC.
+
+  Returns
+  -------
+  List[int]
+    The bitmask of quality flags of every reading, 0 if the reading looks valid.
+  """
+
+  flags = []
+  scratch = _copy_windows(db, {collector_id for collector_id, _, _ in readings})
+
+  for collector_id, date, value in readings:
+    window = scratch[collector_id]
+
+    date = dialect.as_utc(date)
+    flags.append(window.inspect(value, date))
+    if not flags[-1] & FLAG_OUT_OF_RANGE:
+      window.push(value, date)
+
+  return flags
+
+
+def record_readings(readings: list[tuple[int, datetime, int, int]]):
+
+  """
+  Update the collector state with stored readings, called once they have been committed.
+
+  Parameters
+  ----------
+  readings : List[Tuple[int, datetime, int, int]]
+    The readings, as (collector ID, collection date, raw ADC reading, quality flags)
+    tuples, in collection order.
+  """
+
+  with _lock:
+    for collector_id, date, value, flags in readings:
+      # Out of range readings are garbage, keep them away from the statistics.
+      # Everything else goes in, so real level changes are followed by the median.
+      window = _windows.get(collector_id)
+      if window is not None and not flags & FLAG_OUT_OF_RANGE:
+        window.push(value, dialect.as_utc(date))
+
+
+def flag_names(flags: int) -> list[str]:
+
+  """
+  Convert a bitmask of quality flags to their names.
+
+  Parameters
+  ----------
+  flags : int
+    A bitmask of quality flags.
+
+  Returns
+  -------
+  List[str]
+    The names of the flags that are set.
+  """
+
+  return [name for flag, name in FLAG_NAMES.items() if flags & flag]
+
+
+def humidity_percentage(read_humidity: int) -> float:
+
+  """
+  Convert a raw ADC reading to a humidity percentage, as the calculated_humidity view does.
+
+  Parameters
+  ----------
+  read_humidity : int
+    The raw ADC reading.
+
+  Returns
+  -------
+  float
+    The humidity percentage, rounded to 2 decimal places.
+  """
+
+  return round(min(100 * (ADC_DRY - read_humidity) / (ADC_DRY - ADC_WET), 100.0), 2)
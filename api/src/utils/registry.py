@@ -0,0 +1,286 @@
+################################################################################
+##                                  LIBRARIES                                 ##
+################################################################################
+
+################
+##  BUILT-IN  ##
+################
+
+import time
+from datetime import datetime
+from threading import Lock
+from typing import NamedTuple
+
+
+################
+##  INTERNAL  ##
+################
+
+from . import dialect, models
+from .shards import shards
+
+
+################
+##  EXTERNAL  ##
+################
+
+from sqlalchemy import Integer, and_, column, func, select, true, values
+from sqlalchemy.orm import Session
+
+
+
+################################################################################
+##                                  CONSTANTS                                 ##
+################################################################################
+
+REGISTRY_TTL = 300 # seconds between full reloads
+UNKNOWN_TTL = 5    # seconds before an unknown collector may trigger a reload
+
+
+
+################################################################################
+##                                  REGISTRY                                  ##
+################################################################################
+
+class Status(NamedTuple):
+  crop: str
+  start_date: datetime
+  end_date: datetime | None
+
+
+class CollectorRegistry:
+
+  """
+  In-process index of the known collectors.
+
+  Keeps the most recent `collector_status` row of every collector (the active
+  ones have no `end_date`) and the date of its latest record. It is loaded
+  lazily, kept up to date by the create routes of this process and reloaded
+  every `REGISTRY_TTL` seconds to pick up changes made by other processes.
+  """
+
+  def __init__(self, ttl: float = REGISTRY_TTL):
+    self.ttl = ttl
+    self._status: dict[int, Status] = {}
+    self._last_seen: dict[int, datetime] = {}
+    self._loaded = None
+    self._lock = Lock()
+
+
+  def _load(self, db: Session):
+    # Every shard has the statuses and records of its own collectors
+    status, last_seen = {}, {}
+    for shard_status, shard_last_seen in (shards.fan_out(self._query) if shards.sharded else [self._query(db)]):
+      status.update(shard_status)
+      last_seen.update(shard_last_seen)
+
+    self._status = status
+    self._last_seen = last_seen
+    self._loaded = time.monotonic()
+
+
+  def _query(self, db: Session, collector_ids: set[int] | None = None) -> tuple[dict[int, Status], dict[int, datetime]]:
+    # Every collector, or only the given ones
+    where = true() if collector_ids is None else models.CollectorStatus.collector_id.in_(collector_ids)
+
+    if dialect.is_sqlite(db):
+      # No DISTINCT ON nor LATERAL on SQLite, a gateway only has a few collectors
+      latest = (
+        db.query(models.CollectorStatus.collector_id, func.max(models.CollectorStatus.start_date).label("start_date"))
+          .filter(where)
+          .group_by(models.CollectorStatus.collector_id)
+          .subquery()
+      )
+      rows = (
+        db.query(models.CollectorStatus)
+          .join(latest, and_(
+            models.CollectorStatus.collector_id == latest.c.collector_id,
+            models.CollectorStatus.start_date == latest.c.start_date,
+          ))
+          .all()
+      )
+    else:
+      rows = (
+        db.query(models.CollectorStatus)
+          .filter(where)
+          .distinct(models.CollectorStatus.collector_id)
+          .order_by(models.CollectorStatus.collector_id, models.CollectorStatus.start_date.desc())
+          .all()
+      )
+    status = {row.collector_id: Status(row.crop, row.start_date, row.end_date) for row in rows}
+
+    last_seen = {}
+    if status and dialect.is_sqlite(db):
+      last_seen = dict(
+        db.query(models.CollectorRecord.collector_id, func.max(models.CollectorRecord.collection_date))
+          .filter(models.CollectorRecord.collector_id.in_(list(status)))
+          .group_by(models.CollectorRecord.collector_id)
+          .all()
+      )
+    elif status:
+      collectors = values(column("collector_id", Integer), name="collectors").data([(id,) for id in status])
+      latest = (
+        select(func.max(models.CollectorRecord.collection_date).label("collection_date"))
+          .where(models.CollectorRecord.collector_id == collectors.c.collector_id)
+      ).lateral()
+      last_seen = {
+        row.collector_id: row.collection_date
+        for row in db.query(collectors.c.collector_id, latest.c.collection_date).select_from(collectors).join(latest, true())
+        if row.collection_date is not None
+      }
+
+    return status, last_seen
+
+
+  def _ensure(self, db: Session, max_age: float | None = None):
+    age = None if self._loaded is None else time.monotonic() - self._loaded
+    if age is None or age > (self.ttl if max_age is None else max_age):
+      self._load(db)
+
+
+  def status(self, db: Session) -> dict[int, Status]:
+
+    """
+    Retrieve the most recent status of every known collector.
+
+    Parameters
+    ----------
+    db : Session
+      The database session, only used when the registry is stale.
+
+    Returns
+    -------
+    Dict[int, Status]
+      The most recent status of each collector, by collector ID.
+    """
+
+    with self._lock:
+      self._ensure(db)
+      return dict(self._status)
+
+
+  def is_known(self, db: Session, collector_id: int) -> bool:
+
+    """
+    Check if a collector has been registered (has at least one status).
+
+    Unknown collectors trigger a reload at most once every `UNKNOWN_TTL` seconds,
+    so a flood of readings from a bad ID never reaches the database.
+
+    Parameters
+    ----------
+    db : Session
+      The database session, only used when the registry is stale.
+    collector_id : int
+      The ID of the collector.
+
+    Returns
+    -------
+    bool
+      True if the collector is known.
+    """
+
+    with self._lock:
+      self._ensure(db)
+      if collector_id not in self._status:
+        self._ensure(db, max_age=UNKNOWN_TTL)
+      return collector_id in self._status
+
+
+  def known(self, db: Session, collector_ids: set[int]) -> set[int]:
+
+    """
+    Find which of several collectors have been registered (have at least one status).
+
+    The collectors missing from the registry are looked up in the database in a
+    single query, another process may have registered them since the last reload.
+    Used by the batch uploads, which are rate limited, so the lookup is not throttled.
+
+    Parameters
+    ----------
+    db : Session
+      The database session, bound to the shard of the collectors.
+    collector_ids : Set[int]
+      The IDs of the collectors.
+
+    Returns
+    -------
+    Set[int]
+      The IDs of the known collectors.
+    """
+
+    with self._lock:
+      self._ensure(db)
+      missing = collector_ids - self._status.keys()
+      if missing:
+        status, last_seen = self._query(db, missing)
+        self._status.update(status)
+        self._last_seen.update(last_seen)
+      return collector_ids & self._status.keys()
+
+
+  def crop(self, db: Session, collector_id: int) -> str | None:
+
+    """
+    Retrieve the crop currently planted at a collector.
+
+    Parameters
+    ----------
+    db : Session
+      The database session, only used when the registry is stale.
+    collector_id : int
+      The ID of the collector.
+
+    Returns
+    -------
+    str | None
+      The crop, or None if the collector is unknown or has no active crop.
+    """
+
+    with self._lock:
+      self._ensure(db)
+      status = self._status.get(collector_id)
+      return status.crop if status and status.end_date is None else None
+
+
+  def last_seen(self, db: Session) -> dict[int, datetime]:
+
+    """
+    Retrieve the date of the latest record of every known collector.
+    """
+
+    with self._lock:
+      self._ensure(db)
+      return dict(self._last_seen)
+
+
+  def update_status(self, collector_id: int, crop: str, start_date: datetime, end_date: datetime | None):
+
+    """
+    Register a new status of a collector, called once it has been committed.
+    """
+
+    start_date = dialect.as_utc(start_date)
+    end_date = end_date and dialect.as_utc(end_date)
+
+    with self._lock:
+      current = self._status.get(collector_id)
+      if current is None or start_date >= current.start_date:
+        self._status[collector_id] = Status(crop, start_date, end_date)
+
+
+  def seen(self, collector_id: int, date: datetime):
+
+    """
+    Register a new record of a collector, called once it has been committed.
+    """
+
+    date = dialect.as_utc(date)
+
+    with self._lock:
+      last = self._last_seen.get(collector_id)
+      if last is None or date > last:
+        self._last_seen[collector_id] = date
+
+
+registry = CollectorRegistry()
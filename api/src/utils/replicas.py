@@ -0,0 +1,116 @@
+################################################################################
+##                                  LIBRARIES                                 ##
+################################################################################
+
+################
+##  BUILT-IN  ##
+################
+
+import logging
+import os
+import time
+from itertools import cycle
+from threading import Lock
+
+
+################
+##  INTERNAL  ##
+################
+
+from .database import replica_engines
+
+
+################
+##  EXTERNAL  ##
+################
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import SQLAlchemyError
+
+
+
+################################################################################
+##                                  CONSTANTS                                 ##
+################################################################################
+
+logger = logging.getLogger(__name__)
+
+# Seconds a replica may lag behind the primary and still serve reads
+MAX_REPLICA_LAG = float(os.environ.get("MAX_REPLICA_LAG", 30))
+
+LAG_CHECK_INTERVAL = 5 # Seconds between lag checks of a replica
+
+# Replication lag of a PostgreSQL standby, 0 once it replayed everything it received
+# (the replay timestamp alone grows while the primary is idle) and on a primary
+LAG_QUERY = text("""
+  SELECT COALESCE(
+    CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END,
+    0
+  )
+""")
+
+
+
+################################################################################
+##                                  REPLICAS                                  ##
+################################################################################
+
+class ReplicaSet:
+
+  """
+  Pick the read replica that serves a read-only request.
+
+  The replicas take turns. The lag of each one is checked at most every
+  `LAG_CHECK_INTERVAL` seconds, a replica that lags more than `max_lag` seconds
+  or cannot be reached is skipped until its next check. Without a healthy
+  replica the reads fall back to the primary.
+  """
+
+  def __init__(self, engines: list[Engine], max_lag: float = MAX_REPLICA_LAG):
+    self.engines = engines
+    self.max_lag = max_lag
+    self._checked: dict[Engine, tuple[float, bool]] = {}
+    self._turn = cycle(engines)
+    self._lock = Lock()
+
+
+  def _healthy(self, engine: Engine) -> bool:
+    checked = self._checked.get(engine)
+    if checked is not None and time.monotonic() - checked[0] < LAG_CHECK_INTERVAL:
+      return checked[1]
+
+    try:
+      with engine.connect() as connection:
+        healthy = float(connection.execute(LAG_QUERY).scalar()) <= self.max_lag
+    except SQLAlchemyError as error:
+      logger.warning("Replica %s unavailable: %s", engine.url.host, error)
+      healthy = False
+
+    self._checked[engine] = (time.monotonic(), healthy)
+    return healthy
+
+
+  def pick(self) -> Engine | None:
+
+    """
+    Pick the next healthy replica.
+
+    Returns
+    -------
+    Engine | None
+      The engine of the replica, or None if the primary must serve the read.
+    """
+
+    # The lag checks run outside the lock, a slow replica does not hold up the others
+    with self._lock:
+      engines = [next(self._turn) for _ in self.engines]
+
+    for engine in engines:
+      if self._healthy(engine):
+        return engine
+    return None
+
+
+replicas = ReplicaSet(replica_engines)
@@ -0,0 +1,288 @@
+################################################################################
+##                                  LIBRARIES                                 ##
+################################################################################
+
+################
+##  BUILT-IN  ##
+################
+
+import gzip
+import json
+import logging
+import os
+import socket
+import time
+from threading import Lock, Thread
+from typing import Callable, NamedTuple
+from urllib.error import HTTPError, URLError
+from urllib.request import Request, urlopen
+
+
+################
+##  INTERNAL  ##
+################
+
+from . import binary, models
+from .database import EDGE, SessionLocal, engine
+
+
+################
+##  EXTERNAL  ##
+################
+
+import numpy as np
+from sqlalchemy import Column, Integer, MetaData, String, Table, literal_column, select
+from sqlalchemy.dialects.sqlite import insert
+
+
+
+################################################################################
+##                                  CONSTANTS                                 ##
+################################################################################
+
+logger = logging.getLogger(__name__)
+
+# Base URL of the central API, e.g. https://api.example.com, replication is off without it
+CENTRAL_API_URL = os.environ.get("CENTRAL_API_URL")
+
+REPLICATION_INTERVAL = 60 # Seconds between replication passes
+BATCH_SIZE = 1000         # Rows per request, the `MAX_BATCH_SIZE` of the binary routes
+MAX_BATCHES = 100         # Requests per table and pass, the next pass goes on
+TIMEOUT = 30              # Seconds per request
+
+# Answers that mean the central API is unavailable, the batch is sent again later
+RETRY_STATUS = {408, 429}
+
+# Passes a batch with records of collectors unknown to the central API is sent again
+# (their status may still be on its way) before these records are given up
+MAX_HELD_PASSES = 10
+
+# Outcomes of a request
+SENT = "sent"           # the central API has the rows
+POSTPONED = "postponed" # the central API is unavailable, send them again later
+REJECTED = "rejected"   # some records were rejected, their collectors are unknown
+DROPPED = "dropped"     # the central API will never take the rows
+
+# The gateway is rate limited by the central API like a receptor
+RECEPTOR_ID = "edge-" + socket.gethostname()
+
+# High-water mark of every replicated table: the SQLite rowid of the latest row the
+# central API took. Kept apart from the models, the central database does not need it.
+metadata = MetaData()
+replication_state = Table(
+  "replication_state", metadata,
+  Column("name", String, primary_key=True),
+  Column("high_water", Integer, nullable=False),
+)
+
+
+
+################################################################################
+##                                   STREAMS                                  ##
+################################################################################
+
+class Stream(NamedTuple):
+  model: type
+  columns: tuple[str, ...]
+  # Rows to (path, body, content type, first rowid, last rowid) requests
+  encode: Callable[[list], list[tuple[str, bytes, str, int, int]]]
+
+
+def _epoch(rows, column):
+  return np.array([int(getattr(row, column).timestamp()) for row in rows], dtype="<u4")
+
+
+def _records(rows):
+  # The binary records carry whole seconds, the receptor readings have no fraction anyway
+  records = np.zeros(len(rows), dtype=binary.RECORD_DTYPE)
+  records["collector_id"] = [row.collector_id for row in rows]
+  records["epoch"] = _epoch(rows, "collection_date")
+  records["read_humidity"] = [row.read_humidity for row in rows]
+  return [("/collector/record/binary", gzip.compress(records.tobytes()), binary.CONTENT_TYPE, rows[0].rowid, rows[-1].rowid)]
+
+
+def _links(rows):
+  links = np.zeros(len(rows), dtype=binary.LINK_DTYPE)
+  links["collector_id"] = [row.collector_id for row in rows]
+  links["epoch"] = _epoch(rows, "received_date")
+  links["rssi"] = [row.rssi for row in rows]
+  links["snr"] = [round(row.snr * 4) for row in rows]
+  links["header_id"] = [row.header_id for row in rows]
+  links["duplicates"] = [row.duplicates for row in rows]
+  return [("/collector/link/binary", gzip.compress(links.tobytes()), binary.CONTENT_TYPE, rows[0].rowid, rows[-1].rowid)]
+
+
+def _collector_status(rows):
+  return [
+    (
+      f"/collector/{row.collector_id}/status",
+      json.dumps({"start_date": row.start_date, "end_date": row.end_date, "crop": row.crop}, default=str).encode(),
+      "application/json",
+      row.rowid,
+      row.rowid,
+    )
+    for row in rows
+  ]
+
+
+def _receptor_status(rows):
+  return [
+    (
+      "/receptor/status",
+      json.dumps({"update_date": row.update_date, "records_in_buffer": row.records_in_buffer}, default=str).encode(),
+      "application/json",
+      row.rowid,
+      row.rowid,
+    )
+    for row in rows
+  ]
+
+
+# In order: the central API rejects the records of collectors it has no status of
+STREAMS = {
+  "collector_status": Stream(models.CollectorStatus, ("collector_id", "start_date", "end_date", "crop"), _collector_status),
+  "receptor_status": Stream(models.ReceptorStatus, ("update_date", "records_in_buffer"), _receptor_status),
+  "collector_record": Stream(models.CollectorRecord, ("collector_id", "collection_date", "read_humidity"), _records),
+  "collector_link": Stream(
+    models.CollectorLink, ("collector_id", "received_date", "rssi", "snr", "header_id", "duplicates"), _links
+  ),
+}
+
+
+
+################################################################################
+##                                 REPLICATOR                                 ##
+################################################################################
+
+class Replicator:
+
+  """
+  Replicate the tables of an edge (SQLite) database to the central API from a background thread.
+
+  Every table is sent in insertion order, in batches of `BATCH_SIZE` rows, after the
+  rowid of the latest row the central API took. The ingest routes are idempotent, a
+  batch sent again after a lost answer is counted as duplicated (or answered 409) and
+  the mark moves on. While the uplink is down the mark stays put and the local API
+  keeps serving the dashboards from the SQLite database. A batch whose records the
+  central API rejected is sent again for `MAX_HELD_PASSES` passes before the mark
+  moves past it, and every row range given up is logged.
+  """
+
+  def __init__(self, url: str):
+    self.url = url.rstrip("/")
+    self._retry_after = None
+    self._held: dict[str, int] = {}
+    self._thread = None
+    self._lock = Lock()
+
+
+  def start(self):
+
+    """
+    Start the replication thread, if it is not running yet.
+    """
+
+    with self._lock:
+      if self._thread is None or not self._thread.is_alive():
+        metadata.create_all(bind=engine)
+        self._thread = Thread(target=self._run, name="replication", daemon=True)
+        self._thread.start()
+
+
+  def _run(self):
+    while True:
+      self._retry_after = None
+      try:
+        self.replicate()
+      except Exception as error:
+        logger.exception("Replication failed: %s", error)
+      # A throttled gateway comes back when the central API asked to
+      time.sleep(min(self._retry_after or REPLICATION_INTERVAL, REPLICATION_INTERVAL))
+
+
+  def replicate(self) -> bool:
+
+    """
+    Send the rows added since the previous pass, table by table.
+
+    Returns
+    -------
+    bool
+      True if every table is up to date, False if the pass stopped at an unavailable
+      central API or at rejected records (the remaining tables wait for the next pass,
+      to keep their order).
+    """
+
+    with SessionLocal() as db:
+      for name, stream in STREAMS.items():
+        for _ in range(MAX_BATCHES):
+          high_water = db.execute(
+            select(replication_state.c.high_water).where(replication_state.c.name == name)
+          ).scalar() or 0
+
+          table = stream.model.__table__
+          rows = db.execute(
+            select(literal_column(f"{table.name}.rowid").label("rowid"), *(table.c[column] for column in stream.columns))
+              .where(literal_column(f"{table.name}.rowid") > high_water)
+              .order_by(literal_column(f"{table.name}.rowid"))
+              .limit(BATCH_SIZE)
+          ).all()
+          if not rows:
+            break
+
+          for path, body, content_type, first, last in stream.encode(rows):
+            outcome, reason = self._post(path, body, content_type)
+            if outcome == POSTPONED:
+              logger.warning("Replication of %s postponed: %s", name, reason)
+              return False
+
+            if outcome == REJECTED:
+              held = self._held[name] = self._held.get(name, 0) + 1
+              if held < MAX_HELD_PASSES:
+                logger.warning("Replication of %s rows %d to %d held (%d): %s", name, first, last, held, reason)
+                return False
+              logger.error("Replication of %s rows %d to %d given up after %d passes: %s", name, first, last, held, reason)
+            elif outcome == DROPPED:
+              logger.error("Replication of %s rows %d to %d dropped: %s", name, first, last, reason)
+
+          self._held.pop(name, None)
+
+          statement = insert(replication_state).values(name=name, high_water=rows[-1].rowid)
+          db.execute(statement.on_conflict_do_update(
+            index_elements=[replication_state.c.name],
+            set_={"high_water": statement.excluded.high_water},
+          ))
+          db.commit()
+
+    return True
+
+
+  def _post(self, path: str, body: bytes, content_type: str) -> tuple[str, str]:
+
+    # The outcome of the request and its reason
+    headers = {"Content-Type": content_type, "X-Receptor-Id": RECEPTOR_ID}
+    if content_type == binary.CONTENT_TYPE:
+      headers["Content-Encoding"] = "gzip"
+    request = Request(self.url + path, data=body, headers=headers, method="POST")
+
+    try:
+      with urlopen(request, timeout=TIMEOUT) as response:
+        result = json.loads(response.read() or b"null")
+    except HTTPError as error:
+      if error.code >= 500 or error.code in RETRY_STATUS:
+        retry_after = error.headers.get("Retry-After")
+        self._retry_after = int(retry_after) if retry_after and retry_after.isdigit() else None
+        return POSTPONED, str(error)
+      if error.code == 409: # Already replicated
+        return SENT, ""
+      return DROPPED, f"{error}: {error.read().decode(errors='replace')}"
+    except (URLError, OSError) as error:
+      return POSTPONED, str(error)
+
+    # The batch routes count the records of the collectors they do not know
+    if isinstance(result, dict) and result.get("rejected"):
+      return REJECTED, f"{result['rejected']} records rejected, unknown collectors {result.get('unknown', [])}"
+    return SENT, ""
+
+
+replicator = Replicator(CENTRAL_API_URL) if EDGE and CENTRAL_API_URL else None
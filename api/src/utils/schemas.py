@@ -7,13 +7,21 @@
 ################
 
 from datetime import datetime
+from typing import Literal
+
+
+################
+##  INTERNAL  ##
+################
+
+from . import quality
 
 
 ################
 ##  EXTERNAL  ##
 ################
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, computed_field, model_validator
 
 
 
@@ -58,13 +66,50 @@ class CollectorRecordBase(BaseModel):
   read_humidity: int
 
 
-class CollectorRecord(CollectorRecordBase):
+class CollectorRecordData(CollectorRecordBase):
+  # Bitmask of data-quality flags (see utils.quality), 0 means a valid reading
+  quality_flags: int = 0
+
+
+class CollectorRecord(CollectorRecordData):
   collector_id: int
 
 
 class CollectorRecordJSON(BaseModel):
   collector_id: int
-  data: list[CollectorRecordBase]
+  data: list[CollectorRecordData]
+
+
+class CollectorRecordBatch(CollectorRecordBase):
+  collector_id: int
+
+
+class CollectorRecordBatchResult(BaseModel):
+  inserted: int
+  duplicated: int         # already stored, e.g. a batch retried after a lost response
+  rejected: int           # unknown collectors, or dates the receptor never synchronized
+  unknown: list[int] = [] # collectors without a status, their records were rejected
+
+
+class CollectorRecordFlag(CollectorRecordData):
+
+  @computed_field
+  @property
+  def flags(self) -> list[str]:
+    return quality.flag_names(self.quality_flags)
+
+
+class CollectorRecordFlagJSON(BaseModel):
+  collector_id: int
+  data: list[CollectorRecordFlag]
+
+
+class CollectorSeasonJSON(BaseModel):
+  collector_id: int
+  crop: str
+  start_date: datetime
+  end_date: datetime | None = None
+  data: list[CollectorRecordData]
 
 
 ###########################
@@ -85,6 +130,36 @@ class CalculatedHumidityJSON(BaseModel):
   data: list[CalculatedHumidityBase]
 
 
+class HumiditySeries(BaseModel):
+  collector_id: int
+  data: list[float | None]
+
+
+class HumiditySeriesJSON(BaseModel):
+  # Shared time axis, the start of each bin
+  timestamps: list[datetime]
+  resolution: int
+  series: list[HumiditySeries]
+
+
+############
+##  CROP  ##
+############
+
+class CropHumidityBase(BaseModel):
+  calculation_date: datetime
+  humidity_mean: float
+  humidity_min: float
+  humidity_max: float
+  collectors: int
+
+
+class CropHumidityJSON(BaseModel):
+  crop: str
+  resolution: int
+  data: list[CropHumidityBase]
+
+
 ################
 ##  RECEPTOR  ##
 ################
@@ -92,3 +167,95 @@ class CalculatedHumidityJSON(BaseModel):
 class ReceptorStatus(BaseModel):
   update_date: datetime
   records_in_buffer: int
+
+
+################
+##  OVERVIEW  ##
+################
+
+class CollectorOverview(BaseModel):
+  collector_id: int
+  crop: str | None = None
+  start_date: datetime | None = None
+  end_date: datetime | None = None
+  collection_date: datetime | None = None
+  read_humidity: int | None = None
+  quality_flags: int | None = None
+  calculation_date: datetime | None = None
+  humidity_percentage: float | None = None
+  last_seen_age: float | None = None # seconds since the latest record
+
+
+class Overview(BaseModel):
+  generated_at: datetime
+  collectors: list[CollectorOverview]
+  receptor: ReceptorStatus | None = None
+
+
+####################
+##  FLEET HEALTH  ##
+####################
+
+class LinkHealth(BaseModel):
+  packets: int          # packets received
+  expected: int         # frames sent, estimated from the header ID gaps
+  duplicates: int       # retransmissions received, their ACK was lost
+  loss: float | None = None # estimated share of the frames lost
+  rssi_p10: float | None = None # dBm
+  rssi_p50: float | None = None
+  rssi_p90: float | None = None
+  snr_mean: float | None = None # dB
+
+
+class CollectorLinkHealth(LinkHealth):
+  collector_id: int
+  last_seen: datetime | None = None # latest record
+
+
+class FleetHealth(BaseModel):
+  generated_at: datetime
+  start: datetime
+  fleet: LinkHealth
+  collectors: list[CollectorLinkHealth]
+
+
+class LinkHealthHourly(LinkHealth):
+  hour: datetime
+
+
+class CollectorLinkHealthJSON(BaseModel):
+  collector_id: int
+  data: list[LinkHealthHourly]
+
+
+
+##############
+##  ALERTS  ##
+##############
+
+class AlertRuleBase(BaseModel):
+  collector_id: int | None = None
+  crop: str | None = None
+  condition: Literal["below", "above"]
+  threshold: float = Field(ge=0, le=100) # humidity percentage
+  duration: int = Field(default=0, ge=0) # seconds the condition must hold
+  webhook_url: str
+  enabled: bool = True
+
+  @model_validator(mode="after")
+  def check_target(self):
+    if self.collector_id is None and self.crop is None:
+      raise ValueError("Either collector_id or crop must be set")
+    return self
+
+
+class AlertRule(AlertRuleBase):
+  rule_id: int
+
+
+class AlertState(BaseModel):
+  rule_id: int
+  collector_id: int
+  breach_start: datetime | None = None
+  last_date: datetime
+  firing: bool
\ No newline at end of file
@@ -0,0 +1,118 @@
+################################################################################
+##                                  LIBRARIES                                 ##
+################################################################################
+
+################
+##  BUILT-IN  ##
+################
+
+from datetime import datetime, timezone
+
+
+################
+##  EXTERNAL  ##
+################
+
+import numpy as np
+
+
+
+################################################################################
+##                                  CONSTANTS                                 ##
+################################################################################
+
+MAX_POINTS = 2000 # Maximum number of points in the shared time axis
+
+
+
+################################################################################
+##                                 RESAMPLING                                 ##
+################################################################################
+
+def time_axis(start: datetime, end: datetime, resolution: int) -> np.ndarray:
+
+  """
+  Build the shared time axis of a window, in seconds since the epoch.
+
+  Parameters
+  ----------
+  start : datetime
+    The start of the window.
+  end : datetime
+    The end of the window.
+  resolution : int
+    The distance between two points of the axis, in seconds.
+
+  Returns
+  -------
+  numpy.ndarray
+    The timestamps of the start of each bin.
+  """
+
+  return np.arange(start.timestamp(), end.timestamp(), resolution, dtype=np.float64)
+
+
+def align(rows: list[tuple[int, float, float]], collector_ids: list[int], axis: np.ndarray, resolution: int) -> list[list[float | None]]:
+
+  """
+  Resample the readings of several collectors onto a shared time axis.
+
+  Readings are averaged per bin (all collectors at once with a single `bincount`),
+  and empty bins between two bins with data are linearly interpolated. Bins
+  before the first or after the last reading of a collector are left empty.
+
+  Parameters
+  ----------
+  rows : List[Tuple[int, float, float]]
+    The readings as (collector ID, seconds since the epoch, value) tuples.
+  collector_ids : List[int]
+    The IDs of the collectors, in the order of the returned series.
+  axis : numpy.ndarray
+    The shared time axis, as returned by `time_axis`.
+  resolution : int
+    The distance between two points of the axis, in seconds.
+
+  Returns
+  -------
+  List[List[float | None]]
+    One series per collector, with one value per point of the axis (None where there is no data).
+  """
+
+  n_series, n_bins = len(collector_ids), len(axis)
+  result = np.full((n_series, n_bins), np.nan)
+
+  if rows and n_bins:
+    data = np.asarray(rows, dtype=np.float64)
+
+    # Map each collector ID to its row in the result
+    ids = np.asarray(collector_ids, dtype=np.float64)
+    order = np.argsort(ids)
+    series = order[np.searchsorted(ids, data[:, 0], sorter=order)]
+
+    bins = ((data[:, 1] - axis[0]) // resolution).astype(np.int64)
+    valid = (bins >= 0) & (bins < n_bins)
+    index = series[valid] * n_bins + bins[valid]
+
+    sums = np.bincount(index, weights=data[valid, 2], minlength=n_series * n_bins)
+    counts = np.bincount(index, minlength=n_series * n_bins)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+      means = (sums / counts).reshape(n_series, n_bins)
+
+    positions = np.arange(n_bins)
+    for i in range(n_series):
+      filled = ~np.isnan(means[i])
+      if filled.any():
+        result[i] = np.interp(positions, positions[filled], means[i, filled], left=np.nan, right=np.nan)
+
+  result = np.round(result, 2)
+  return [[None if np.isnan(value) else float(value) for value in row] for row in result]
+
+
+def axis_dates(axis: np.ndarray) -> list[datetime]:
+
+  """
+  Convert a time axis back to timezone-aware dates.
+  """
+
+  return [datetime.fromtimestamp(timestamp, tz=timezone.utc) for timestamp in axis.tolist()]
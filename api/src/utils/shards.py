@@ -0,0 +1,201 @@
+################################################################################
+##                                  LIBRARIES                                 ##
+################################################################################
+
+################
+##  BUILT-IN  ##
+################
+
+import logging
+import os
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from threading import current_thread
+from typing import Callable, Iterable, TypeVar
+
+
+################
+##  INTERNAL  ##
+################
+
+from .database import EDGE, SHARD_URLS, SessionLocal, engine, replica_engines
+
+
+################
+##  EXTERNAL  ##
+################
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+
+
+################################################################################
+##                                  CONSTANTS                                 ##
+################################################################################
+
+logger = logging.getLogger(__name__)
+
+# First collector ID of every shard after the first, as a comma separated SHARD_BOUNDS,
+# e.g. "10000,20000" for three shards. Without it the collectors are spread by
+# collector_id modulo the number of shards. Changing either moves collectors to
+# another shard, their rows must be moved with them.
+SHARD_BOUNDS = [int(bound) for bound in os.environ.get("SHARD_BOUNDS", "").split(",") if bound]
+
+T = TypeVar("T")
+
+
+
+################################################################################
+##                                   ROUTER                                   ##
+################################################################################
+
+class ShardRouter:
+
+  """
+  Map every collector to the database (shard) that holds its rows.
+
+  A shard keeps the status, records, link telemetry and alert state of its
+  collectors. The first shard is the primary database, it also keeps the
+  tables that are not per collector (receptor status, alert rules). Queries
+  about several collectors run on every shard in parallel, each in its own
+  session, and their results are merged by the caller.
+
+  The read replicas (`DATABASE_REPLICA_URLS`) replicate the primary only. With
+  shards they keep serving the tables of the primary, the reads of collectors
+  go to the shards themselves.
+  """
+
+  def __init__(self, engines: list[Engine], bounds: list[int] | None = None):
+    if bounds and len(bounds) != len(engines) - 1:
+      raise ValueError(f"{len(engines)} shards need {len(engines) - 1} bounds, got {len(bounds)}")
+
+    self.engines = engines
+    self.bounds = bounds or None
+    self._executor = ThreadPoolExecutor(max_workers=len(engines), thread_name_prefix="shard")
+
+
+  @property
+  def sharded(self) -> bool:
+    return len(self.engines) > 1
+
+
+  def index(self, collector_id: int) -> int:
+
+    """
+    Find the shard of a collector.
+    """
+
+    if self.bounds is not None:
+      return bisect_right(self.bounds, collector_id)
+    return collector_id % len(self.engines)
+
+
+  def session(self, index: int) -> Session:
+
+    """
+    Open a session on a shard, the caller closes it.
+    """
+
+    return SessionLocal(bind=self.engines[index])
+
+
+  def partition(self, items: Iterable[T], key: Callable[[T], int] = lambda item: item) -> dict[int, list[T]]:
+
+    """
+    Split items (collector IDs, or rows keyed by them) by shard, keeping their order.
+    """
+
+    parts = {}
+    for item in items:
+      parts.setdefault(self.index(key(item)), []).append(item)
+    return parts
+
+
+  def fan_out(self, function: Callable[[Session], T], indexes: Iterable[int] | None = None) -> list[T]:
+
+    """
+    Run a function on several shards in parallel.
+
+    Parameters
+    ----------
+    function : Callable[[Session], T]
+      The function to run, it gets a session on the shard.
+    indexes : Iterable[int], optional
+      The shards to run it on. Defaults to every shard.
+
+    Returns
+    -------
+    List[T]
+      The results, in the order of the shards.
+    """
+
+    def run(index):
+      with self.session(index) as db:
+        return function(db)
+
+    return self._map(run, range(len(self.engines)) if indexes is None else list(indexes))
+
+
+  def scatter(self, db: Session, items: list, function: Callable[[Session, list], T], key: Callable = lambda item: item) -> list[T]:
+
+    """
+    Split items by shard and run a function on the part of every shard, in parallel.
+
+    Parameters
+    ----------
+    db : Session
+      The session used without shards, which may be bound to a read replica.
+    items : List
+      The collector IDs, or rows keyed by them through `key`.
+    function : Callable[[Session, List], T]
+      The function to run, it gets a session on the shard and the items of the shard.
+    key : Callable, optional
+      The collector ID of an item. Defaults to the item itself.
+
+    Returns
+    -------
+    List[T]
+      The results of the shards that have items.
+    """
+
+    if not self.sharded:
+      return [function(db, items)]
+
+    parts = self.partition(items, key)
+
+    def run(index):
+      with self.session(index) as shard_db:
+        return function(shard_db, parts[index])
+
+    return self._map(run, list(parts))
+
+
+  def _map(self, run: Callable[[int], T], indexes: list[int]) -> list[T]:
+    # A function that fans out again runs in turn, the workers may all be waiting on it
+    if current_thread().name.startswith("shard"):
+      return [run(index) for index in indexes]
+    return list(self._executor.map(run, indexes))
+
+
+  def gather(self, db: Session, function: Callable[[Session], list], key: Callable = lambda row: row[0]) -> list:
+
+    """
+    Run a query on every shard and merge its rows, sorted by `key` (the collector ID).
+
+    Only for queries whose rows each belong to a single collector, so every shard
+    returns complete rows and the merge is a sort. Without shards the query runs on
+    `db`, which may be bound to a read replica.
+    """
+
+    if not self.sharded:
+      return function(db)
+    return sorted((row for rows in self.fan_out(function) for row in rows), key=key)
+
+
+# The primary is the first shard, edge gateways are never sharded
+shards = ShardRouter([engine] if EDGE else [engine, *(create_engine(url) for url in SHARD_URLS)], SHARD_BOUNDS)
+
+if shards.sharded and replica_engines:
+  logger.warning("Read replicas only serve the tables of the first shard, the reads of collectors go to the shards")
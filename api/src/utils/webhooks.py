@@ -0,0 +1,159 @@
+################################################################################
+##                                  LIBRARIES                                 ##
+################################################################################
+
+################
+##  BUILT-IN  ##
+################
+
+import json
+import logging
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from threading import Lock
+from urllib.error import URLError
+from urllib.request import Request, urlopen
+
+
+################
+##  INTERNAL  ##
+################
+
+from . import models
+from .shards import shards
+
+
+################
+##  EXTERNAL  ##
+################
+
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+
+
+
+################################################################################
+##                                  CONSTANTS                                 ##
+################################################################################
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 50       # Maximum number of events taken from the outbox at once
+RETRY_INTERVAL = 30.0 # Seconds between checks of the outbox for events to retry
+MAX_RETRIES = 5       # Attempts per event before giving up
+RETRY_BACKOFF = 30.0  # Seconds, doubled at every retry
+TIMEOUT = 10          # Seconds per request
+
+
+
+################################################################################
+##                                 DISPATCHER                                 ##
+################################################################################
+
+class WebhookDispatcher:
+
+  """
+  Deliver notifications to webhooks from the `alert_outbox` table.
+
+  The notifications are written to the outbox in the transaction of the reading
+  that raised them, so none is lost when the process stops, or a Lambda container
+  is frozen, before it was delivered. The ingest routes run `flush` once their
+  response is ready. Events are grouped by URL and sent as a JSON list, so a burst
+  of alerts costs a single request per webhook. Failed events are retried by a
+  later flush with exponential backoff and dropped after `MAX_RETRIES` attempts.
+  """
+
+  def __init__(self):
+    self._pending = False
+    self._checked = 0.0
+    self._lock = Lock()
+
+
+  def wake(self):
+
+    """
+    Note that notifications were committed to the outbox, the next flush delivers them.
+    """
+
+    self._pending = True
+
+
+  def flush(self):
+
+    """
+    Deliver the notifications that are due, on every shard.
+
+    Only looks at the outbox if this process committed notifications since the
+    previous flush, or every `RETRY_INTERVAL` seconds for the retries. A flush that
+    is already running in the process is not waited for.
+    """
+
+    if not self._pending and time.monotonic() - self._checked < RETRY_INTERVAL:
+      return
+    if not self._lock.acquire(blocking=False):
+      return
+
+    try:
+      self._pending = False
+      self._checked = time.monotonic()
+      shards.fan_out(self._drain)
+    finally:
+      self._lock.release()
+
+
+  def _drain(self, db: Session):
+    now = datetime.now(timezone.utc)
+
+    # Other processes skip the events being delivered here (PostgreSQL only, SQLite
+    # serializes the writes itself)
+    rows = (
+      db.query(models.AlertOutbox)
+        .filter(or_(models.AlertOutbox.next_attempt.is_(None), models.AlertOutbox.next_attempt <= now))
+        .order_by(models.AlertOutbox.outbox_id)
+        .limit(BATCH_SIZE)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+
+    batches = defaultdict(list)
+    for row in rows:
+      batches[row.webhook_url].append(row)
+
+    for url, events in batches.items():
+      if self._post(url, [event.event for event in events]):
+        for event in events:
+          db.delete(event)
+        continue
+
+      dropped = 0
+      for event in events:
+        event.attempts += 1
+        if event.attempts >= MAX_RETRIES:
+          db.delete(event)
+          dropped += 1
+        else:
+          event.next_attempt = now + timedelta(seconds=RETRY_BACKOFF * 2 ** (event.attempts - 1))
+      if dropped:
+        logger.error("Webhook %s dropped %d events", url, dropped)
+
+    db.commit()
+
+    # A full batch may have left more behind
+    if len(rows) == BATCH_SIZE:
+      self._pending = True
+
+
+  def _post(self, url: str, events: list[dict]) -> bool:
+    body = json.dumps(events, default=str).encode()
+    request = Request(url, data=body, headers={"Content-Type": "application/json"}, method="POST")
+
+    try:
+      with urlopen(request, timeout=TIMEOUT) as response:
+        return response.status < 300
+    except (URLError, OSError) as error:
+      logger.warning("Webhook %s failed: %s", url, error)
+      return False
+
+
+dispatcher = WebhookDispatcher()
@@ -2,31 +2,58 @@ DROP TABLE IF EXISTS
     collector_status
   , collector_record
   , calculated_humidity
+  , collector_link
+  , collector_link_hourly
   , receptor_status
+  , alert_rule
+  , alert_state
+  , alert_outbox
 ;
 
 
+-- Needed to mix scalar and range columns in GiST indexes
+CREATE EXTENSION IF NOT EXISTS btree_gist;
+
 CREATE TABLE IF NOT EXISTS collector_status (
     collector_id  INTEGER       NOT NULL
   , start_date    TIMESTAMPTZ   NOT NULL
   , end_date      TIMESTAMPTZ   NULL
   , crop          VARCHAR(255)  NOT NULL
+  -- Crop season as a range, an open end_date means the crop is still planted
+  , season        TSTZRANGE     GENERATED ALWAYS AS (tstzrange(start_date, end_date, '[)')) STORED
   , PRIMARY KEY (
         collector_id
       , start_date
     )
+  -- A collector grows a single crop at a time, also indexes the season lookups per collector
+  , CONSTRAINT collector_status_season_excl
+      EXCLUDE USING gist (collector_id WITH =, season WITH &&)
 );
 
+-- Seasons of every collector growing a crop
+CREATE INDEX IF NOT EXISTS collector_status_crop_season_idx
+    ON collector_status USING gist (crop, season)
+;
+
 CREATE TABLE IF NOT EXISTS collector_record (
     collector_id    INTEGER     NOT NULL
   , collection_date TIMESTAMPTZ NOT NULL
   , read_humidity   INTEGER     NOT NULL
+  -- Data-quality flags set on ingest, 0 means a valid reading
+  -- 1: out of range, 2: spike, 4: stuck, 8: jump
+  , quality_flags   SMALLINT    NOT NULL DEFAULT 0
   , PRIMARY KEY (
         collector_id
       , collection_date
     )
 );
 
+-- Flagged readings are rare, keep them in a small partial index
+CREATE INDEX IF NOT EXISTS collector_record_flagged_idx
+    ON collector_record (collector_id, collection_date DESC)
+    WHERE quality_flags <> 0
+;
+
 CREATE OR REPLACE VIEW calculated_humidity AS
 SELECT
     collector_id
@@ -36,9 +63,88 @@ SELECT
   -- a + (x-min(x))(b-a)/(max(x)-min(x))
   , CAST(LEAST(100 * (65535 - CAST(read_humidity AS FLOAT)) / 42106, 100.0) AS NUMERIC(5,2)) AS humidity_percentage 
 FROM collector_record
+-- Quarantined readings must not poison the averages
+WHERE quality_flags = 0
+;
+
+-- Radio telemetry of every packet received by the receptor
+CREATE TABLE IF NOT EXISTS collector_link (
+    collector_id  INTEGER       NOT NULL
+  , received_date TIMESTAMPTZ   NOT NULL
+  , rssi          SMALLINT      NOT NULL -- dBm
+  , snr           NUMERIC(4,2)  NOT NULL -- dB
+  -- Grows by one per frame sent by the collector, the gaps are the frames lost
+  , header_id     SMALLINT      NOT NULL
+  -- Retransmissions dropped by the receptor since the previous packet
+  , duplicates    SMALLINT      NOT NULL DEFAULT 0
+  , PRIMARY KEY (
+        collector_id
+      , received_date
+    )
+);
+
+-- Hourly rollups of collector_link, updated on ingest. The fleet health endpoints
+-- only read these.
+CREATE TABLE IF NOT EXISTS collector_link_hourly (
+    collector_id    INTEGER       NOT NULL
+  , hour            TIMESTAMPTZ   NOT NULL
+  , packets         INTEGER       NOT NULL
+  , expected        INTEGER       NOT NULL -- frames sent, from the header_id gaps
+  , duplicates      INTEGER       NOT NULL
+  , snr_sum         NUMERIC(12,2) NOT NULL
+  -- Packets per 2 dB RSSI bucket from -150 dBm, see api/src/utils/link.py
+  , rssi_histogram  INTEGER[]     NOT NULL
+  , last_date       TIMESTAMPTZ   NOT NULL
+  , PRIMARY KEY (
+        collector_id
+      , hour
+    )
+);
+
+-- The fleet health reads every collector over the last hours
+CREATE INDEX IF NOT EXISTS collector_link_hourly_hour_idx
+    ON collector_link_hourly (hour)
 ;
 
 CREATE TABLE IF NOT EXISTS receptor_status (
     update_date       TIMESTAMPTZ NOT NULL PRIMARY KEY
   , records_in_buffer INTEGER     NOT NULL
-);
\ No newline at end of file
+);
+
+CREATE TABLE IF NOT EXISTS alert_rule (
+    rule_id       SERIAL        NOT NULL PRIMARY KEY
+  -- A rule applies to one collector or to every collector growing a crop
+  , collector_id  INTEGER       NULL
+  , crop          VARCHAR(255)  NULL
+  , condition     VARCHAR(5)    NOT NULL CHECK (condition IN ('below', 'above'))
+  , threshold     NUMERIC(5,2)  NOT NULL
+  , duration      INTEGER       NOT NULL DEFAULT 0 -- seconds
+  , webhook_url   VARCHAR(2048) NOT NULL
+  , enabled       BOOLEAN       NOT NULL DEFAULT TRUE
+  , CHECK (collector_id IS NOT NULL OR crop IS NOT NULL)
+);
+
+-- One row per rule and collector, updated in place on every reading. It lives on the
+-- shard of the collector while alert_rule is only on the first one, so rule_id is not
+-- a foreign key.
+CREATE TABLE IF NOT EXISTS alert_state (
+    rule_id       INTEGER       NOT NULL
+  , collector_id  INTEGER       NOT NULL
+  , breach_start  TIMESTAMPTZ   NULL
+  , last_date     TIMESTAMPTZ   NOT NULL
+  , firing        BOOLEAN       NOT NULL DEFAULT FALSE
+  , PRIMARY KEY (
+        rule_id
+      , collector_id
+    )
+);
+
+-- Notifications of the alert_state changes, written in the transaction of the reading
+-- and deleted once delivered to the webhook, see api/src/utils/webhooks.py
+CREATE TABLE IF NOT EXISTS alert_outbox (
+    outbox_id     SERIAL        NOT NULL PRIMARY KEY
+  , webhook_url   VARCHAR(2048) NOT NULL
+  , event         JSON          NOT NULL
+  , attempts      INTEGER       NOT NULL DEFAULT 0
+  , next_attempt  TIMESTAMPTZ   NULL -- NULL means due now
+);
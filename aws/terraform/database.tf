@@ -52,6 +52,10 @@ locals {
       create_monitoring_role                = true
       monitoring_role_name                  = format("%s-%s-rds-monitoring-role", local.project_name, terraform.workspace)
       monitoring_interval                   = 60 # seconds
+
+      # Read replicas, serve the GET routes of the API
+      replicas               = 1
+      replica_instance_class = "db.t3.micro"
     }
   }
 }
@@ -124,3 +128,58 @@ module "db" {
     }
   ]
 }
+
+
+
+################################################################################
+##                           CREATE READ REPLICAS                             ##
+################################################################################
+
+module "db_replica" {
+  source  = "terraform-aws-modules/rds/aws"
+  version = "5.9.0"
+  count   = local.rds[terraform.workspace].replicas
+
+  # Name
+  identifier = format("%s-%s-replica-%d", local.project_name, terraform.workspace, count.index + 1)
+
+  # Source, the database, username and password come from the primary
+  replicate_source_db    = module.db.db_instance_id
+  create_random_password = false
+
+  # Instance type
+  instance_class = local.rds[terraform.workspace].replica_instance_class
+
+  # Software
+  engine                    = local.rds[terraform.workspace].engine
+  engine_version            = local.rds[terraform.workspace].engine_version
+  major_engine_version      = local.rds[terraform.workspace].major_engine_version
+  family                    = local.rds[terraform.workspace].family
+  create_db_parameter_group = local.rds[terraform.workspace].create_db_parameter_group
+  create_db_option_group    = local.rds[terraform.workspace].create_db_option_group
+
+  # Storage
+  allocated_storage = local.rds[terraform.workspace].allocated_storage
+  storage_type      = local.rds[terraform.workspace].storage_type
+  storage_encrypted = local.rds[terraform.workspace].storage_encrypted
+
+  # Backup, kept by the primary
+  backup_retention_period = 0
+  skip_final_snapshot     = true
+  deletion_protection     = local.rds[terraform.workspace].deletion_protection
+
+  # Network
+  multi_az               = false
+  publicly_accessible    = local.rds[terraform.workspace].publicly_accessible
+  port                   = local.rds[terraform.workspace].port
+  network_type           = local.rds[terraform.workspace].network_type
+  vpc_security_group_ids = [aws_security_group.database.id]
+
+  # Maintenance
+  maintenance_window         = local.rds[terraform.workspace].maintenance_window
+  auto_minor_version_upgrade = local.rds[terraform.workspace].auto_minor_version_upgrade
+
+  # Monitoring
+  performance_insights_enabled          = local.rds[terraform.workspace].performance_insights_enabled
+  performance_insights_retention_period = local.rds[terraform.workspace].performance_insights_retention_period
+}
@@ -3,6 +3,11 @@ output "db_instance_address" {
   value       = module.db.db_instance_address
 }
 
+output "db_replica_addresses" {
+  description = "The addresses of the RDS read replicas, the replica_hosts of the API credentials"
+  value       = module.db_replica[*].db_instance_address
+}
+
 output "db_instance_username" {
   description = "The username for the database"
   value       = nonsensitive(module.db.db_instance_username)
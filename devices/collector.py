@@ -18,8 +18,9 @@
 ##  BUILT-IN  ##
 ################
 
-from utime import sleep, localtime
-from machine import ADC, Pin
+from utime import time, time_ns
+from machine import ADC, Pin, lightsleep, deepsleep, unique_id
+import json
 
 
 ###############
@@ -27,6 +28,8 @@ from machine import ADC, Pin
 ###############
 
 from .lib.ulora import LoRa
+from .lib.adr import LinkFollower
+from .lib import frame
 
 
 
@@ -38,12 +41,61 @@ from .config.lora_parameters import *
 
 SLEEP_TIME = 20 # seconds
 
+# Readings sent together in a single frame, 1 sends every reading as plain text
+FRAME_READINGS = 6
+DELTA_ENCODING = True # usually halves the frame size
+
+# Readings kept while the gateway does not acknowledge the frames, the oldest are dropped
+PENDING_READINGS = frame.MAX_READINGS
+
+# Seconds a reading may wait for the frame to fill, the sparse readings of report by
+# exception would otherwise wait hours
+MAX_PENDING_AGE = 900
+
+# Sampling
+OVERSAMPLING = 16 # ADC reads averaged in every sample
+
+# Report by exception: sample at an interval that follows the rate of change and
+# only send the readings that moved past the deadband, or a heartbeat
+ADAPTIVE = True
+MIN_INTERVAL = 20 # seconds between samples while the soil is changing
+MAX_INTERVAL = 600 # seconds between samples while it is stable
+DEADBAND = 512 # ADC counts from the last reported reading
+HEARTBEAT = 3600 # seconds, a reading is reported at least this often
+
+# TDMA: every MIN_INTERVAL (SLEEP_TIME without ADAPTIVE) is split in slots and the
+# collector wakes up in the one given by its address, 0 disables
+TDMA_SLOTS = 16
+
+# LoRa address of this collector, the receptor uploads its readings with it as the
+# collector id and it picks the TDMA slot. Set COLLECTOR_ADDRESS in
+# the configuration to give the collectors of a receptor consecutive addresses, and
+# so different slots, otherwise it is derived from the board id and may collide
+COLLECTOR_ADDRESS = globals().get("COLLECTOR_ADDRESS")
+
+# Follow the data rate and the transmit power the receptor sends back in the ACKs
+ADR = True
+
+# "light" keeps the RAM between samples, "deep" saves more power but reboots the board
+SLEEP_MODE = "light"
+STATE_PATH = "collector.json" # state kept between deep sleeps
+
 
 
 ################################################################################
 ##                               CONFIGURATIONS                               ##
 ################################################################################
 
+def board_address():
+  # Hash of the board id spread over 0-254 without the receptor's address, 255 is the
+  # broadcast address
+  digest = 0
+  for byte in unique_id():
+    digest = (digest * 31 + byte) & 0xffff
+  address = digest % 254
+  return address + 1 if address >= SERVER_ADDRESS else address
+
+
 # Humidity sensor
 soil = ADC(Pin(26)) # Soil moisture PIN reference
 
@@ -51,13 +103,120 @@ soil = ADC(Pin(26)) # Soil moisture PIN reference
 lora = LoRa(
   spi_channel=RFM95_SPIBUS,
   interrupt=RFM95_INT,
-  this_address=SERVER_ADDRESS,
+  this_address=board_address() if COLLECTOR_ADDRESS is None else COLLECTOR_ADDRESS,
   cs_pin=RFM95_CS,
   reset_pin=RFM95_RST,
   freq=RF95_FREQ,
   tx_power=RF95_POW,
   acks=ACKS
 )
+link = LinkFollower(lora)
+
+# Collector state, saved to the flash before a deep sleep
+state = dict(
+  pending = [],            # readings waiting to be sent, as [time, reading]
+  interval = MIN_INTERVAL, # seconds until the next sample
+  sample = None,           # last sample, as [time, reading]
+  reported = None,         # last reported sample, as [time, reading]
+  link = None,             # data rate and transmit power, as [index, dBm]
+  wake = None,             # time the board should wake up from a deep sleep
+)
+
+
+
+################################################################################
+##                                  FUNCTIONS                                 ##
+################################################################################
+
+# Average several ADC reads, the single reads are noisy
+def read_moisture() -> int:
+  total = 0
+  for _ in range(OVERSAMPLING):
+    total += soil.read_u16()
+  return total // OVERSAMPLING
+
+
+# Sample twice while the soil moves across the deadband, growing slowly when it is stable
+def next_interval(moisture, now) -> int:
+  if state["sample"] is None:
+    return MIN_INTERVAL
+
+  last_time, last_moisture = state["sample"]
+  rate = abs(moisture - last_moisture) / max(now - last_time, 1)
+  interval = 2 * state["interval"] if rate == 0 else DEADBAND / (2 * rate)
+  return int(max(MIN_INTERVAL, min(interval, 2 * state["interval"], MAX_INTERVAL)))
+
+
+# Report the samples past the deadband from the last report, or after the heartbeat
+def should_report(moisture, now) -> bool:
+  if state["reported"] is None:
+    return True
+  reported_time, reported_moisture = state["reported"]
+  return abs(moisture - reported_moisture) >= DEADBAND or now - reported_time >= HEARTBEAT
+
+
+# Send the pending readings in a single frame, they are kept if it is not acknowledged
+def send_pending() -> bool:
+  pending = state["pending"]
+
+  # The receptor dates every reading from its age when the frame arrives
+  now = time()
+  readings = [(max(now - timestamp, 0), reading) for timestamp, reading in pending]
+
+  # Plain text only carries the latest reading
+  if FRAME_READINGS == 1:
+    data = str(pending[-1][1])
+  else:
+    data = frame.encode(readings, DELTA_ENCODING)
+
+  if ADR:
+    link.poll()
+  if not lora.send_to_wait(data, SERVER_ADDRESS, header_flags=link.flags() if ADR else 0):
+    if ADR:
+      link.on_failure()
+    return False
+
+  if ADR:
+    link.on_ack(lora.last_ack.message)
+
+  pending.clear()
+  return True
+
+
+# Restore the state saved before a deep sleep, returns True if there was one
+def load_state() -> bool:
+  try:
+    with open(STATE_PATH) as file:
+      state.update(json.load(file))
+  except (OSError, ValueError):
+    return False
+
+  # Deep sleep resets the RTC of the RP2040. The saved times are moved to the new
+  # clock, taking the wake up time as now, so the ages of the readings stay right.
+  if state["wake"] is not None:
+    offset = time() - state["wake"]
+    for timestamp in (state["sample"], state["reported"], *state["pending"]):
+      if timestamp is not None:
+        timestamp[0] += offset
+  return True
+
+
+# Power the radio and the microcontroller down until the next sample
+def sleep_for(seconds) -> None:
+  delay = seconds * 1000
+  if TDMA_SLOTS:
+    period = (MIN_INTERVAL if ADAPTIVE else SLEEP_TIME) * 1000
+    delay = max(delay + lora.slot_offset(period, TDMA_SLOTS, time_ns() // 1000000 + delay), 0)
+
+  lora.sleep()
+  if SLEEP_MODE == "deep":
+    state["link"] = link.state()
+    state["wake"] = time() + delay // 1000
+    with open(STATE_PATH, "w") as file:
+      json.dump(state, file)
+    deepsleep(delay) # Reboots the board, the main loop starts over
+  else:
+    lightsleep(delay)
 
 
 
@@ -65,18 +224,43 @@ lora = LoRa(
 ##                                    MAIN                                    ##
 ################################################################################
 
+woke_up = SLEEP_MODE == "deep" and load_state()
+if woke_up and ADR and state["link"]:
+  link.restore(state["link"])
+
+# Collectors powered on together start in their own TDMA slot
+if TDMA_SLOTS and not woke_up:
+  period = (MIN_INTERVAL if ADAPTIVE else SLEEP_TIME) * 1000
+  wait = lora.slot_offset(period, TDMA_SLOTS, time_ns() // 1000000) % period
+  if wait:
+    lightsleep(wait)
+
 while True:
 
   # Read moisture value
-  moisture = soil.read_u16()
+  moisture = read_moisture()
+  now = time()
+  print("Moisture: {}", moisture)
 
-  # Send data to gateway
-  result = lora.send_to_wait(str(moisture), SERVER_ADDRESS)
+  if ADAPTIVE:
+    state["interval"] = next_interval(moisture, now)
+    state["sample"] = [now, moisture]
+    report = should_report(moisture, now)
+    if report:
+      state["reported"] = [now, moisture]
+  else:
+    state["interval"] = SLEEP_TIME
+    report = True
 
-  # Print result
-  print("Moisture: {}", moisture)
-  print("Sent: {}", result)
+  if report:
+    state["pending"].append([now, moisture])
+    if len(state["pending"]) > PENDING_READINGS:
+      state["pending"].pop(0)
+
+  # Send data to gateway once the frame is full, or its oldest reading is due
+  count = len(state["pending"])
+  if count and (count >= FRAME_READINGS or now - state["pending"][0][0] >= MAX_PENDING_AGE):
+    print("Sent {} readings: {}".format(count, send_pending()))
 
   # Sleep for a while
-  sleep(SLEEP_TIME)
-  
\ No newline at end of file
+  sleep_for(state["interval"])
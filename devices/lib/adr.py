@@ -0,0 +1,250 @@
+# Adaptive data rate: the receptor measures the link margin of every collector and
+# answers in the ACKs with the data rate and the transmit power they should use.
+#
+# ACK message (4 bytes): "!" | data rate (uint8) | tx power (uint8, dBm) | switch in (uint8, seconds)
+#
+# The receptor has a single SX127x, so it only hears one spreading factor at a time:
+# the transmit power is set per collector, but the data rate is the same for the
+# whole network. It follows the weakest active collector and is announced ahead of
+# time, receptor and collectors switch together when `switch in` runs out. Older
+# collectors only check that an ACK arrived and ignore its message.
+#
+# Collectors report the power of every packet in the low nibble of the header flags,
+# which RadioHead leaves to the application. A collector that stops getting ACKs goes
+# to full power and then scans the data rates until the receptor answers again.
+
+
+
+################################################################################
+##                                  LIBRARIES                                 ##
+################################################################################
+
+################
+##  BUILT-IN  ##
+################
+
+from utime import time
+
+
+###############
+## EXTERNAL  ##
+###############
+
+from .ulora import ModemConfig
+
+
+
+################################################################################
+##                                  CONSTANTS                                 ##
+################################################################################
+
+# Data rates, from the most robust to the fastest. All of them use 125 kHz, so the
+# SNR measured at one of them holds for the others.
+DATA_RATES = (
+  ModemConfig.Bw125Cr48Sf4096,
+  ModemConfig.Bw125Cr45Sf2048,
+  ModemConfig.Bw125Cr45Sf1024,
+  ModemConfig.Bw125Cr45Sf512,
+  ModemConfig.Bw125Cr45Sf256,
+  ModemConfig.Bw125Cr45Sf128,
+)
+
+# Lowest SNR each spreading factor can demodulate (SX1276 datasheet), dB
+DEMODULATION_SNR = {6: -5.0, 7: -7.5, 8: -10.0, 9: -12.5, 10: -15.0, 11: -17.5, 12: -20.0}
+
+ACK = b"!"
+
+MIN_POWER = 5  # dBm
+MAX_POWER = 20 # dBm, MIN_POWER + 15 fits in the 4 bits of the header flags
+POWER_MASK = 0x0f
+
+MARGIN = 5        # dB of SNR kept above the demodulation limit, against fading
+HYSTERESIS = 3    # dB more needed before moving to a faster data rate
+HISTORY = 8       # packets per collector the margin is measured on
+SETTLE = 4        # packets of a collector before it counts for the data rate
+ACTIVE = 3600     # seconds, collectors not heard for longer are not considered
+SWITCH_DELAY = 120 # seconds between the announcement of a data rate and the switch
+FAILURES = 3      # failed sends before a collector searches for the receptor
+
+
+
+################################################################################
+##                                  FUNCTIONS                                 ##
+################################################################################
+
+def data_rate(modem_config):
+  # Index of a ModemConfig in DATA_RATES, None if it is not one of them
+  for index, config in enumerate(DATA_RATES):
+    if tuple(config) == tuple(modem_config):
+      return index
+  return None
+
+
+def demodulation_snr(index):
+  return DEMODULATION_SNR[DATA_RATES[index][1] >> 4]
+
+
+def mean(values):
+  return sum(values) / len(values)
+
+
+
+################################################################################
+##                                  RECEPTOR                                  ##
+################################################################################
+
+class LinkAdapter:
+
+  def __init__(self, lora):
+    """
+    LinkAdapter(lora)
+    lora: the receptor LoRa, its ACKs carry the settings of every collector
+    """
+
+    self.lora = lora
+    self.data_rate = data_rate(lora.modem_config)
+    self.target = self.data_rate
+    self.switch_at = None
+
+    # address -> [SNR at MAX_POWER of the last packets, time last heard]
+    self.links = {}
+
+    lora.ack_message = self.ack_message
+
+
+  def ack_message(self, address, header_flags, snr):
+    # Called by the driver for every ACK: record the packet and answer with the settings
+    now = time()
+    power = MIN_POWER + (header_flags & POWER_MASK)
+
+    link = self.links.get(address)
+    if link is None:
+      link = self.links[address] = [[], now]
+    history = link[0]
+    # The SNR the packet would have had at full power, valid across power changes
+    history.append(snr + MAX_POWER - power)
+    if len(history) > HISTORY:
+      history.pop(0)
+    link[1] = now
+
+    if self.data_rate is None:
+      return ACK
+
+    self._plan(now)
+    switch_in = 0 if self.switch_at is None else min(max(self.switch_at - now, 1), 255)
+    return ACK + bytes((self.target, self._power(history), switch_in))
+
+
+  def _power(self, history):
+    # Lowest power that keeps MARGIN at the data rate in use after the switch
+    margin = mean(history) - demodulation_snr(self.target) - MARGIN
+    return int(min(max(MAX_POWER - margin, MIN_POWER), MAX_POWER))
+
+
+  def _plan(self, now):
+    # Fastest data rate the weakest active collector reaches at full power. The ACKs
+    # go back at the receptor power, which may be the weaker direction.
+    # An announced switch is never cancelled, some collectors may have acted on it.
+    if self.switch_at is not None:
+      return
+
+    downlink = min(self.lora.tx_power - MAX_POWER, 0)
+    snrs = [
+      mean(history) + downlink for history, seen in self.links.values()
+      if now - seen < ACTIVE and len(history) >= SETTLE
+    ]
+    if not snrs:
+      return
+    worst = min(snrs)
+
+    target = 0
+    for index in range(len(DATA_RATES)):
+      needed = MARGIN + (HYSTERESIS if index > self.data_rate else 0)
+      if worst - demodulation_snr(index) >= needed:
+        target = index
+
+    if target != self.data_rate:
+      self.target = target
+      self.switch_at = now + SWITCH_DELAY
+
+
+  def poll(self):
+    # Switch the receptor when the announced time comes, call it at least every second
+    if self.switch_at is not None and time() >= self.switch_at:
+      self.lora.set_modem_config(DATA_RATES[self.target])
+      self.data_rate = self.target
+      self.switch_at = None
+
+
+
+################################################################################
+##                                  COLLECTOR                                 ##
+################################################################################
+
+class LinkFollower:
+
+  def __init__(self, lora):
+    """
+    LinkFollower(lora)
+    lora: the collector LoRa, configured from the ACKs of the receptor
+    """
+
+    self.lora = lora
+    self.target = None
+    self.switch_at = None
+    self.failures = 0
+
+
+  def flags(self):
+    # Header flags of the packets, report the power they are sent with
+    return (self.lora.tx_power - MIN_POWER) & POWER_MASK
+
+
+  def on_ack(self, message):
+    self.failures = 0
+    if len(message) < 4 or message[:1] != ACK:
+      return
+
+    target, power, switch_in = message[1], message[2], message[3]
+    if power != self.lora.tx_power:
+      self.lora.set_tx_power(power)
+
+    if target < len(DATA_RATES) and target != data_rate(self.lora.modem_config):
+      self.target = target
+      self.switch_at = time() + switch_in
+      self.poll()
+
+
+  def on_failure(self):
+    # Full power first, then a different data rate every FAILURES failed sends
+    self.failures += 1
+    if self.failures % FAILURES:
+      return
+
+    if self.lora.tx_power < MAX_POWER:
+      self.lora.set_tx_power(MAX_POWER)
+      return
+
+    current = data_rate(self.lora.modem_config)
+    current = len(DATA_RATES) if current is None else current
+    self.lora.set_modem_config(DATA_RATES[(current - 1) % len(DATA_RATES)])
+    self.switch_at = None
+
+
+  def poll(self):
+    # Apply an announced data rate when its time comes, call it before sending
+    if self.switch_at is not None and time() >= self.switch_at:
+      self.lora.set_modem_config(DATA_RATES[self.target])
+      self.switch_at = None
+
+
+  def state(self):
+    # Settings to keep across a deep sleep
+    return [data_rate(self.lora.modem_config), self.lora.tx_power]
+
+
+  def restore(self, state):
+    index, power = state
+    if index is not None:
+      self.lora.set_modem_config(DATA_RATES[index])
+    self.lora.set_tx_power(power)
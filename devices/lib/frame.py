@@ -0,0 +1,128 @@
+# Binary LoRa frame carrying several readings of a collector in a single transmission.
+# Every reading has an age: the seconds between the reading and the transmission,
+# so the receptor can rebuild the timestamps from the moment it got the frame.
+#
+# Plain frame (4 bytes per reading):
+#
+#   FRAME_PLAIN (uint8) | count (uint8) | count x [age (uint16) | reading (uint16)]
+#
+# Delta frame (usually 2 bytes per reading):
+#
+#   FRAME_DELTA (uint8) | count (uint8) | age (varint) | reading (varint) |
+#   (count - 1) x [age decrease (varint) | reading change (zigzag varint)]
+#
+# Readings go from the oldest to the newest. The frame types are outside of the
+# ASCII digits, so plain text readings from older collectors are still told apart.
+
+
+
+################################################################################
+##                                  LIBRARIES                                 ##
+################################################################################
+
+################
+##  BUILT-IN  ##
+################
+
+import struct
+
+
+
+################################################################################
+##                                  CONSTANTS                                 ##
+################################################################################
+
+FRAME_PLAIN = 0xB1
+FRAME_DELTA = 0xB2
+
+MAX_PAYLOAD = 251 # RFM95 FIFO (255 bytes) minus the RadioHead header
+MAX_AGE = 0xFFFF  # seconds
+MAX_READINGS = (MAX_PAYLOAD - 2) // 4 # readings that always fit, even in a plain frame
+
+
+
+################################################################################
+##                                  ENCODING                                  ##
+################################################################################
+
+def _put_varint(buffer, value):
+  while value > 0x7F:
+    buffer.append((value & 0x7F) | 0x80)
+    value >>= 7
+  buffer.append(value)
+
+
+def _get_varint(data, offset):
+  value = shift = 0
+  while True:
+    byte = data[offset]
+    offset += 1
+    value |= (byte & 0x7F) << shift
+    if not byte & 0x80:
+      return value, offset
+    shift += 7
+
+
+def encode(readings, delta=True):
+  # Pack a list of (age, reading) tuples, from the oldest to the newest, in a frame.
+  # The delta encoding is used when asked and shorter than the plain one.
+  if not 0 < len(readings) <= MAX_READINGS:
+    raise ValueError("Invalid number of readings")
+
+  frame = bytearray((FRAME_PLAIN, len(readings)))
+  for age, reading in readings:
+    frame.extend(struct.pack("<HH", min(age, MAX_AGE), reading))
+
+  if delta:
+    compact = bytearray((FRAME_DELTA, len(readings)))
+    last_age, last_reading = readings[0]
+    _put_varint(compact, min(last_age, MAX_AGE))
+    _put_varint(compact, last_reading)
+
+    for age, reading in readings[1:]:
+      change = reading - last_reading
+      _put_varint(compact, max(min(last_age, MAX_AGE) - min(age, MAX_AGE), 0))
+      _put_varint(compact, (change << 1) if change >= 0 else ((-change << 1) - 1))
+      last_age, last_reading = age, reading
+
+    if len(compact) < len(frame):
+      frame = compact
+
+  return bytes(frame)
+
+
+
+################################################################################
+##                                  DECODING                                  ##
+################################################################################
+
+def is_frame(payload):
+  return len(payload) >= 2 and payload[0] in (FRAME_PLAIN, FRAME_DELTA)
+
+
+def decode(payload):
+  # Unpack a frame to a list of (age, reading) tuples, from the oldest to the newest
+  kind, count = payload[0], payload[1]
+
+  if kind == FRAME_PLAIN:
+    if len(payload) != 2 + 4 * count:
+      raise ValueError("Invalid frame length")
+    return [struct.unpack_from("<HH", payload, 2 + 4 * i) for i in range(count)]
+
+  if kind == FRAME_DELTA:
+    age, offset = _get_varint(payload, 2)
+    reading, offset = _get_varint(payload, offset)
+    readings = [(age, reading)]
+
+    for _ in range(count - 1):
+      decrease, offset = _get_varint(payload, offset)
+      change, offset = _get_varint(payload, offset)
+      age -= decrease
+      reading += (change >> 1) if not change & 1 else -((change + 1) >> 1)
+      readings.append((age, reading))
+
+    if offset != len(payload):
+      raise ValueError("Invalid frame length")
+    return readings
+
+  raise ValueError("Unknown frame type")
@@ -0,0 +1,284 @@
+#  _  _______ _____ ____       _    _     _____     _______
+# | |/ / ____| ____|  _ \     / \  | |   |_ _\ \   / / ____|
+# | ' /|  _| |  _| | |_) |   / _ \ | |    | | \ \ / /|  _|
+# | . \| |___| |___|  __/   / ___ \| |___ | |  \ V / | |___
+# |_|\_\_____|_____|_|     /_/   \_\_____|___|  \_/  |_____|
+
+
+# Minimal HTTP/1.1 client that keeps a single connection open between requests,
+# on uasyncio streams so the other tasks keep running while a request waits on the
+# network. Only the name resolution of a new connection still blocks. Opening a
+# TCP + TLS connection takes seconds and a lot of heap on an ESP32, so every
+# request reuses the same socket while the server allows it. Several requests to
+# the same host can be pipelined: all of them are written first and the responses
+# are read back in order.
+#
+# After a failed connection, new attempts wait for an exponential backoff. A
+# response it can't parse closes the connection and is raised as an OSError, there
+# is no `urequests` fallback, which would block the event loop.
+#
+# A server that sheds load answers 429 or 503 with a Retry-After header, its
+# value (in seconds) is kept in `retry_after` for the caller to honor.
+
+
+
+################################################################################
+##                                  LIBRARIES                                 ##
+################################################################################
+
+################
+##  BUILT-IN  ##
+################
+
+from utime import ticks_ms, ticks_add, ticks_diff
+import uasyncio as asyncio
+
+
+
+################################################################################
+##                                   CLIENT                                   ##
+################################################################################
+
+class AsyncKeepAliveClient:
+
+  def __init__(self, timeout=10, backoff=1000, max_backoff=60000, headers=None):
+    """
+    AsyncKeepAliveClient(timeout=10, backoff=1000, max_backoff=60000, headers=None)
+    timeout: seconds to wait for the connection, or for any read or write on it
+    backoff: first wait after a failed connection in milliseconds, doubled on every failure
+    max_backoff: maximum wait after a failed connection in milliseconds
+    headers: extra headers sent with every request, as a dict
+    """
+
+    self.timeout = timeout
+    self.backoff = backoff
+    self.max_backoff = max_backoff
+    self.headers = headers or {}
+    self.retry_after = None # seconds, longest Retry-After of the latest requests
+
+    self._reader = None
+    self._writer = None
+    self._target = None
+    self._current_backoff = 0
+    self._retry_at = None
+
+
+  def close(self):
+    if self._writer is not None:
+      try:
+        self._writer.close()
+      except OSError:
+        pass
+    self._reader = None
+    self._writer = None
+    self._target = None
+
+
+  def _parse_url(self, url):
+    proto, _, rest = url.split("/", 2)
+    host, _, path = rest.partition("/")
+    secure = proto == "https:"
+    port = 443 if secure else 80
+    if ":" in host:
+      host, port = host.split(":", 1)
+    return secure, host, int(port), "/" + path
+
+
+  def _waiting(self):
+    return self._retry_at is not None and ticks_diff(self._retry_at, ticks_ms()) > 0
+
+
+  def _failed(self):
+    self._current_backoff = min(max(2 * self._current_backoff, self.backoff), self.max_backoff)
+    self._retry_at = ticks_add(ticks_ms(), self._current_backoff)
+
+
+  def _succeeded(self):
+    self._current_backoff = 0
+    self._retry_at = None
+
+
+  def _request(self, host, path, body, content_type):
+    if isinstance(body, str):
+      body = body.encode()
+
+    return (
+      "POST {} HTTP/1.1\r\n"
+      "Host: {}\r\n"
+      "Content-Type: {}\r\n"
+      "Content-Length: {}\r\n"
+      "Connection: keep-alive\r\n"
+      "{}"
+      "\r\n"
+    ).format(path, host, content_type, len(body), self._extra_headers()).encode(), body
+
+
+  def _extra_headers(self):
+    return "".join("{}: {}\r\n".format(name, value) for name, value in self.headers.items())
+
+
+  def _wait(self, value):
+    # Retry-After in seconds, the HTTP date form is not used by the API
+    try:
+      self.retry_after = max(self.retry_after or 0, int(value))
+    except (ValueError, TypeError):
+      pass
+
+
+  def _header(self, line, response):
+    # Parse a header line into `response`, a [length, chunked, keep_alive] list
+    name, _, value = line.partition(b":")
+    name = name.strip().lower()
+    value = value.strip().lower()
+    if name == b"content-length":
+      response[0] = int(value)
+    elif name == b"transfer-encoding":
+      response[1] = value == b"chunked"
+    elif name == b"connection":
+      response[2] = value != b"close"
+    elif name == b"retry-after":
+      self._wait(value)
+
+
+  async def post(self, url, body, content_type="application/json"):
+    # Send a single POST request, returns the (status, body) of the response
+    return (await self.post_many([(url, body)], content_type))[0]
+
+
+  async def post_many(self, requests, content_type="application/json"):
+    # Send several POST requests to the same host, pipelined on a single connection.
+    # Returns the (status, body) of every response, in order. Raises OSError if the
+    # requests could not be delivered, some of them may have been processed already.
+    self.retry_after = None
+    try:
+      return await self._post_many(requests, content_type)
+    except (ValueError, TypeError, AttributeError, IndexError) as e:
+      # A response it can't parse, the connection is in an unknown state
+      self.close()
+      raise OSError("Invalid response: {}".format(e))
+
+
+  async def _post_many(self, requests, content_type):
+    pending = [(self._parse_url(url), body) for url, body in requests]
+    target = pending[0][0][:3]
+    responses = []
+    retried = False
+
+    while pending:
+      # A reused connection may have been closed by the server while idle,
+      # that is retried once on a fresh connection
+      fresh = self._writer is None or self._target != target
+      if fresh:
+        await self._connect(*target)
+      received = len(responses)
+
+      try:
+        for (secure, host, port, path), body in pending:
+          head, body = self._request(host, path, body, content_type)
+          self._writer.write(head)
+          self._writer.write(body)
+        await self._io(self._writer.drain())
+
+        for _ in range(len(pending)):
+          status, data, keep_alive = await self._receive()
+          responses.append((status, data))
+          pending.pop(0)
+
+          # The requests after this one were dropped by the server, send them again
+          if not keep_alive:
+            self.close()
+            break
+
+      except OSError:
+        self.close()
+        # The server closed the connection after some responses, send the rest again
+        if len(responses) > received:
+          retried = False
+          continue
+        if fresh or retried:
+          self._failed()
+          raise
+        retried = True
+
+    self._succeeded()
+    return responses
+
+
+  async def _connect(self, secure, host, port):
+    self.close()
+
+    if self._waiting():
+      raise OSError("Waiting to reconnect")
+
+    try:
+      self._reader, self._writer = await self._io(asyncio.open_connection(host, port, ssl=True if secure else None))
+    except OSError:
+      self._failed()
+      raise
+
+    self._target = (secure, host, port)
+
+
+  async def _io(self, awaitable):
+    # A stalled server must not hold the task forever
+    try:
+      return await asyncio.wait_for(awaitable, self.timeout)
+    except asyncio.TimeoutError:
+      raise OSError("Timed out")
+
+
+  async def _readline(self):
+    line = await self._io(self._reader.readline())
+    if not line:
+      raise OSError("Connection closed")
+    return line
+
+
+  async def _read(self, n):
+    data = b""
+    while len(data) < n:
+      chunk = await self._io(self._reader.read(n - len(data)))
+      if not chunk:
+        raise OSError("Connection closed")
+      data += chunk
+    return data
+
+
+  async def _receive(self):
+    # Status line, e.g. "HTTP/1.1 200 OK"
+    status = int((await self._readline()).split(None, 2)[1])
+
+    response = [None, False, True]
+    while True:
+      line = await self._readline()
+      if line == b"\r\n":
+        break
+      self._header(line, response)
+    length, chunked, keep_alive = response
+
+    if chunked:
+      data = b""
+      while True:
+        size = int((await self._readline()).split(b";")[0], 16)
+        if size == 0:
+          # Skip the trailers
+          while await self._readline() != b"\r\n":
+            pass
+          break
+        data += await self._read(size)
+        await self._readline()
+
+    elif length is not None:
+      data = await self._read(length)
+
+    else:
+      # No length: the body ends when the server closes the connection
+      data = b""
+      while True:
+        chunk = await self._io(self._reader.read(512))
+        if not chunk:
+          break
+        data += chunk
+      keep_alive = False
+
+    return status, data, keep_alive
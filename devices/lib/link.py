@@ -0,0 +1,55 @@
+# Packed link telemetry record, one per packet received by the receptor. Shared by the
+# receptor buffer and the API binary ingest route. Little-endian, 14 bytes, no padding:
+#
+#   collector_id (uint32) | epoch (uint32, Unix seconds) | rssi (int16, dBm) | snr (int8, 1/4 dB)
+#   | header_id (uint8) | duplicates (uint8) | flags (uint8)
+#
+# `header_id` grows by one for every frame a collector sends, the API estimates the
+# lost frames from the gaps. `duplicates` counts the retransmissions of the collector
+# dropped by the receptor since its previous packet, they mean the ACKs were lost.
+#
+# The same layout is decoded on the API side (`api/src/utils/binary.py`), keep both in sync.
+
+
+
+################################################################################
+##                                  LIBRARIES                                 ##
+################################################################################
+
+################
+##  BUILT-IN  ##
+################
+
+import struct
+
+
+
+################################################################################
+##                                  CONSTANTS                                 ##
+################################################################################
+
+LINK_FORMAT = "<IIhbBBB"
+LINK_SIZE = struct.calcsize(LINK_FORMAT)
+
+# Flags, same meaning as in `record.py`
+FLAG_TIME_UNSYNCED = 0x01 # The receptor clock was not synchronized by NTP yet
+
+
+
+################################################################################
+##                                  FUNCTIONS                                 ##
+################################################################################
+
+def pack(collector_id, epoch, rssi, snr, header_id, duplicates=0, flags=0):
+  return struct.pack(
+    LINK_FORMAT, collector_id, epoch,
+    max(-32768, min(int(rssi), 32767)), max(-128, min(int(snr * 4), 127)),
+    header_id, min(duplicates, 255), flags
+  )
+
+
+def unpack(data):
+  # Iterate over the (collector_id, epoch, rssi, snr, header_id, duplicates, flags) of every record in `data`
+  for offset in range(0, len(data), LINK_SIZE):
+    collector_id, epoch, rssi, snr, header_id, duplicates, flags = struct.unpack_from(LINK_FORMAT, data, offset)
+    yield collector_id, epoch, rssi, snr / 4, header_id, duplicates, flags
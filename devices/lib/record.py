@@ -0,0 +1,45 @@
+# Packed binary record, shared by the receptor buffer and the API binary ingest route.
+# Little-endian, 12 bytes, no padding between fields:
+#
+#   collector_id (uint32) | epoch (uint32, Unix seconds) | reading (uint16) | flags (uint8) | reserved (uint8)
+#
+# The same layout is decoded on the API side (`api/src/utils/binary.py`), keep both in sync.
+
+
+
+################################################################################
+##                                  LIBRARIES                                 ##
+################################################################################
+
+################
+##  BUILT-IN  ##
+################
+
+import struct
+
+
+
+################################################################################
+##                                  CONSTANTS                                 ##
+################################################################################
+
+RECORD_FORMAT = "<IIHBx"
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+
+# Flags
+FLAG_TIME_UNSYNCED = 0x01 # The receptor clock was not synchronized by NTP yet
+
+
+
+################################################################################
+##                                  FUNCTIONS                                 ##
+################################################################################
+
+def pack(collector_id, epoch, reading, flags=0):
+  return struct.pack(RECORD_FORMAT, collector_id, epoch, reading, flags)
+
+
+def unpack(data):
+  # Iterate over the (collector_id, epoch, reading, flags) of every record in `data`
+  for offset in range(0, len(data), RECORD_SIZE):
+    yield struct.unpack_from(RECORD_FORMAT, data, offset)
@@ -0,0 +1,202 @@
+#  ____  ___ _   _  ____   ____  _   _ _____ _____ _____ ____
+# |  _ \|_ _| \ | |/ ___| | __ )| | | |  ___|  ___| ____|  _ \
+# | |_) || ||  \| | |  _  |  _ \| | | | |_  | |_  |  _| | |_) |
+# |  _ < | || |\  | |_| | | |_) | |_| |  _| |  _| | |___|  _ <
+# |_| \_\___|_| \_|\____| |____/ \___/|_|   |_|   |_____|_| \_\
+
+
+# Persistent FIFO of fixed-size binary records stored in a flash file.
+# The file starts with a small header followed by `capacity` record slots:
+#
+#   magic (4s) | record_size (H) | capacity (H) | head (I) | count (I) | dropped (I) | sequence (I)
+#
+# `head` is the slot of the oldest record and `count` how many are stored.
+# When the buffer is full the oldest record is overwritten and `dropped` grows.
+#
+# Every slot starts with the sequence number (I) of its record, one more than the
+# record before. The position lives in RAM and the header is only written every
+# `sync_every` pushes and on every pop, which saves a flash write per record. On
+# open, the records pushed after the latest header are found again by following
+# the sequence numbers from the tail.
+
+
+
+################################################################################
+##                                  LIBRARIES                                 ##
+################################################################################
+
+################
+##  BUILT-IN  ##
+################
+
+import struct
+
+
+
+################################################################################
+##                                  CONSTANTS                                 ##
+################################################################################
+
+MAGIC = b"RB02"
+HEADER_FORMAT = "<4sHHIIII"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+SEQUENCE_FORMAT = "<I"
+SEQUENCE_SIZE = struct.calcsize(SEQUENCE_FORMAT)
+SEQUENCE_MASK = 0xFFFFFFFF
+
+
+
+################################################################################
+##                                 RING BUFFER                                ##
+################################################################################
+
+class RingBuffer:
+
+  def __init__(self, path, record_size, capacity, sync_every=16):
+    """
+    RingBuffer(path, record_size, capacity, sync_every=16)
+    path: file used to store the records, created if missing
+    record_size: size of every record in bytes
+    capacity: maximum number of records kept
+    sync_every: pushes between header writes
+    """
+
+    self.path = path
+    self.record_size = record_size
+    self.capacity = capacity
+    self.sync_every = sync_every
+    self.head = 0
+    self.count = 0
+    self.dropped = 0
+    self.sequence = 0 # of the next record
+
+    self._slot_size = SEQUENCE_SIZE + record_size
+    self._unsynced = 0
+
+    try:
+      self._file = open(path, "r+b")
+      if self._read_header():
+        self._recover()
+      else:
+        self._reset()
+    except OSError:
+      self._reset()
+
+
+  def __len__(self):
+    return self.count
+
+
+  def _read_header(self):
+    self._file.seek(0)
+    header = self._file.read(HEADER_SIZE)
+    if len(header) != HEADER_SIZE:
+      return False
+
+    magic, record_size, capacity, head, count, dropped, sequence = struct.unpack(HEADER_FORMAT, header)
+
+    # A different layout means the records can't be trusted, start over
+    if magic != MAGIC or record_size != self.record_size or capacity != self.capacity:
+      return False
+
+    self.head, self.count, self.dropped, self.sequence = head, count, dropped, sequence
+    return True
+
+
+  def _recover(self):
+    # Take back the records pushed after the latest header, they carry the next sequence numbers
+    for _ in range(self.capacity):
+      self._seek(self.head + self.count)
+      slot = self._file.read(SEQUENCE_SIZE)
+      if len(slot) != SEQUENCE_SIZE or struct.unpack(SEQUENCE_FORMAT, slot)[0] != self.sequence:
+        break
+      self._advance()
+
+    self._write_header()
+
+
+  def _write_header(self):
+    self._file.seek(0)
+    self._file.write(struct.pack(
+      HEADER_FORMAT, MAGIC, self.record_size, self.capacity, self.head, self.count, self.dropped, self.sequence
+    ))
+    self._file.flush()
+    self._unsynced = 0
+
+
+  def _reset(self):
+    # Truncate the file, records left in the slots could pass for recent ones
+    try:
+      self._file.close()
+    except AttributeError:
+      pass
+    self._file = open(self.path, "w+b")
+    self.head = self.count = self.dropped = self.sequence = 0
+    self._write_header()
+
+
+  def _seek(self, slot):
+    self._file.seek(HEADER_SIZE + (slot % self.capacity) * self._slot_size)
+
+
+  def _advance(self):
+    if self.count == self.capacity:
+      self.head = (self.head + 1) % self.capacity
+      self.dropped += 1
+    else:
+      self.count += 1
+    self.sequence = (self.sequence + 1) & SEQUENCE_MASK
+
+
+  def push(self, record):
+    # Add a record at the end of the buffer, overwriting the oldest one when full
+    if len(record) != self.record_size:
+      raise ValueError("Invalid record size")
+
+    self._seek(self.head + self.count)
+    self._file.write(struct.pack(SEQUENCE_FORMAT, self.sequence) + record)
+    self._advance()
+
+    self._unsynced += 1
+    if self._unsynced >= self.sync_every:
+      self._write_header()
+    else:
+      self._file.flush()
+
+
+  def peek(self, n):
+    # Read up to `n` of the oldest records as a single bytes object, without removing them
+    n = min(n, self.count)
+    data = b""
+    slot = self.head
+
+    while n:
+      # Records may wrap around the end of the file, read at most up to it
+      chunk = min(n, self.capacity - slot)
+      self._seek(slot)
+      slots = self._file.read(chunk * self._slot_size)
+      for offset in range(SEQUENCE_SIZE, len(slots), self._slot_size):
+        data += slots[offset:offset + self.record_size]
+      slot = (slot + chunk) % self.capacity
+      n -= chunk
+
+    return data
+
+
+  def pop(self, n):
+    # Remove the `n` oldest records, once they are safely delivered
+    n = min(n, self.count)
+    self.head = (self.head + n) % self.capacity
+    self.count -= n
+    self._write_header()
+
+
+  def sync(self):
+    # Write the header, e.g. before a planned reset
+    if self._unsynced:
+      self._write_header()
+
+
+  def close(self):
+    self.sync()
+    self._file.close()
@@ -5,10 +5,12 @@
 
 import time
 import math
+import micropython
 from ucollections import namedtuple
 from urandom import getrandbits
 from machine import SPI
 from machine import Pin
+from machine import idle
 
 #Constants
 FLAGS_ACK = 0x80
@@ -58,12 +60,84 @@ REG_09_PA_CONFIG = 0x09
 FXOSC = 32000000.0
 FSTEP = (FXOSC / 524288)
 
+FIFO_SIZE = 256
+HEADER_SIZE = 4
+ACK_SIZE = HEADER_SIZE + 4  # '!' and the control bytes of adr.py
+
+# Bandwidths selected by the high nibble of MODEM_CONFIG1, in Hz
+BANDWIDTHS = (7800, 10400, 15600, 20800, 31250, 41700, 62500, 125000, 250000, 500000)
+
+# Received packet, queued for `receive` and passed to on_recv
+# timestamp: `time.time()` when the packet was read from the radio
+Payload = namedtuple(
+    "Payload",
+    ['message', 'header_to', 'header_from', 'header_id', 'header_flags', 'rssi', 'snr', 'timestamp']
+)
+
 class ModemConfig():
     Bw125Cr45Sf128 = (0x72, 0x74, 0x04) #< Bw = 125 kHz, Cr = 4/5, Sf = 128chips/symbol, CRC on. Default medium range
     Bw500Cr45Sf128 = (0x92, 0x74, 0x04) #< Bw = 500 kHz, Cr = 4/5, Sf = 128chips/symbol, CRC on. Fast+short range
     Bw31_25Cr48Sf512 = (0x48, 0x94, 0x04) #< Bw = 31.25 kHz, Cr = 4/8, Sf = 512chips/symbol, CRC on. Slow+long range
     Bw125Cr48Sf4096 = (0x78, 0xc4, 0x0c) #/< Bw = 125 kHz, Cr = 4/8, Sf = 4096chips/symbol, low data rate, CRC on. Slow+long range
     Bw125Cr45Sf2048 = (0x72, 0xb4, 0x04) #< Bw = 125 kHz, Cr = 4/5, Sf = 2048chips/symbol, CRC on. Slow+long range
+    Bw125Cr45Sf256 = (0x72, 0x84, 0x04) #< Bw = 125 kHz, Cr = 4/5, Sf = 256chips/symbol, CRC on
+    Bw125Cr45Sf512 = (0x72, 0x94, 0x04) #< Bw = 125 kHz, Cr = 4/5, Sf = 512chips/symbol, CRC on
+    Bw125Cr45Sf1024 = (0x72, 0xa4, 0x04) #< Bw = 125 kHz, Cr = 4/5, Sf = 1024chips/symbol, CRC on
+
+def time_on_air(modem_config, length, preamble=8):
+    # Milliseconds a packet of `length` bytes (header included) occupies the channel,
+    # SX1276 datasheet section 4.1.1.7. `modem_config` is one of the ModemConfig tuples.
+    config1, config2, config3 = modem_config
+    bandwidth = BANDWIDTHS[config1 >> 4]
+    spreading_factor = config2 >> 4
+    coding_rate = (config1 >> 1) & 0x07  # 1 to 4, for 4/5 to 4/8
+    implicit_header = config1 & 0x01
+    crc = (config2 >> 2) & 0x01
+    low_data_rate = (config3 >> 3) & 0x01
+
+    symbol_time = 1000 * (1 << spreading_factor) / bandwidth
+    payload_symbols = math.ceil(
+        (8 * length - 4 * spreading_factor + 28 + 16 * crc - 20 * implicit_header) /
+        (4 * (spreading_factor - 2 * low_data_rate))
+    )
+    payload_symbols = 8 + max(payload_symbols * (coding_rate + 4), 0)
+    return (preamble + 4.25 + payload_symbols) * symbol_time
+
+class AirtimeBudget():
+    def __init__(self, duty_cycle=0.01, window=3600):
+        """
+        AirtimeBudget(duty_cycle=0.01, window=3600)
+        duty_cycle: fraction of the time the device may transmit, e.g. 0.01 in the EU868 g1 sub-band
+        window: seconds the duty cycle is measured over, the budget never holds more than one window
+        """
+        self.duty_cycle = duty_cycle
+        self.capacity = duty_cycle * window * 1000  # ms of airtime
+        self._available = self.capacity
+        self._updated = time.ticks_ms()
+
+    def _refill(self):
+        now = time.ticks_ms()
+        elapsed = max(time.ticks_diff(now, self._updated), 0)
+        self._updated = now
+        self._available = min(self._available + elapsed * self.duty_cycle, self.capacity)
+
+    def available(self):
+        # Milliseconds of airtime that can be used now
+        self._refill()
+        return self._available
+
+    def consume(self, airtime):
+        # Take `airtime` ms from the budget, False if there is not enough left
+        self._refill()
+        if airtime > self._available:
+            return False
+        self._available -= airtime
+        return True
+
+    def wait_time(self, airtime):
+        # Milliseconds until `airtime` ms can be used
+        missing = airtime - self.available()
+        return 0 if missing <= 0 else int(missing / self.duty_cycle) + 1
 
 class SPIConfig():
     # spi pin defs for various boards (channel, sck, mosi, miso)
@@ -76,10 +150,12 @@ class SPIConfig():
 
 class LoRa(object):
     def __init__(self, spi_channel, interrupt, this_address, cs_pin, reset_pin=None, freq=868.0, tx_power=14,
-                 modem_config=ModemConfig.Bw125Cr45Sf128, receive_all=False, acks=False, crypto=None):
+                 modem_config=ModemConfig.Bw125Cr45Sf128, receive_all=False, acks=False, crypto=None, rx_queue_size=8,
+                 dedup_window=5, duty_cycle=None, csma=False, backoff=0.1, max_backoff=5.0, csma_attempts=6):
         """
         Lora(channel, interrupt, this_address, cs_pin, reset_pin=None, freq=868.0, tx_power=14,
-                 modem_config=ModemConfig.Bw125Cr45Sf128, receive_all=False, acks=False, crypto=None)
+                 modem_config=ModemConfig.Bw125Cr45Sf128, receive_all=False, acks=False, crypto=None, rx_queue_size=8,
+                 dedup_window=5, duty_cycle=None, csma=False, backoff=0.1, max_backoff=5.0, csma_attempts=6)
         channel: SPI channel, check SPIConfig for preconfigured names
         interrupt: GPIO interrupt pin
         this_address: set address for this device [0-254]
@@ -91,6 +167,15 @@ class LoRa(object):
         receive_all: if True, don't filter packets on address
         acks: if True, request acknowledgments
         crypto: if desired, an instance of ucrypto AES (https://docs.pycom.io/firmwareapi/micropython/ucrypto/) - not tested
+        rx_queue_size: received packets kept until `receive` takes them, newer packets are dropped when it is full
+        dedup_window: seconds a (sender, header_id) pair is remembered, retransmissions inside it are ACKed
+            but not delivered again. 0 disables the check
+        duty_cycle: if set, transmissions are limited to this fraction of the time (see AirtimeBudget),
+            `send` returns False when the budget is exhausted
+        csma: if True, listen before talk: a CAD runs before every transmission (ACKs excepted), and a busy
+            channel or a missing ACK waits a random backoff, up to `backoff` * 2^attempt seconds
+        max_backoff: maximum backoff window in seconds
+        csma_attempts: CADs before `send` gives up on a busy channel and returns False
         """
         
         self._spi_channel = spi_channel
@@ -109,12 +194,57 @@ class LoRa(object):
         self._last_header_id = 0
 
         self._last_payload = None
+        self.last_ack = None
         self.crypto = crypto
 
         self.cad_timeout = 0
         self.send_retries = 2
         self.wait_packet_sent_timeout = 0.2
         self.retry_timeout = 0.2
+
+        # Regional duty-cycle limit
+        self.budget = AirtimeBudget(duty_cycle) if duty_cycle else None
+        self.duty_cycle_blocked = 0
+
+        # Listen before talk
+        self.csma = csma
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.csma_attempts = csma_attempts
+        self.channel_busy = 0
+
+        # Time-on-air of the last packet sent, in ms, the waits are never shorter than it
+        self._tx_airtime = 0
+
+        # Preallocated SPI buffers, the receive path runs from the interrupt and
+        # should not wake the garbage collector
+        self._address = bytearray(1)
+        self._register = bytearray(2)
+        self._registers = bytearray(4)
+        self._fifo = memoryview(bytearray(FIFO_SIZE))
+
+        # Received packets, filled by `_service` and drained by `receive`. One slot
+        # stays empty, so each side only moves its own index.
+        self._rx_queue = [None] * (rx_queue_size + 1)
+        self._rx_head = 0
+        self._rx_tail = 0
+        self.rx_overflow = 0
+
+        # Last header_id and its ticks_ms for every sender, to drop retransmissions
+        # whose ACK was lost
+        self.dedup_window = dedup_window
+        self._seen_ids = bytearray(256)
+        self._seen_ticks = [None] * 256
+        self.rx_duplicates = 0
+        # Per sender, saturating at 255. The application reads and clears them, e.g.
+        # to report the retransmissions of every collector.
+        self.duplicates = bytearray(256)
+
+        # The interrupt only schedules `_service`, the bound method is created once here
+        self._service_ref = self._service
+        self._scheduled = False
+        self._missed = False
+        self._servicing = False
         
         # Setup the module
 #        gpio_interrupt = Pin(self._interrupt, Pin.IN, Pin.PULL_DOWN)
@@ -151,38 +281,75 @@ class LoRa(object):
         self.set_mode_idle()
 
         # set modem config (Bw125Cr45Sf128)
-        self._spi_write(REG_1D_MODEM_CONFIG1, self._modem_config[0])
-        self._spi_write(REG_1E_MODEM_CONFIG2, self._modem_config[1])
-        self._spi_write(REG_26_MODEM_CONFIG3, self._modem_config[2])
+        self.set_modem_config(self._modem_config)
 
         # set preamble length (8)
-        self._spi_write(REG_20_PREAMBLE_MSB, 0)
-        self._spi_write(REG_21_PREAMBLE_LSB, 8)
+        self._spi_write(REG_20_PREAMBLE_MSB, bytes((0, 8)))
 
         # set frequency
         frf = int((self._freq * 1000000.0) / FSTEP)
-        self._spi_write(REG_06_FRF_MSB, (frf >> 16) & 0xff)
-        self._spi_write(REG_07_FRF_MID, (frf >> 8) & 0xff)
-        self._spi_write(REG_08_FRF_LSB, frf & 0xff)
+        self._spi_write(REG_06_FRF_MSB, bytes(((frf >> 16) & 0xff, (frf >> 8) & 0xff, frf & 0xff)))
         
         # Set tx power
-        if self._tx_power < 5:
-            self._tx_power = 5
-        if self._tx_power > 23:
-            self._tx_power = 23
+        self.set_tx_power(self._tx_power)
+
+    def set_modem_config(self, modem_config):
+        # Change the modem settings, one of the ModemConfig tuples. MODEM_CONFIG1 and 2 are consecutive.
+        mode = self._mode
+        self.set_mode_idle()
+        self._spi_write(REG_1D_MODEM_CONFIG1, bytes(modem_config[:2]))
+        self._spi_write(REG_26_MODEM_CONFIG3, modem_config[2])
+        self._modem_config = modem_config
+        if mode == MODE_RXCONTINUOUS:
+            self.set_mode_rx()
 
-        if self._tx_power < 20:
+    def set_tx_power(self, tx_power):
+        # Change the transmit power, in dBm between 5 and 23
+        tx_power = min(max(tx_power, 5), 23)
+        self.tx_power = tx_power
+
+        # The high power DAC adds 3 dB above 20 dBm, as in RadioHead. It was enabled
+        # below 20 dBm instead, which overflowed PA_CONFIG from 5 to 7 dBm.
+        if tx_power > 20:
             self._spi_write(REG_4D_PA_DAC, PA_DAC_ENABLE)
-            self._tx_power -= 3
+            tx_power -= 3
         else:
             self._spi_write(REG_4D_PA_DAC, PA_DAC_DISABLE)
 
-        self._spi_write(REG_09_PA_CONFIG, PA_SELECT | (self._tx_power - 5))
-        
+        self._spi_write(REG_09_PA_CONFIG, PA_SELECT | (tx_power - 5))
+
+    @property
+    def modem_config(self):
+        return self._modem_config
+
     def on_recv(self, message):
         # This should be overridden by the user
+        # Called from the scheduler once the packet is queued, keep it short
         pass
 
+    def ack_message(self, header_from, header_flags, snr):
+        # Message of the ACK to a packet, can be overridden to send control data back
+        # (see `adr.py`). Called from the scheduler, keep it short.
+        return b'!'
+
+    def receive(self):
+        # Take the oldest received packet out of the queue, None if it is empty
+        if self._missed:
+            self._service(None)
+
+        head = self._rx_head
+        if head == self._rx_tail:
+            return None
+
+        payload = self._rx_queue[head]
+        self._rx_queue[head] = None
+        self._rx_head = (head + 1) % len(self._rx_queue)
+        return payload
+
+    def available(self):
+        # Number of packets waiting in the queue
+        return (self._rx_tail - self._rx_head) % len(self._rx_queue)
+
     def sleep(self):
         if self._mode != MODE_SLEEP:
             self._spi_write(REG_01_OP_MODE, MODE_SLEEP)
@@ -206,37 +373,76 @@ class LoRa(object):
             self._spi_write(REG_40_DIO_MAPPING1, 0x80)  # Interrupt on CadDone
             self._mode = MODE_CAD
 
+    def _wait_mode(self, mode, timeout):
+        # Idle until the interrupt moves the radio out of `mode`, False after `timeout` seconds
+        deadline = time.ticks_add(time.ticks_ms(), int(timeout * 1000))
+        while self._mode == mode:
+            if time.ticks_diff(deadline, time.ticks_ms()) <= 0:
+                return False
+            self._idle()
+        return True
+
+    def _idle(self):
+        # Let the scheduler run `_service`, or read the flags when it is already running
+        if self._missed and not self._servicing:
+            self._service(None)
+            return
+
+        idle()
+        if self._servicing:
+            self._poll_flags()
+
     def _is_channel_active(self):
+        # A CAD takes a few symbols, a missing interrupt counts as an active channel
         self.set_mode_cad()
+        if not self._wait_mode(MODE_CAD, self.wait_packet_sent_timeout):
+            self.set_mode_idle()
+            return True
+        return bool(self._cad)
 
-        while self._mode == MODE_CAD:
-            yield
+    def _backoff(self, attempt):
+        # Random wait in [0, backoff * 2^attempt], capped at max_backoff
+        window = min(self.backoff * (1 << attempt), self.max_backoff)
+        time.sleep_ms(int(window * 1000 * getrandbits(16) / (2**16 - 1)))
 
-        return self._cad
-    
     def wait_cad(self):
+        # CSMA: up to `csma_attempts` CADs with an exponential backoff between them
+        if self.csma:
+            for attempt in range(self.csma_attempts):
+                if not self._is_channel_active():
+                    return True
+                self.channel_busy += 1
+                self._backoff(attempt)
+            return False
+
+        # Wait up to `cad_timeout` seconds for a clear channel, False if it stays busy
         if not self.cad_timeout:
             return True
 
-        start = time.time()
-        for status in self._is_channel_active():
-            if time.time() - start < self.cad_timeout:
+        deadline = time.ticks_add(time.ticks_ms(), int(self.cad_timeout * 1000))
+        while self._is_channel_active():
+            remaining = time.ticks_diff(deadline, time.ticks_ms())
+            if remaining <= 0:
                 return False
+            time.sleep_ms(min(100 * (1 + getrandbits(16) % 10), remaining))
 
-            if status is None:
-                time.sleep(0.1)
-                continue
-            else:
-                return status
+        return True
 
     def wait_packet_sent(self):
         # wait for `_handle_interrupt` to switch the mode back
-        start = time.time()
-        while time.time() - start < self.wait_packet_sent_timeout:
-            if self._mode != MODE_TX:
-                return True
+        return self._wait_mode(MODE_TX, max(self.wait_packet_sent_timeout, 2 * self._tx_airtime / 1000))
 
-        return False
+    def time_on_air(self, length):
+        # Milliseconds a message of `length` bytes occupies the channel with the current settings
+        return time_on_air(self._modem_config, HEADER_SIZE + length)
+
+    def slot_offset(self, period, slots, now):
+        # TDMA: the period (ms) is split in `slots`, and the device sends in the one given by
+        # its address. Returns the ms to add to `now` to reach the nearest start of the slot,
+        # between -period/2 and period/2, on a clock shared by the devices or, at least,
+        # started at the same time.
+        start = (self._this_address % slots) * period // slots
+        return (start - now + period // 2) % period - period // 2
 
     def set_mode_idle(self):
         if self._mode != MODE_STDBY:
@@ -246,71 +452,116 @@ class LoRa(object):
     def send(self, data, header_to, header_id=0, header_flags=0):
         self.wait_packet_sent()
         self.set_mode_idle()
-        self.wait_cad()
 
-        header = [header_to, self._this_address, header_id, header_flags]
+        # ACKs go out at once, the sender is waiting for them and the channel just got free
+        if not header_flags & FLAGS_ACK and not self.wait_cad():
+            return False
+
         if type(data) == int:
-            data = [data]
-        elif type(data) == bytes:
-            data = [p for p in data]
+            data = bytes((data,))
         elif type(data) == str:
-            data = [ord(s) for s in data]
+            data = data.encode()
+        elif type(data) == list:
+            data = bytes(data)
 
         if self.crypto:
-            data = [b for b in self._encrypt(bytes(data))]
+            data = self._encrypt(bytes(data))
+
+        # Header and data go to the FIFO in a single burst
+        length = HEADER_SIZE + len(data)
+        airtime = time_on_air(self._modem_config, length)
+        if self.budget and not self.budget.consume(airtime):
+            self.duty_cycle_blocked += 1
+            return False
+        self._tx_airtime = airtime
+
+        fifo = self._fifo
+        fifo[0] = header_to
+        fifo[1] = self._this_address
+        fifo[2] = header_id
+        fifo[3] = header_flags
+        fifo[4:length] = data
 
-        payload = header + data
         self._spi_write(REG_0D_FIFO_ADDR_PTR, 0)
-        self._spi_write(REG_00_FIFO, payload)
-        self._spi_write(REG_22_PAYLOAD_LENGTH, len(payload))
+        self._spi_write(REG_00_FIFO, fifo[:length])
+        self._spi_write(REG_22_PAYLOAD_LENGTH, length)
 
         self.set_mode_tx()
         return True
 
     def send_to_wait(self, data, header_to, header_flags=0, retries=3):
-        self._last_header_id += 1
+        self._last_header_id = (self._last_header_id + 1) & 0xff
+
+        for attempt in range(retries + 1):
+            if attempt and self.csma:
+                self._backoff(attempt - 1)
 
-        for _ in range(retries + 1):
-            self.send(data, header_to, header_id=self._last_header_id, header_flags=header_flags)
+            sent = self.send(data, header_to, header_id=self._last_header_id, header_flags=header_flags)
+            self.wait_packet_sent()  # Switching to RX before TxDone would cut the packet
             self.set_mode_rx()
 
-            if header_to == BROADCAST_ADDRESS:  # Don't wait for acks from a broadcast message
+            if sent and header_to == BROADCAST_ADDRESS:  # Don't wait for acks from a broadcast message
                 return True
 
-            start = time.time()
-            while time.time() - start < self.retry_timeout + (self.retry_timeout * (getrandbits(16) / (2**16 - 1))):
+            # Random timeout between 1 and 2 times retry_timeout, CSMA randomizes the
+            # backoff instead. Plus the time-on-air of the ACK.
+            jitter = 0 if self.csma else getrandbits(16) / (2**16 - 1)
+            timeout = int(self.retry_timeout * 1000 * (1 + jitter) +
+                          time_on_air(self._modem_config, ACK_SIZE))
+            deadline = time.ticks_add(time.ticks_ms(), timeout)
+            while sent and time.ticks_diff(deadline, time.ticks_ms()) > 0:
                 if self._last_payload:
                     if self._last_payload.header_to == self._this_address and \
                             self._last_payload.header_flags & FLAGS_ACK and \
                             self._last_payload.header_id == self._last_header_id:
 
                         # We got an ACK
+                        self.last_ack = self._last_payload
                         return True
+
+                self._idle()
         return False
 
-    def send_ack(self, header_to, header_id):
-        self.send(b'!', header_to, header_id, FLAGS_ACK)
+    def send_ack(self, header_to, header_id, message=b'!'):
+        self.send(message, header_to, header_id, FLAGS_ACK)
         self.wait_packet_sent()
 
     def _spi_write(self, register, payload):
-        if type(payload) == int:
-            payload = [payload]
-        elif type(payload) == bytes:
-            payload = [p for p in payload]
-        elif type(payload) == str:
-            payload = [ord(s) for s in payload]
+        # A single register takes an int, a buffer is written in a burst from `register`
         self.cs.value(0)
-        self.spi.write(bytearray([register | 0x80] + payload))
+        if type(payload) == int:
+            buffer = self._register
+            buffer[0] = register | 0x80
+            buffer[1] = payload
+            self.spi.write(buffer)
+        else:
+            if type(payload) == str:
+                payload = payload.encode()
+            self._address[0] = register | 0x80
+            self.spi.write(self._address)
+            self.spi.write(payload)
         self.cs.value(1)
 
     def _spi_read(self, register, length=1):
-        self.cs.value(0)
         if length == 1:
-            data = self.spi.read(length + 1, register)[1]
-        else:
-            data = self.spi.read(length + 1, register)[1:]
+            buffer = self._register
+            buffer[0] = register & 0x7f
+            self.cs.value(0)
+            self.spi.write_readinto(buffer, buffer)
+            self.cs.value(1)
+            return buffer[1]
+
+        data = bytearray(length)
+        self._spi_read_into(register, data)
+        return bytes(data)
+
+    def _spi_read_into(self, register, buffer):
+        # Burst read from `register` into a preallocated buffer
+        self._address[0] = register & 0x7f
+        self.cs.value(0)
+        self.spi.write(self._address)
+        self.spi.readinto(buffer)
         self.cs.value(1)
-        return data
         
     def _decrypt(self, message):
         decrypted_msg = self.crypto.decrypt(message)
@@ -325,17 +576,56 @@ class LoRa(object):
         return encrypted_msg
 
     def _handle_interrupt(self, channel):
+        # Runs in interrupt context: no SPI and no allocation, the work is done by `_service`
+        if self._scheduled:
+            return
+        try:
+            micropython.schedule(self._service_ref, None)
+            self._scheduled = True
+        except RuntimeError:
+            # The scheduler queue is full, the next `receive` services the radio
+            self._missed = True
+
+    def _poll_flags(self):
+        # `_service` can't run again while it is running (e.g. sending an ACK), so the
+        # waits read the TX and CAD flags themselves then
         irq_flags = self._spi_read(REG_12_IRQ_FLAGS)
+        if self._mode == MODE_TX and (irq_flags & TX_DONE):
+            self.set_mode_idle()
+        elif self._mode == MODE_CAD and (irq_flags & CAD_DONE):
+            self._cad = irq_flags & CAD_DETECTED
+            self.set_mode_idle()
+        else:
+            return
+        self._spi_write(REG_12_IRQ_FLAGS, TX_DONE | CAD_DONE | CAD_DETECTED)
+
+    def _service(self, _):
+        self._scheduled = False
+        self._missed = False
+        self._servicing = True
+        try:
+            self._process_irq()
+        finally:
+            self._servicing = False
+
+    def _process_irq(self):
+        # FIFO_RX_CURRENT_ADDR, IRQ_FLAGS_MASK, IRQ_FLAGS and RX_NB_BYTES in a single burst
+        registers = self._registers
+        self._spi_read_into(REG_10_FIFO_RX_CURRENT_ADDR, registers)
+        irq_flags = registers[2]
 
         if self._mode == MODE_RXCONTINUOUS and (irq_flags & RX_DONE):
-            packet_len = self._spi_read(REG_13_RX_NB_BYTES)
-            self._spi_write(REG_0D_FIFO_ADDR_PTR, self._spi_read(REG_10_FIFO_RX_CURRENT_ADDR))
+            packet_len = registers[3]
+            self._spi_write(REG_0D_FIFO_ADDR_PTR, registers[0])
 
-            packet = self._spi_read(REG_00_FIFO, packet_len)
+            packet = self._fifo[:packet_len]
+            self._spi_read_into(REG_00_FIFO, packet)
             self._spi_write(REG_12_IRQ_FLAGS, 0xff)  # Clear all IRQ flags
 
-            snr = self._spi_read(REG_19_PKT_SNR_VALUE) / 4
-            rssi = self._spi_read(REG_1A_PKT_RSSI_VALUE)
+            # PKT_SNR_VALUE (signed, in quarters of dB) and PKT_RSSI_VALUE
+            self._spi_read_into(REG_19_PKT_SNR_VALUE, registers)
+            snr = (registers[0] - 256 if registers[0] > 127 else registers[0]) / 4
+            rssi = registers[1]
 
             if snr < 0:
                 rssi = snr + rssi
@@ -361,16 +651,20 @@ class LoRa(object):
                     message = self._decrypt(message)
 
                 if self._acks and header_to == self._this_address and not header_flags & FLAGS_ACK:
-                    self.send_ack(header_from, header_id)
+                    self.send_ack(header_from, header_id, self.ack_message(header_from, header_flags, snr))
 
                 self.set_mode_rx()
 
-                self._last_payload = namedtuple(
-                    "Payload",
-                    ['message', 'header_to', 'header_from', 'header_id', 'header_flags', 'rssi', 'snr']
-                )(message, header_to, header_from, header_id, header_flags, rssi, snr)
+                self._last_payload = Payload(message, header_to, header_from, header_id, header_flags, rssi, snr, time.time())
 
                 if not header_flags & FLAGS_ACK:
+                    # The ACK was sent again above, the sender only missed it
+                    if self._is_duplicate(header_from, header_id):
+                        self.rx_duplicates += 1
+                        if self.duplicates[header_from] < 255:
+                            self.duplicates[header_from] += 1
+                        return
+                    self._enqueue(self._last_payload)
                     self.on_recv(self._last_payload)
 
         elif self._mode == MODE_TX and (irq_flags & TX_DONE):
@@ -382,5 +676,30 @@ class LoRa(object):
 
         self._spi_write(REG_12_IRQ_FLAGS, 0xff)
 
+    def _is_duplicate(self, header_from, header_id):
+        # Remember the packet, True if the same sender sent the same header_id recently.
+        # The window keeps a collector that rebooted and restarted its header_id from
+        # being ignored.
+        if not self.dedup_window:
+            return False
+
+        now = time.ticks_ms()
+        last = self._seen_ticks[header_from]
+        duplicate = last is not None and self._seen_ids[header_from] == header_id and \
+            time.ticks_diff(now, last) < self.dedup_window * 1000
+
+        self._seen_ids[header_from] = header_id
+        self._seen_ticks[header_from] = now
+        return duplicate
+
+    def _enqueue(self, payload):
+        tail = self._rx_tail
+        next_tail = (tail + 1) % len(self._rx_queue)
+        if next_tail == self._rx_head:
+            self.rx_overflow += 1
+            return
+        self._rx_queue[tail] = payload
+        self._rx_tail = next_tail
+
     def close(self):
         self.spi.deinit()
\ No newline at end of file
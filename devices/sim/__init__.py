@@ -0,0 +1,7 @@
+# Host-side simulator of the LoRa network: the real `devices/lib` code runs on top of
+# stubbed MicroPython modules and a register level SX127x model sharing a virtual
+# channel. Run `python -m devices.sim --help` from the repository root.
+
+from .clock import VirtualClock
+from .radio import Channel, SX127x
+from .stubs import install
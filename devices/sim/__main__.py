@@ -0,0 +1,249 @@
+# Run N simulated collectors against a simulated receptor and report delivery ratio,
+# retries and receptor throughput as N grows.
+#
+#   python -m devices.sim --collectors 1 5 10 20 50 --duration 600
+#
+# The applications below follow `collector.py` (frames of readings sent with
+# `send_to_wait`) and the radio side of `trensmitter.py` (packets drained from the
+# driver queue and expanded into readings). Each reading carries its sequence number
+# instead of an ADC value, so the receptor can count the unique ones.
+#
+# Columns: delivery (unique readings received / readings sent), frames (sent by the
+# collectors), retries (extra transmissions per frame), throughput (readings per
+# minute at the receptor), load (airtime / duration, over 1 means overlapping
+# transmissions), collisions and lost (packets missed by the receptor because of
+# another packet or of a weak or random loss), blocked (frames not sent because of
+# the duty cycle), busy (CADs that found the channel busy), duplicates and overflow
+# (counters of the receptor driver). With --adr, power is the mean transmit power of
+# the collectors (dBm) and rate the data rate index of the receptor at the end.
+
+
+
+################################################################################
+##                                  LIBRARIES                                 ##
+################################################################################
+
+################
+##  BUILT-IN  ##
+################
+
+import argparse
+import math
+
+
+################
+##  INTERNAL  ##
+################
+
+from .clock import VirtualClock
+from .radio import Channel, SX127x
+from .stubs import install
+from ..lib import frame
+
+
+
+################################################################################
+##                                  CONSTANTS                                 ##
+################################################################################
+
+RECEPTOR_ADDRESS = 1
+
+# Board wiring, any values work as long as they are different
+SPI_CHANNEL = (1, 14, 13, 12)
+CS_PIN = 5
+INTERRUPT_PIN = 26
+RESET_PIN = 27
+
+
+
+################################################################################
+##                                APPLICATIONS                                ##
+################################################################################
+
+class Stats:
+
+  def __init__(self):
+    self.sent = set()     # (collector, sequence) pairs sent at least once
+    self.received = set() # (collector, sequence) pairs at the receptor
+    self.frames = 0       # frames the collectors tried to send
+    self.packets = 0      # packets delivered to the receptor application
+    self.collectors = []  # the collector drivers, for their counters
+    self.lora = None      # the receptor driver
+
+
+def collector(ulora, adr, utime, urandom, address, args, stats):
+  lora = ulora.LoRa(
+    SPI_CHANNEL, INTERRUPT_PIN, address, CS_PIN, reset_pin=RESET_PIN,
+    freq=args.frequency, tx_power=args.tx_power, modem_config=getattr(ulora.ModemConfig, args.modem_config), acks=True,
+    duty_cycle=args.duty_cycle, csma=args.csma
+  )
+  stats.collectors.append(lora)
+  link = adr.LinkFollower(lora) if args.adr else None
+
+  # Collectors don't boot at the same time, unless they wait for their TDMA slot
+  period = int(args.interval * 1000)
+  if args.slots:
+    utime.sleep_ms(lora.slot_offset(period, args.slots, utime.ticks_ms()) % period)
+  else:
+    utime.sleep_ms(urandom.getrandbits(16) * period // 0xffff)
+
+  pending = []
+  sequence = 0
+  while True:
+    pending.append((utime.time(), sequence & 0xffff))
+    sequence += 1
+    if len(pending) > frame.MAX_READINGS:
+      pending.pop(0)
+
+    if len(pending) >= args.frame_readings:
+      now = utime.time()
+      readings = [(now - timestamp, reading) for timestamp, reading in pending]
+      data = str(pending[-1][1]) if args.frame_readings == 1 else frame.encode(readings)
+
+      stats.frames += 1
+      stats.sent.update((address, reading) for _, reading in pending)
+      if link is None:
+        if lora.send_to_wait(data, RECEPTOR_ADDRESS):
+          pending.clear()
+      else:
+        link.poll()
+        if lora.send_to_wait(data, RECEPTOR_ADDRESS, header_flags=link.flags()):
+          link.on_ack(lora.last_ack.message)
+          pending.clear()
+        else:
+          link.on_failure()
+
+    delay = period
+    if args.slots:
+      delay += lora.slot_offset(period, args.slots, utime.ticks_ms() + delay)
+    utime.sleep_ms(delay)
+
+
+def receptor(ulora, adr, machine, args, stats):
+  lora = ulora.LoRa(
+    SPI_CHANNEL, INTERRUPT_PIN, RECEPTOR_ADDRESS, CS_PIN, reset_pin=RESET_PIN,
+    freq=args.frequency, tx_power=args.tx_power, modem_config=getattr(ulora.ModemConfig, args.modem_config), acks=True,
+    rx_queue_size=args.queue_size, duty_cycle=args.duty_cycle
+  )
+  stats.lora = lora
+  adapter = adr.LinkAdapter(lora) if args.adr else None
+  lora.set_mode_rx()
+
+  while True:
+    if adapter is not None:
+      adapter.poll()
+    packet = lora.receive()
+    if packet is None:
+      machine.idle()
+      continue
+
+    stats.packets += 1
+    message = packet.message
+    readings = frame.decode(message) if frame.is_frame(message) else [(0, int(message))]
+    for _, reading in readings:
+      stats.received.add((packet.header_from, reading))
+
+
+
+################################################################################
+##                                 SIMULATION                                 ##
+################################################################################
+
+def simulate(collectors, args):
+
+  """
+  Run one simulation.
+
+  Parameters
+  ----------
+  collectors : int
+    Number of collectors sending to the receptor.
+  args : argparse.Namespace
+    The command line options.
+
+  Returns
+  -------
+  dict
+    The measurements of the run.
+  """
+
+  clock = VirtualClock(seed=args.seed)
+  ulora, adr = install(clock)
+
+  import machine, urandom, utime
+
+  channel = Channel(clock, loss=args.loss)
+  stats = Stats()
+
+  device = clock.add_device("receptor", receptor, ulora, adr, machine, args, stats)
+  gateway = SX127x(channel, device, CS_PIN, INTERRUPT_PIN, position=(0.0, 0.0))
+
+  # Collectors spread uniformly over a disc around the receptor
+  radios = []
+  for i in range(collectors):
+    address = RECEPTOR_ADDRESS + 1 + i
+    radius = args.radius * math.sqrt(clock.random.random())
+    angle = 2 * math.pi * clock.random.random()
+    device = clock.add_device("collector-{}".format(address), collector, ulora, adr, utime, urandom, address, args, stats)
+    radios.append(SX127x(channel, device, CS_PIN, INTERRUPT_PIN, position=(radius * math.cos(angle), radius * math.sin(angle))))
+
+  clock.run(args.duration * 1000)
+
+  transmissions = sum(radio.transmissions for radio in radios)
+  return dict(
+    collectors = collectors,
+    delivery = len(stats.received & stats.sent) / len(stats.sent) if stats.sent else 0.0,
+    frames = stats.frames,
+    retries = (transmissions - stats.frames) / stats.frames if stats.frames else 0.0,
+    throughput = 60 * len(stats.received) / args.duration,
+    load = channel.airtime / clock.now if clock.now else 0.0,
+    collisions = gateway.collisions,
+    lost = gateway.lost,
+    blocked = sum(lora.duty_cycle_blocked for lora in stats.collectors),
+    busy = sum(lora.channel_busy for lora in stats.collectors),
+    duplicates = stats.lora.rx_duplicates if stats.lora else 0,
+    overflow = stats.lora.rx_overflow if stats.lora else 0,
+    power = sum(lora.tx_power for lora in stats.collectors) / len(stats.collectors) if stats.collectors else 0.0,
+    rate = adr.data_rate(stats.lora.modem_config) if stats.lora else None,
+  )
+
+
+
+################################################################################
+##                                    MAIN                                    ##
+################################################################################
+
+def main():
+  parser = argparse.ArgumentParser(prog="python -m devices.sim", description="Simulate collectors sending to a receptor over LoRa.")
+  parser.add_argument("--collectors", type=int, nargs="+", default=[1, 5, 10, 20, 50],
+                      help="number of collectors of each run")
+  parser.add_argument("--duration", type=int, default=600, help="simulated seconds per run")
+  parser.add_argument("--interval", type=float, default=20, help="seconds between readings")
+  parser.add_argument("--frame-readings", type=int, default=1, help="readings per frame, 1 sends plain text")
+  parser.add_argument("--radius", type=float, default=100, help="meters around the receptor")
+  parser.add_argument("--loss", type=float, default=0.0, help="random packet loss probability")
+  parser.add_argument("--modem-config", default="Bw125Cr45Sf128", help="a ModemConfig preset")
+  parser.add_argument("--frequency", type=float, default=915.0, help="MHz")
+  parser.add_argument("--tx-power", type=int, default=14, help="dBm of every radio, the starting power with --adr")
+  parser.add_argument("--duty-cycle", type=float, default=None, help="duty-cycle limit of every device, e.g. 0.01")
+  parser.add_argument("--csma", action="store_true", help="listen before talk on the collectors")
+  parser.add_argument("--slots", type=int, default=0, help="TDMA slots per interval, 0 boots the collectors at random")
+  parser.add_argument("--adr", action="store_true", help="adapt data rate and power to the link margin")
+  parser.add_argument("--queue-size", type=int, default=32, help="receptor packet queue")
+  parser.add_argument("--seed", type=int, default=0)
+  args = parser.parse_args()
+
+  columns = ("collectors", "delivery", "frames", "retries", "throughput", "load", "collisions", "lost", "blocked", "busy", "duplicates", "overflow")
+  if args.adr:
+    columns += ("power", "rate")
+  print("  ".join("{:>11}".format(column) for column in columns))
+  for collectors in args.collectors:
+    result = simulate(collectors, args)
+    print("  ".join(
+      "{:>11.3f}".format(result[column]) if isinstance(result[column], float) else "{:>11}".format(result[column])
+      for column in columns
+    ))
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,206 @@
+################################################################################
+##                                  LIBRARIES                                 ##
+################################################################################
+
+################
+##  BUILT-IN  ##
+################
+
+import heapq
+import random
+import threading
+
+
+
+################################################################################
+##                                  CONSTANTS                                 ##
+################################################################################
+
+IDLE_QUANTUM = 10 # ms, `machine.idle()` also returns on the next system tick
+SCHEDULE_DEPTH = 8 # pending `micropython.schedule` callbacks, as on the boards
+
+
+
+################################################################################
+##                                   DEVICE                                   ##
+################################################################################
+
+class Device:
+
+  """
+  A simulated board: a thread running the application, driven by the virtual clock.
+  Only one device runs at a time, so the simulation is deterministic for a given seed.
+  """
+
+  def __init__(self, clock, name, target, *args):
+    self.clock = clock
+    self.name = name
+    self.radio = None
+    self.pins = {}
+
+    self.deadline = None   # ms, None while running
+    self.interrupted = False
+    self.scheduled = []
+    self.sched_lock = False
+    self.finished = False
+    self.error = None
+
+    self._go = threading.Semaphore(0)
+    self._thread = threading.Thread(target=self._run, args=(target, args), name=name, daemon=True)
+
+
+  def _run(self, target, args):
+    self._go.acquire()
+    try:
+      if not self.clock.ended:
+        target(*args)
+    except SimulationEnded:
+      pass
+    except BaseException as e:
+      self.error = e
+    self.finished = True
+    self.clock._back.release()
+
+
+  def ready(self, now):
+    if self.finished:
+      return False
+    return self.deadline is None or self.deadline <= now or self.interrupted
+
+
+  def resume(self):
+    # Run the device until it waits again
+    self.clock.current = self
+    self._go.release()
+    self.clock._back.acquire()
+    self.clock.current = None
+
+
+  def wait(self, duration, interruptible=False):
+    # Block the application for `duration` ms of virtual time, running the scheduled
+    # callbacks meanwhile. An interruptible wait returns on the next interrupt.
+    deadline = self.clock.now + duration
+    while True:
+      self.run_scheduled()
+      if self.clock.now >= deadline or (interruptible and self.interrupted):
+        self.interrupted = False
+        return
+
+      self.interrupted = False
+      self.deadline = deadline
+      self.clock._back.release()
+      self._go.acquire()
+      self.deadline = None
+      if self.clock.ended:
+        raise SimulationEnded()
+
+
+  def schedule(self, callback, argument):
+    if len(self.scheduled) >= SCHEDULE_DEPTH:
+      raise RuntimeError("schedule queue full")
+    self.scheduled.append((callback, argument))
+
+
+  def interrupt(self, pin):
+    # Call the handler of a pin, as the hardware interrupt would
+    handler = self.pins.get(pin)
+    if handler is None:
+      return
+    previous, self.clock.current = self.clock.current, self
+    try:
+      handler(pin)
+    finally:
+      self.clock.current = previous
+    self.interrupted = True
+
+
+  def run_scheduled(self):
+    # Scheduled callbacks don't nest, as in MicroPython
+    if self.sched_lock:
+      return
+    self.sched_lock = True
+    try:
+      while self.scheduled:
+        callback, argument = self.scheduled.pop(0)
+        callback(argument)
+    finally:
+      self.sched_lock = False
+
+
+
+################################################################################
+##                                    CLOCK                                   ##
+################################################################################
+
+class SimulationEnded(Exception):
+  pass
+
+
+class VirtualClock:
+
+  """
+  Discrete event clock shared by the devices and the radio channel.
+  Time only moves when every device is waiting, straight to the next event or deadline.
+  """
+
+  def __init__(self, seed=0):
+    self.now = 0 # ms
+    self.random = random.Random(seed)
+    self.devices = []
+    self.current = None
+    self.ended = False
+
+    self._events = []
+    self._sequence = 0
+    self._back = threading.Semaphore(0)
+
+
+  def add_device(self, name, target, *args):
+    device = Device(self, name, target, *args)
+    self.devices.append(device)
+    device._thread.start()
+    return device
+
+
+  def call_at(self, time, callback, *args):
+    self._sequence += 1
+    heapq.heappush(self._events, (time, self._sequence, callback, args))
+
+
+  def call_later(self, delay, callback, *args):
+    self.call_at(self.now + delay, callback, *args)
+
+
+  def run(self, until):
+    # Run the simulation for `until` ms of virtual time
+    while True:
+      ready = [device for device in self.devices if device.ready(self.now)]
+      if ready:
+        for device in ready:
+          device.resume()
+          if device.error is not None:
+            self.stop()
+            raise device.error
+        continue
+
+      deadlines = [device.deadline for device in self.devices if not device.finished]
+      if self._events:
+        deadlines.append(self._events[0][0])
+      if not deadlines or min(deadlines) > until:
+        break
+
+      self.now = min(deadlines)
+      while self._events and self._events[0][0] <= self.now:
+        _, _, callback, args = heapq.heappop(self._events)
+        callback(*args)
+
+    self.now = until
+    self.stop()
+
+
+  def stop(self):
+    # Unblock the waiting device threads, they end with SimulationEnded
+    self.ended = True
+    for device in self.devices:
+      if not device.finished:
+        device.resume()
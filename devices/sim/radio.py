@@ -0,0 +1,402 @@
+# SX127x (RFM95) model, only what `devices/lib/ulora.py` uses: the LoRa register set,
+# the FIFO, the operating modes and DIO0, on a shared channel with time-on-air,
+# path loss, collisions and random loss.
+
+
+
+################################################################################
+##                                  LIBRARIES                                 ##
+################################################################################
+
+################
+##  BUILT-IN  ##
+################
+
+import math
+
+
+
+################################################################################
+##                                  CONSTANTS                                 ##
+################################################################################
+
+# Registers
+REG_00_FIFO = 0x00
+REG_01_OP_MODE = 0x01
+REG_06_FRF_MSB = 0x06
+REG_09_PA_CONFIG = 0x09
+REG_0D_FIFO_ADDR_PTR = 0x0d
+REG_0E_FIFO_TX_BASE_ADDR = 0x0e
+REG_0F_FIFO_RX_BASE_ADDR = 0x0f
+REG_10_FIFO_RX_CURRENT_ADDR = 0x10
+REG_12_IRQ_FLAGS = 0x12
+REG_13_RX_NB_BYTES = 0x13
+REG_19_PKT_SNR_VALUE = 0x19
+REG_1A_PKT_RSSI_VALUE = 0x1a
+REG_1D_MODEM_CONFIG1 = 0x1d
+REG_1E_MODEM_CONFIG2 = 0x1e
+REG_20_PREAMBLE_MSB = 0x20
+REG_21_PREAMBLE_LSB = 0x21
+REG_22_PAYLOAD_LENGTH = 0x22
+REG_26_MODEM_CONFIG3 = 0x26
+REG_40_DIO_MAPPING1 = 0x40
+REG_4D_PA_DAC = 0x4d
+
+# Modes
+LONG_RANGE_MODE = 0x80
+MODE_SLEEP = 0x00
+MODE_STDBY = 0x01
+MODE_TX = 0x03
+MODE_RXCONTINUOUS = 0x05
+MODE_CAD = 0x07
+
+# IRQ flags
+RX_DONE = 0x40
+TX_DONE = 0x08
+CAD_DONE = 0x04
+CAD_DETECTED = 0x01
+
+# DIO0 mapping (bits 7-6 of DIO_MAPPING1) for each flag
+DIO0_RX_DONE = 0x00
+DIO0_TX_DONE = 0x40
+DIO0_CAD_DONE = 0x80
+
+FXOSC = 32000000.0
+FSTEP = FXOSC / 524288
+
+BANDWIDTHS = (7.8e3, 10.4e3, 15.6e3, 20.8e3, 31.25e3, 41.7e3, 62.5e3, 125e3, 250e3, 500e3) # Hz
+
+# Lowest SNR each spreading factor can demodulate (SX1276 datasheet), dB
+SNR_LIMITS = {6: -5.0, 7: -7.5, 8: -10.0, 9: -12.5, 10: -15.0, 11: -17.5, 12: -20.0}
+
+NOISE_FIGURE = 6 # dB
+CAPTURE_THRESHOLD = 6 # dB, a stronger packet survives a collision by this margin
+
+
+
+################################################################################
+##                                    RADIO                                   ##
+################################################################################
+
+class SX127x:
+
+  """
+  Register level model of a radio, attached to a device and a channel.
+  """
+
+  def __init__(self, channel, device, cs_pin, interrupt_pin, position=(0.0, 0.0)):
+    self.channel = channel
+    self.device = device
+    self.cs_pin = cs_pin
+    self.interrupt_pin = interrupt_pin
+    self.position = position
+
+    self.regs = bytearray(0x80)
+    self.fifo = bytearray(256)
+    self.regs[REG_01_OP_MODE] = MODE_STDBY
+    self.mode_since = 0
+
+    self._selected = False
+    self._address = None
+
+    self.transmitting = None
+
+    # Statistics
+    self.transmissions = 0
+    self.received = 0
+    self.collisions = 0
+    self.lost = 0
+    channel.radios.append(self)
+    device.radio = self
+
+
+  # SPI
+
+  def select(self, selected):
+    self._selected = selected
+    self._address = None
+
+
+  def transfer(self, data):
+    # Full duplex SPI transfer, the first byte of a transaction is the address
+    out = bytearray(len(data))
+    for i, byte in enumerate(data):
+      if self._address is None:
+        self._address = byte
+        continue
+
+      write = self._address & 0x80
+      register = self._address & 0x7f
+      if register == REG_00_FIFO:
+        pointer = self.regs[REG_0D_FIFO_ADDR_PTR]
+        if write:
+          self.fifo[pointer] = byte
+        else:
+          out[i] = self.fifo[pointer]
+        self.regs[REG_0D_FIFO_ADDR_PTR] = (pointer + 1) & 0xff
+        continue
+
+      if write:
+        self._write(register, byte)
+      else:
+        out[i] = self.regs[register]
+      # Burst access moves to the next register
+      self._address = (self._address & 0x80) | ((register + 1) & 0x7f)
+    return bytes(out)
+
+
+  def _write(self, register, value):
+    if register == REG_12_IRQ_FLAGS:
+      self.regs[register] &= ~value & 0xff
+    elif register == REG_01_OP_MODE:
+      self._set_mode(value)
+    else:
+      self.regs[register] = value
+
+
+  # Modes
+
+  @property
+  def mode(self):
+    return self.regs[REG_01_OP_MODE] & 0x07
+
+
+  def _set_mode(self, value):
+    # The LoRa bit only changes when going to or staying in sleep mode
+    current = self.regs[REG_01_OP_MODE]
+    lora = value & LONG_RANGE_MODE if (current & 0x07 == MODE_SLEEP or value & 0x07 == MODE_SLEEP) \
+      else current & LONG_RANGE_MODE
+    mode = value & 0x07
+
+    if self.mode == MODE_TX and mode != MODE_TX:
+      self.channel.abort(self)
+
+    if mode != self.mode:
+      self.mode_since = self.channel.clock.now
+    self.regs[REG_01_OP_MODE] = lora | mode
+
+    if mode == MODE_TX:
+      start = self.regs[REG_0E_FIFO_TX_BASE_ADDR]
+      length = self.regs[REG_22_PAYLOAD_LENGTH]
+      self.channel.transmit(self, bytes(self.fifo[start:start + length]))
+    elif mode == MODE_CAD:
+      self.channel.clock.call_later(2 * self.symbol_time(), self._cad_done)
+
+
+  def _raise(self, flags, mapping):
+    self.regs[REG_12_IRQ_FLAGS] |= flags
+    if self.regs[REG_40_DIO_MAPPING1] & 0xc0 == mapping:
+      self.device.interrupt(self.interrupt_pin)
+
+
+  def tx_done(self):
+    self.transmitting = None
+    self.regs[REG_01_OP_MODE] = (self.regs[REG_01_OP_MODE] & LONG_RANGE_MODE) | MODE_STDBY
+    self.mode_since = self.channel.clock.now
+    self._raise(TX_DONE, DIO0_TX_DONE)
+
+
+  def _cad_done(self):
+    if self.mode != MODE_CAD:
+      return
+    detected = self.channel.is_active(self)
+    self.regs[REG_01_OP_MODE] = (self.regs[REG_01_OP_MODE] & LONG_RANGE_MODE) | MODE_STDBY
+    self._raise(CAD_DONE | (CAD_DETECTED if detected else 0), DIO0_CAD_DONE)
+
+
+  def rx_done(self, payload, rssi, snr):
+    base = self.regs[REG_0F_FIFO_RX_BASE_ADDR]
+    for i, byte in enumerate(payload):
+      self.fifo[(base + i) & 0xff] = byte
+    self.regs[REG_10_FIFO_RX_CURRENT_ADDR] = base
+    self.regs[REG_13_RX_NB_BYTES] = len(payload)
+
+    # Inverse of the conversion done by the driver, the register saturates
+    self.regs[REG_19_PKT_SNR_VALUE] = max(-128, min(127, int(round(snr * 4)))) & 0xff
+    offset = 157 if self.frequency >= 779e6 else 164
+    raw = rssi + offset - snr if snr < 0 else (rssi + offset) * 15 / 16
+    self.regs[REG_1A_PKT_RSSI_VALUE] = max(0, min(255, int(round(raw))))
+
+    self._raise(RX_DONE, DIO0_RX_DONE)
+
+
+  # Modem settings
+
+  @property
+  def frequency(self):
+    frf = (self.regs[REG_06_FRF_MSB] << 16) | (self.regs[REG_06_FRF_MSB + 1] << 8) | self.regs[REG_06_FRF_MSB + 2]
+    return frf * FSTEP
+
+
+  @property
+  def bandwidth(self):
+    return BANDWIDTHS[min(self.regs[REG_1D_MODEM_CONFIG1] >> 4, len(BANDWIDTHS) - 1)]
+
+
+  @property
+  def spreading_factor(self):
+    return max(6, min(self.regs[REG_1E_MODEM_CONFIG2] >> 4, 12))
+
+
+  @property
+  def tx_power(self):
+    # dBm, as the driver computes the PA settings from it
+    boost = 3 if self.regs[REG_4D_PA_DAC] & 0x07 == 0x07 else 0
+    return (self.regs[REG_09_PA_CONFIG] & 0x0f) + 5 + boost
+
+
+  def symbol_time(self):
+    # ms
+    return 1000 * (1 << self.spreading_factor) / self.bandwidth
+
+
+  def time_on_air(self, length):
+    # ms, SX1276 datasheet section 4.1.1.7
+    config1 = self.regs[REG_1D_MODEM_CONFIG1]
+    sf = self.spreading_factor
+    coding_rate = (config1 >> 1) & 0x07
+    implicit = config1 & 0x01
+    crc = (self.regs[REG_1E_MODEM_CONFIG2] >> 2) & 0x01
+    low_rate = (self.regs[REG_26_MODEM_CONFIG3] >> 3) & 0x01
+    preamble = (self.regs[REG_20_PREAMBLE_MSB] << 8) | self.regs[REG_21_PREAMBLE_LSB]
+
+    symbols = math.ceil((8 * length - 4 * sf + 28 + 16 * crc - 20 * implicit) / (4 * (sf - 2 * low_rate)))
+    symbols = 8 + max(symbols * (coding_rate + 4), 0)
+    return (preamble + 4.25 + symbols) * self.symbol_time()
+
+
+
+################################################################################
+##                                   CHANNEL                                  ##
+################################################################################
+
+class Transmission:
+
+  def __init__(self, radio, payload, start, end):
+    self.radio = radio
+    self.payload = payload
+    self.start = start
+    self.end = end
+    self.frequency = radio.frequency
+    self.spreading_factor = radio.spreading_factor
+    self.bandwidth = radio.bandwidth
+    self.power = radio.tx_power
+
+
+class Channel:
+
+  """
+  Shared medium between the radios.
+
+  Parameters
+  ----------
+  clock : VirtualClock
+    The simulation clock.
+  loss : float
+    Probability of losing a packet that would otherwise be received.
+  path_loss_exponent : float
+    Exponent of the log-distance path loss model.
+  shadowing : float
+    Standard deviation of the per packet shadowing, in dB.
+  """
+
+  def __init__(self, clock, loss=0.0, path_loss_exponent=2.7, shadowing=3.0):
+    self.clock = clock
+    self.loss = loss
+    self.path_loss_exponent = path_loss_exponent
+    self.shadowing = shadowing
+
+    self.radios = []
+    self.active = []
+    self.recent = []
+
+    # Statistics
+    self.transmissions = 0
+    self.airtime = 0.0 # ms, summed over the radios
+
+
+  def path_loss(self, a, b):
+    # dB, log-distance model with 40 dB at 1 m (868/915 MHz)
+    distance = max(math.dist(a.position, b.position), 1.0)
+    return 40 + 10 * self.path_loss_exponent * math.log10(distance)
+
+
+  def transmit(self, radio, payload):
+    now = self.clock.now
+    transmission = Transmission(radio, payload, now, now + radio.time_on_air(len(payload)))
+    radio.transmitting = transmission
+    radio.transmissions += 1
+    self.active.append(transmission)
+    self.transmissions += 1
+    self.clock.call_at(transmission.end, self._end, transmission)
+
+
+  def abort(self, radio):
+    transmission = radio.transmitting
+    if transmission is not None and transmission in self.active:
+      self.active.remove(transmission)
+      transmission.end = self.clock.now
+      self.recent.append(transmission)
+    radio.transmitting = None
+
+
+  def is_active(self, listener):
+    # Channel activity detection: a transmission with the same settings is heard
+    return any(
+      t.radio is not listener and self._compatible(t, listener) and self._snr(t, listener)[1] >= SNR_LIMITS[t.spreading_factor]
+      for t in self.active
+    )
+
+
+  def _compatible(self, transmission, radio):
+    return abs(transmission.frequency - radio.frequency) < radio.bandwidth / 2 and \
+      transmission.spreading_factor == radio.spreading_factor and transmission.bandwidth == radio.bandwidth
+
+
+  def _snr(self, transmission, radio, shadowing=0.0):
+    rssi = transmission.power - self.path_loss(transmission.radio, radio) + shadowing
+    noise = -174 + 10 * math.log10(transmission.bandwidth) + NOISE_FIGURE
+    return rssi, rssi - noise
+
+
+  def _end(self, transmission):
+    if transmission not in self.active:
+      return # Aborted
+    self.active.remove(transmission)
+    self.recent.append(transmission)
+    self.airtime += transmission.end - transmission.start
+
+    radio = transmission.radio
+    radio.tx_done()
+
+    # Overlapping transmissions, kept until nothing can overlap them anymore
+    overlapping = [
+      t for t in self.active + self.recent
+      if t is not transmission and t.start < transmission.end and t.end > transmission.start
+    ]
+    oldest = min((t.start for t in self.active), default=self.clock.now)
+    self.recent = [t for t in self.recent if t.end > oldest]
+
+    for receiver in self.radios:
+      if receiver is radio or receiver.mode != MODE_RXCONTINUOUS or receiver.mode_since > transmission.start:
+        continue
+      if not self._compatible(transmission, receiver):
+        continue
+
+      rssi, snr = self._snr(transmission, receiver, self.clock.random.gauss(0, self.shadowing))
+      if snr < SNR_LIMITS[transmission.spreading_factor]:
+        receiver.lost += 1
+        continue
+
+      # A packet survives a collision only if it is much stronger than the others
+      interferers = [t for t in overlapping if t.radio is not receiver and self._compatible(t, receiver)]
+      if any(self._snr(t, receiver)[0] > rssi - CAPTURE_THRESHOLD for t in interferers):
+        receiver.collisions += 1
+        continue
+
+      if self.clock.random.random() < self.loss:
+        receiver.lost += 1
+        continue
+
+      receiver.received += 1
+      receiver.rx_done(transmission.payload, round(rssi, 2), round(max(snr, -32), 2))
@@ -0,0 +1,188 @@
+# Host replacements for the MicroPython modules used by the device libraries:
+# `machine`, `micropython`, `utime`, `urandom` and `ucollections`. They act on the
+# device that is currently running in the virtual clock.
+
+
+
+################################################################################
+##                                  LIBRARIES                                 ##
+################################################################################
+
+################
+##  BUILT-IN  ##
+################
+
+from collections import namedtuple
+import importlib
+import sys
+import types
+
+
+################
+##  INTERNAL  ##
+################
+
+from .clock import IDLE_QUANTUM
+
+
+
+################################################################################
+##                                  CONSTANTS                                 ##
+################################################################################
+
+TICKS_PERIOD = 1 << 30
+TICKS_MAX = TICKS_PERIOD - 1
+TICKS_HALFPERIOD = TICKS_PERIOD // 2
+
+EPOCH_START = 1700000000 # Unix time of the start of the simulation
+
+
+
+################################################################################
+##                                   MACHINE                                  ##
+################################################################################
+
+def _machine(clock):
+
+  class Pin:
+    IN = 0
+    OUT = 1
+    PULL_DOWN = 2
+    IRQ_RISING = 1
+
+    def __init__(self, id, mode=-1, pull=-1):
+      self.id = id
+      self.device = clock.current
+
+    def irq(self, trigger=None, handler=None, hard=False):
+      self.device.pins[self.id] = handler
+
+    def value(self, value=None):
+      # Only the chip select of the radio is wired
+      radio = self.device.radio
+      if value is not None and radio is not None and self.id == radio.cs_pin:
+        radio.select(value == 0)
+      return 0
+
+  class SPI:
+    def __init__(self, id, baudrate=1000000, **kwargs):
+      self.radio = clock.current.radio
+
+    def write(self, buffer):
+      self.radio.transfer(bytes(buffer))
+
+    def read(self, nbytes, write=0x00):
+      return self.radio.transfer(bytes((write,)) * nbytes)
+
+    def readinto(self, buffer, write=0x00):
+      buffer[:] = self.radio.transfer(bytes((write,)) * len(buffer))
+
+    def write_readinto(self, write_buffer, read_buffer):
+      read_buffer[:] = self.radio.transfer(bytes(write_buffer))
+
+    def deinit(self):
+      pass
+
+  def idle():
+    clock.current.wait(IDLE_QUANTUM, interruptible=True)
+
+  def lightsleep(time_ms=None):
+    clock.current.wait(time_ms, interruptible=False)
+
+  def disable_irq():
+    return 0
+
+  def enable_irq(state):
+    pass
+
+  module = types.ModuleType("machine")
+  module.Pin = Pin
+  module.SPI = SPI
+  module.idle = idle
+  module.lightsleep = lightsleep
+  module.disable_irq = disable_irq
+  module.enable_irq = enable_irq
+  return module
+
+
+
+################################################################################
+##                                    UTIME                                   ##
+################################################################################
+
+def _utime(clock):
+
+  def ticks_ms():
+    return int(clock.now) & TICKS_MAX
+
+  def ticks_add(ticks, delta):
+    return (ticks + delta) & TICKS_MAX
+
+  def ticks_diff(ticks1, ticks2):
+    return ((ticks1 - ticks2 + TICKS_HALFPERIOD) & TICKS_MAX) - TICKS_HALFPERIOD
+
+  def time():
+    return EPOCH_START + int(clock.now) // 1000
+
+  def sleep_ms(ms):
+    clock.current.wait(ms)
+
+  def sleep(seconds):
+    clock.current.wait(seconds * 1000)
+
+  module = types.ModuleType("utime")
+  module.ticks_ms = ticks_ms
+  module.ticks_add = ticks_add
+  module.ticks_diff = ticks_diff
+  module.time = time
+  module.sleep_ms = sleep_ms
+  module.sleep = sleep
+  return module
+
+
+
+################################################################################
+##                                   INSTALL                                  ##
+################################################################################
+
+def install(clock):
+
+  """
+  Replace the MicroPython modules and load the device libraries on top of them.
+
+  Parameters
+  ----------
+  clock : VirtualClock
+    The clock that drives the simulated devices.
+
+  Returns
+  -------
+  tuple
+    The `ulora` driver and the `adr` module, bound to the clock.
+  """
+
+  micropython = types.ModuleType("micropython")
+  micropython.schedule = lambda callback, argument: clock.current.schedule(callback, argument)
+
+  urandom = types.ModuleType("urandom")
+  urandom.getrandbits = clock.random.getrandbits
+
+  ucollections = types.ModuleType("ucollections")
+  ucollections.namedtuple = namedtuple
+
+  utime = _utime(clock)
+  sys.modules.update(
+    machine=_machine(clock),
+    micropython=micropython,
+    utime=utime,
+    urandom=urandom,
+    ucollections=ucollections,
+  )
+
+  # The driver imports `time`, which must stay the host module for everything else.
+  # Reloading binds the names it imported from the stubs of this clock.
+  from ..lib import adr, ulora
+  ulora = importlib.reload(ulora)
+  ulora.time = utime
+  adr = importlib.reload(adr)
+  return ulora, adr
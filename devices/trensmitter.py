@@ -21,11 +21,14 @@
 ##  BUILT-IN  ##
 ################
 
-from utime import sleep, localtime
-from ntptime import settime
+from utime import gmtime, localtime, ticks_add, ticks_diff, ticks_ms
+from machine import RTC, unique_id
+from ubinascii import hexlify
+import uasyncio as asyncio
+import usocket as socket
+import ustruct as struct
 import network
 import json
-import urequests
 
 
 ###############
@@ -33,6 +36,10 @@ import urequests
 ###############
 
 from .lib.ulora import LoRa
+from .lib.adr import LinkAdapter
+from .lib.ringbuffer import RingBuffer
+from .lib.keepalive import AsyncKeepAliveClient
+from .lib import frame, link, record
 
 
 
@@ -42,9 +49,36 @@ from .lib.ulora import LoRa
 
 from .config.wifi_credentials import WIFI_CREDENTIALS
 from .config.lora_parameters import *
-from .config.api import POST_RECEPTOR_STATUS, POST_COLLECTOR_RECORD
+from .config.api import POST_RECEPTOR_STATUS, POST_COLLECTOR_RECORD_BINARY, POST_COLLECTOR_LINK_BINARY
 
-SLEEP_TIME = 60 # seconds
+# Task intervals
+STATUS_INTERVAL = 60 # seconds
+UPLOAD_INTERVAL = 30 # seconds, uploads also start as soon as a batch is full
+NTP_INTERVAL = 6 * 3600 # seconds, the RTC drifts slowly
+NTP_RETRY = 30 # seconds, until the first successful sync
+NTP_HOST = "pool.ntp.org"
+NTP_TIMEOUT = 1000 # milliseconds to wait for the answer of the NTP server
+WIFI_CHECK_INTERVAL = 5 # seconds
+WIFI_TIMEOUT = 20 # seconds to wait for a connection before trying again
+ADR_INTERVAL = 1 # seconds, the data rate switches at the time announced to the collectors
+
+# Packets queued by the radio driver, waiting to be stored in the buffer
+PACKET_QUEUE_SIZE = 32
+
+# Store-and-forward buffer
+BUFFER_PATH = "records.bin"
+BUFFER_CAPACITY = 4096 # records, about 40 kB of flash
+LINK_BUFFER_PATH = "links.bin"
+LINK_BUFFER_CAPACITY = 1024 # link records, about 12 kB of flash, uploaded after the readings
+BATCH_SIZE = 32 # records per upload
+PIPELINE_DEPTH = 4 # batches sent back to back on the same connection
+MAX_RETRY_AFTER = 600 # seconds, longest pause of the uploads asked by the API
+
+# Seconds between the MicroPython epoch (2000 on some ports) and the Unix epoch
+EPOCH_OFFSET = 0 if localtime(0)[0] == 1970 else 946684800
+
+# Seconds between the NTP epoch (1900) and the MicroPython epoch
+NTP_DELTA = 2208988800 + EPOCH_OFFSET
 
 
 
@@ -55,7 +89,30 @@ SLEEP_TIME = 60 # seconds
 # Wifi connections
 wifi = network.WLAN(network.STA_IF)
 wifi.active(True)
-wifi.connect(WIFI_CREDENTIALS["ssid"], WIFI_CREDENTIALS["password"])
+
+# Store-and-forward buffer, survives Wi-Fi outages and reboots
+# The records are stored in the same packed format they are uploaded in
+buffer = RingBuffer(BUFFER_PATH, record.RECORD_SIZE, BUFFER_CAPACITY)
+# Radio telemetry of every packet, for the fleet health of the API
+link_buffer = RingBuffer(LINK_BUFFER_PATH, link.LINK_SIZE, LINK_BUFFER_CAPACITY)
+
+# HTTP client, keeps the connection to the API open between requests. The API
+# rate limits the uploads of every receptor by its ID. It runs on uasyncio streams,
+# the radio tasks keep running while a request waits on the network.
+http = AsyncKeepAliveClient(headers={"X-Receptor-Id": hexlify(unique_id()).decode()})
+
+# Address of the NTP server, resolved once (name resolution blocks)
+ntp_address = None
+
+# Ticks before which the API asked not to upload, None when it did not
+upload_after = None
+
+# Set once the clock is synchronized by NTP, older timestamps are unreliable
+time_synced = False
+
+# Events between the tasks
+packet_received = asyncio.ThreadSafeFlag()
+batch_ready = asyncio.Event()
 
 # LoRa initialisation
 lora = LoRa(
@@ -66,18 +123,22 @@ lora = LoRa(
   reset_pin=RFM95_RST,
   freq=RF95_FREQ,
   tx_power=RF95_POW,
-  acks=ACKS
+  acks=ACKS,
+  rx_queue_size=PACKET_QUEUE_SIZE
 )
 
+# Adaptive data rate, the ACKs tell every collector its data rate and transmit power
+adapter = LinkAdapter(lora)
+
 
 
 ################################################################################
 ##                                  FUNCTIONS                                 ##
 ################################################################################
 
-# Format the local time to a string (RFC 3339)
-def format_local_time() -> str:
-  current_time = localtime()
+# Format a Unix timestamp (default: now) to a string (RFC 3339)
+def format_time(timestamp=None) -> str:
+  current_time = localtime(None if timestamp is None else timestamp - EPOCH_OFFSET)
   # Format the time to RFC 3339
   # YEAR"-"MONTH"-"DAY"T"HOUR":"MINUTE":"SECOND"Z"
   timestamp = "{}-{:02d}-{:02d}T{:02d}:{:02d}:{:02d}Z".format(
@@ -87,68 +148,237 @@ def format_local_time() -> str:
   return timestamp
 
 
-# This is our callback function that runs when a message is received
+# This is our callback function that runs when a message is received.
+# The driver already queued the packet, so it only wakes `store_packets` up.
 def on_recv(message) -> None:
+  packet_received.set()
 
-  # Format the body of the request
-  data = dict(
-    collection_date = format_local_time(),
-    read_humidity = message.message,
-  )
 
-  # Send the request
-  r = urequests.post(
-    url=POST_COLLECTOR_RECORD.format(message.header_from), 
-    data=json.dumps(data)
-  )
-  
-  # Print the response
-  print(r.json())
+# Upload up to PIPELINE_DEPTH batches of a buffer to `url`, returns True if the buffer can move on
+async def upload_batches(buffer, url) -> bool:
+  global upload_after
+
+  # The buffered records are already in the wire format, send them as they are
+  data = buffer.peek(BATCH_SIZE * PIPELINE_DEPTH)
+  batch_bytes = BATCH_SIZE * buffer.record_size
+  batches = [data[offset:offset + batch_bytes] for offset in range(0, len(data), batch_bytes)]
+
+  # Send the requests on the same connection, keep the records on network failures
+  try:
+    responses = await http.post_many(
+      [(url, batch) for batch in batches],
+      content_type="application/octet-stream"
+    )
+  except OSError as e:
+    print("Upload failed:", e)
+    return False
+
+  for batch, (status, _) in zip(batches, responses):
+    print("Uploaded {} records: {}".format(len(batch) // buffer.record_size, status))
+
+    # Keep the records on server failures. Client errors would fail forever,
+    # drop the batch instead of blocking the buffer.
+    if status >= 300 and (status >= 500 or status in (408, 429)):
+      # The API sheds load with a Retry-After, the records wait in the buffer until then
+      if http.retry_after:
+        upload_after = ticks_add(ticks_ms(), min(http.retry_after, MAX_RETRY_AFTER) * 1000)
+      return False
+
+    # Duplicates are ignored by the API, so removing only now is safe
+    buffer.pop(len(batch) // buffer.record_size)
+
+  return True
 
 
 # Update the status of the receptor
-def update_status() -> None:
+async def update_status() -> None:
 
   # Format the body of the request
   data = dict(
-    update_date = format_local_time(),
-    records_in_buffer = 0,# Dummy value for now
+    update_date = format_time(),
+    records_in_buffer = len(buffer),
   )
 
   # Send the request
-  r = urequests.post(
-    url=POST_RECEPTOR_STATUS, 
-    data=json.dumps(data)
-  )
-  
+  status, response = await http.post(POST_RECEPTOR_STATUS, json.dumps(data))
+
   # Print the response
-  print(r.json())
+  print(status, response)
+
+
+# Set the RTC from an NTP server (SNTP), like ntptime.settime but without blocking
+# the other tasks while the answer is on its way
+async def set_time() -> None:
+  global ntp_address
+
+  if ntp_address is None:
+    ntp_address = socket.getaddrinfo(NTP_HOST, 123)[0][-1]
+
+  query = bytearray(48)
+  query[0] = 0x1B # Version 3, client mode
+  sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+  try:
+    sock.setblocking(False)
+    sock.sendto(query, ntp_address)
+
+    deadline = ticks_add(ticks_ms(), NTP_TIMEOUT)
+    while True:
+      try:
+        answer = sock.recv(48)
+        break
+      except OSError:
+        if ticks_diff(deadline, ticks_ms()) <= 0:
+          # The server may have moved, resolve its name again on the next attempt
+          ntp_address = None
+          raise OSError("NTP timeout")
+        await asyncio.sleep_ms(50)
+  finally:
+    sock.close()
+
+  # Transmit timestamp, whole seconds
+  now = gmtime(struct.unpack("!I", answer[40:44])[0] - NTP_DELTA)
+  RTC().datetime((now[0], now[1], now[2], now[6] + 1, now[3], now[4], now[5], 0))
 
 
 
 ################################################################################
-##                                    MAIN                                    ##
+##                                    TASKS                                   ##
 ################################################################################
 
-# Set callback
-lora.on_recv = on_recv
+# Move the received packets from the queue to the flash buffer
+async def store_packets():
+  while True:
+    await packet_received.wait()
+
+    while True:
+      packet = lora.receive()
+      if packet is None:
+        break
+      header_from, message = packet.header_from, packet.message
+      epoch = packet.timestamp + EPOCH_OFFSET
+
+      # A frame carries several readings dated by their age, older collectors send
+      # a single reading as plain text
+      try:
+        if frame.is_frame(message):
+          readings = frame.decode(message)
+        else:
+          readings = [(0, int(message))]
+      except (ValueError, IndexError):
+        print("Invalid message from {}: {}".format(header_from, message))
+        continue
+
+      flags = 0 if time_synced else record.FLAG_TIME_UNSYNCED
+      for age, reading in readings:
+        buffer.push(record.pack(header_from, epoch - age, reading, flags))
+
+      # Retransmissions dropped by the driver since the previous packet of the collector
+      duplicates = lora.duplicates[header_from]
+      lora.duplicates[header_from] = 0
+      link_buffer.push(link.pack(header_from, epoch, packet.rssi, packet.snr, packet.header_id, duplicates, flags))
+
+    if len(buffer) >= BATCH_SIZE:
+      batch_ready.set()
+
+
+# Drain the buffers in batches, when a batch is full or every UPLOAD_INTERVAL.
+# The link telemetry only goes once the readings are uploaded.
+async def upload_records():
+  while True:
+    try:
+      await asyncio.wait_for(batch_ready.wait(), UPLOAD_INTERVAL)
+    except asyncio.TimeoutError:
+      pass
+    batch_ready.clear()
+
+    # Honor the Retry-After of the API, the buffer keeps filling meanwhile
+    if upload_after is not None:
+      wait = ticks_diff(upload_after, ticks_ms())
+      if wait > 0:
+        await asyncio.sleep_ms(wait)
+
+    while len(buffer) and wifi.isconnected() and await upload_batches(buffer, POST_COLLECTOR_RECORD_BINARY):
+      # Let the other tasks run between batches
+      await asyncio.sleep(0)
+
+    while not len(buffer) and len(link_buffer) and wifi.isconnected() and await upload_batches(link_buffer, POST_COLLECTOR_LINK_BINARY):
+      await asyncio.sleep(0)
+
+
+# Report the status of the receptor
+async def report_status():
+  while True:
+    if wifi.isconnected():
+      try:
+        await update_status()
+      except OSError as e:
+        print("Status update failed:", e)
+    await asyncio.sleep(STATUS_INTERVAL)
+
+
+# Sincroniza o RTC do microcontrolador com o servidor NTP
+async def sync_time():
+  global time_synced
+
+  while True:
+    if wifi.isconnected():
+      try:
+        await set_time()
+        time_synced = True
+        await asyncio.sleep(NTP_INTERVAL)
+        continue
+      except OSError as e:
+        print("NTP sync failed:", e)
+    await asyncio.sleep(NTP_RETRY)
+
+
+# Switch the radio to the data rate announced to the collectors
+async def adapt_data_rate():
+  while True:
+    adapter.poll()
+    await asyncio.sleep(ADR_INTERVAL)
+
+
+# Keep the receptor connected to the internet
+async def keep_wifi():
+  while True:
+    if not wifi.isconnected():
+      print('Connecting to the internet...')
+      http.close()
+      try:
+        wifi.connect(WIFI_CREDENTIALS["ssid"], WIFI_CREDENTIALS["password"])
+      except OSError as e:
+        print("Wi-Fi connection failed:", e)
+
+      for _ in range(WIFI_TIMEOUT):
+        if wifi.isconnected():
+          break
+        await asyncio.sleep(1)
+
+    await asyncio.sleep(WIFI_CHECK_INTERVAL)
 
-# Set to listen continuously
-lora.set_mode_rx()
 
-while True:
 
-  # Check if the receptor is connected to the internet
-  if not wifi.isconnected():
-    print('Connecting to the internet...')
-    while not wifi.isconnected():
-      sleep(1)
+################################################################################
+##                                    MAIN                                    ##
+################################################################################
 
-  # Sincroniza o RTC do microcontrolador com o servidor NTP
-  settime()
+async def main():
+
+  # Set callback
+  lora.on_recv = on_recv
+
+  # Set to listen continuously
+  lora.set_mode_rx()
+
+  await asyncio.gather(
+    keep_wifi(),
+    sync_time(),
+    store_packets(),
+    upload_records(),
+    report_status(),
+    adapt_data_rate(),
+  )
 
-  # Update the status of the receptor
-  update_status()
 
-  # Sleep for a while
-  sleep(SLEEP_TIME)
\ No newline at end of file
+asyncio.run(main())
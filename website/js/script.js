@@ -2,13 +2,21 @@
 var base_url = 'https://655735yxlatbe5ywa5hbmdutpi0bjxlt.lambda-url.us-east-1.on.aws';
 
 
-// Get the collector humidity data from the API
-async function getCollectorHumidity(collector_id, limit = 100) {
-  const response = await fetch(`${base_url}/collector/${collector_id}/calculated_humidity?limit=${limit}`);
+// Collectors shown on the dashboard
+var collector_ids = [1];
+
+
+// Get the humidity data of several collectors from the API, aligned on a shared time axis
+async function getCollectorsSeries(collector_ids, hours = 24, resolution = 600) {
+  const end = new Date();
+  const start = new Date(end.getTime() - hours * 3600 * 1000);
+  const params = new URLSearchParams({ start: start.toISOString(), end: end.toISOString(), resolution: resolution });
+  collector_ids.forEach(collector_id => params.append('collector_id', collector_id));
+  const response = await fetch(`${base_url}/collector/series?${params}`);
   const data = await response.json();
   return {
-    labels: data.data.map(record => new Date(record.calculation_date).toLocaleDateString('pt-BR', { month:"numeric", day:"numeric", hour:"numeric", minute:"numeric", seconds:"numeric"})),
-    data: data.data.map(record => record.humidity_percentage),
+    labels: data.timestamps.map(timestamp => new Date(timestamp).toLocaleDateString('pt-BR', { month:"numeric", day:"numeric", hour:"numeric", minute:"numeric", seconds:"numeric"})),
+    datasets: data.series.map(series => ({ label: `${series.collector_id}`, data: series.data })),
   }
 }
 
@@ -18,10 +26,7 @@ var myChart = new Chart(ctx, {
   type: 'line',
   data: {
     labels: [],
-    datasets: [{
-      label: '1',
-      data: [],
-    }]
+    datasets: []
   },
   options: {
     maintainAspectRatio: false,
@@ -61,27 +66,14 @@ var myChart = new Chart(ctx, {
   }
 });
 
-// Initialize the chart
-async function createChart(collector_id) {
-  const data = await getCollectorHumidity(collector_id);
-  // revert the order of the data
-  myChart.data.labels = data.labels.reverse();
-  myChart.data.datasets[0].data = data.data.reverse();
-  myChart.update();
-}
-
-// Update the chart
-async function updateChart(collector_id) {
-  const data = await getCollectorHumidity(collector_id, limit = 1);
-  // if last label is the same as the new one, skip the update
-  if (myChart.data.labels[myChart.data.labels.length - 1] === data.labels[0]) return;
-  myChart.data.labels.push(data.labels[0]);
-  myChart.data.labels.shift();
-  myChart.data.datasets[0].data.push(data.data[0]);
-  myChart.data.datasets[0].data.shift();
+// Load the whole field with a single request
+async function updateChart(collector_ids) {
+  const data = await getCollectorsSeries(collector_ids);
+  myChart.data.labels = data.labels;
+  myChart.data.datasets = data.datasets;
   myChart.update();
 }
 
-// Create the chart and update it every 10 seconds
-createChart(1);
-setInterval(() => {updateChart(1)}, 10000);
+// Create the chart and update it every 60 seconds
+updateChart(collector_ids);
+setInterval(() => {updateChart(collector_ids)}, 60000);